@@ -1,17 +1,48 @@
-import requests
 import json
-from bs4 import BeautifulSoup
 import re
+import requests
 import os
 import time
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.http import get_client, HttpClient
+from common.archive import PageArchive
+from common.parser import make_soup, configure_parser, get_parser
+from common.pipeline import FetchParsePipeline
+from common.metrics import crawl_metrics
+from common.corpus import ShardedJsonlWriter, read_corpus, read_shards
+from common.app_ids import android_app_id, canonical_android_url
+from common.visited import VisitedSet, BloomFilter
+from common.deadletter import DeadLetterQueue
+from common.ratelimit import RETRY_STATUSES
+from common.refresh import RefreshStore, label_hash
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from datasafety import parse_data_safety
+from android import iter_all_pages
+import queue
+import threading
+from bs4 import SoupStrainer
+
+
+# compact labels of an app whose developer declared nothing, its data safety page has no sections
+NO_DATA_SAFETY_LABELS = {"No information available"}
+
+# the elements holding the compact labels, see AndroidScraper.scrape_compact_labels
+COMPACT_LABEL_STRAINER = SoupStrainer('div', {'class': "wGcURe"})
 
 
 class AndroidScraper:
-    def __init__(self, compact_url):
+    def __init__(self, compact_url, http_client=None):
         self.compact_url = compact_url
+        # pooled keep-alive connections shared with every other scraper unless a client is given
+        self.http = http_client if http_client is not None else get_client()
         self.header = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 12_2_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.5735.106 Safari/537.36"
             }
+        # determine expanded label url
+        self.expanded_url = "datasafety?".join(compact_url.split("details?"))
         self.expanded_dict = {}
         self.compact_dict = {}
         self.info_collection = {
@@ -27,72 +58,60 @@ class AndroidScraper:
             "Price": ""
             }
         self.all_data = {}
+        self.pages = {}
+
+
+    # fetches and parses a page once, every extractor reuses the cached soup
+    def get_page(self, url):
+        if url not in self.pages:
+            res = self.http.get(url, headers=self.header)
+            # a page still throttled after every retry fails the app, so it is retried later instead of saved empty
+            if res.status_code in RETRY_STATUSES:
+                raise requests.HTTPError(f"status code {res.status_code} for {url}", response=res)
+            self.pages[url] = make_soup(res.text)
+        return self.pages[url]
 
 
     # scrapes all desired app data
     def scrape_data(self):
-        # scrapes expanded label info
-        # determine expanded label url
-        expanded = self.compact_url.split("details?")
-        expanded_url = "datasafety?".join(expanded)
-
-        res = requests.get(expanded_url, headers=self.header)
-        soup = BeautifulSoup(res.text, 'html.parser')
+        # the details page is fetched once and shared by the compact label and app info extractors
+        compact_soup = self.get_page(self.compact_url)
+        # the compact labels may already be scraped, e.g. by the fetch stage or a refresh comparing their hash
+        if not self.compact_dict:
+            self.scrape_compact_labels(compact_soup)
+        # the data safety page is only fetched when the compact labels do not already prove it empty
+        if self.needs_data_safety():
+            self.scrape_expanded_labels(self.get_page(self.expanded_url))
+        else:
+            crawl_metrics.count("expanded_labels_skipped")
+        self.scrape_appinfo(compact_soup)
 
-        data_collection = soup.find_all('h2', {'class': "q1rIdc"})
+        # combines all data collections into one dictionary
+        self.all_data = {**self.info_collection, **self.compact_dict, **self.expanded_dict}
 
-        for elem in data_collection:
-            y = elem.find_next_sibling('div', {'class': "XgPdwe"})
 
-            h3_elements = y.find_all('h3', {'class': "aFEzEb"})
-            h4_elements = y.find_all('h4', {'class': "pcmFvf"})
-            purposes_elements = y.find_all('div', {'class': "FnWDne"})
+    # whether the data safety page can hold anything the compact labels do not show. apps that declare they
+    # share and collect no data still list their security practices there, so only undeclared apps are skipped
+    def needs_data_safety(self):
+        return not self.compact_dict or not set(self.compact_dict) <= NO_DATA_SAFETY_LABELS
 
-            sub_dict = {}
 
-            for h3_elem in h3_elements:
-                h3_text = h3_elem.text
+    # scrapes expanded label info
+    def scrape_expanded_labels(self, soup):
+        # accounting for data types ending in " · Optional"
+        data_safety = parse_data_safety(soup, strip_optional=True)
 
-                # accounting for no purposes associated with security practices
-                if elem.text == "Security practices":
-                    data_items = {}
+        for section, sub_dict in data_safety.items():
+            # accounting for no purposes associated with security practices
+            if section == "Security practices":
+                for h3_text in sub_dict:
                     sub_dict[h3_text] = None
-                
-                # all other data type categories
-                else:
-                    h4_texts = []
-                    h4_texts_temp = []
-                    purposes_texts = []
-
-                    # accounting for data types ending in " · Optional"
-                    for h4_elem, purposes_elem in zip(h4_elements, purposes_elements):
-                        if h4_elem.find_previous('h3') == h3_elem:
-                            h4_texts_temp.append(h4_elem.text)
-                            for type_text in h4_texts_temp:
-                                if len(type_text) >= 12 and type_text[-10] == "·":
-                                    type_text = type_text[0:-11]
-                                    h4_texts.append(type_text)
-                                else:
-                                    h4_texts.append(type_text)
-
-                            purposes_texts.append(purposes_elem.text)
-
-                    # removes duplicates from list
-                    h4_texts = list(dict.fromkeys(h4_texts))
 
-                    data_items = {}
-                    for data, purpose in zip(h4_texts, purposes_texts):
-                        data_items[data] = [purpose]
+            self.expanded_dict[section] = sub_dict
 
-                    sub_dict[h3_text] = data_items
-
-            self.expanded_dict[elem.text] = sub_dict
-
-
-        # scrapes compact label info
-        res = requests.get(self.compact_url, headers=self.header)
-        soup = BeautifulSoup(res.text, 'html.parser')
 
+    # scrapes compact label info
+    def scrape_compact_labels(self, soup):
         # find compact label info
         raw_data = soup.find_all('div', {'class': "wGcURe"})
         for elem in raw_data:
@@ -105,10 +124,16 @@ class AndroidScraper:
                 self.compact_dict[compact_list[0]] = None
 
 
-        # scrapes a lot of app info
-        res = requests.get(self.compact_url, headers=self.header)
-        soup = BeautifulSoup(res.text, 'html.parser')
+    # finds the links to other apps on the details page (similar apps, more by the developer),
+    # reusing the already fetched page
+    def similar_app_links(self):
+        soup = self.get_page(self.compact_url)
+        links = soup.find_all('a', {'href': re.compile(r"^/store/apps/details\?id=")})
+        return ["https://play.google.com" + link['href'] for link in links]
+
 
+    # scrapes a lot of app info
+    def scrape_appinfo(self, soup):
         # find app name
         name_data = soup.find('h1', {'itemprop': "name"})
         app_name = name_data.text
@@ -197,9 +222,6 @@ class AndroidScraper:
         else:
             app_price = "$" + price_data_list[1] + ".00"
             self.info_collection["Price"] = app_price
-
-        # combines all data collections into one dictionary
-        self.all_data = {**self.info_collection, **self.compact_dict, **self.expanded_dict}
     
 
     def write_to_json(self):
@@ -207,34 +229,398 @@ class AndroidScraper:
         Writes all the scraped and computed data to a JSON file.
         No parameters or return values.
         """
-        directory_path = 'json_android_files'
-        if not os.path.exists(directory_path):
-            os.makedirs(directory_path)
-
-        file_path = os.path.join(directory_path, str(self.info_collection['App ID']) + '.json')
-
+        write_app_json(self.all_data)
+
+
+# writer of the sharded corpus, apps are written to one JSON file each while it is None
+corpus_writer = None
+
+
+# writes every app to compressed JSONL shards instead of one JSON file per app,
+# the last shard is only complete once close_corpus is called
+def configure_corpus(directory="json_android_files", **kwargs):
+    global corpus_writer
+    corpus_writer = ShardedJsonlWriter(directory, **kwargs)
+    return corpus_writer
+
+
+# makes the apps written to the corpus so far durable, called before crawl state that marks apps as done
+# is committed, so no app is marked done but lost
+def sync_corpus():
+    if corpus_writer is not None:
+        corpus_writer.sync()
+
+
+def close_corpus():
+    global corpus_writer
+    if corpus_writer is not None:
+        corpus_writer.close()
+        corpus_writer = None
+
+
+# keys of AndroidScraper.info_collection, the other keys of an app's data are compact labels and data safety sections
+APP_INFO_FIELDS = ["App name", "App category", "URL", "App ID", "Average rating", "Total reviews",
+                   "Contains ads", "In-app purchases", "Downloads", "Price"]
+
+
+# flattens an app's data for the Parquet export (common.corpus.export_parquet) into the app info
+# as one row and one row per compact label and data type
+def flatten_app(all_data):
+    app_id = all_data.get("App ID")
+    app_row = {}
+    labels = []
+    for key, value in all_data.items():
+        if key in APP_INFO_FIELDS:
+            app_row[key] = value
+        elif isinstance(value, dict):
+            for category, types in value.items():
+                # security practices have no data types
+                if not types:
+                    labels.append({"app_id": app_id, "label": "expanded", "section": key, "purpose": None,
+                                   "category": category, "data_type": None})
+                    continue
+                for data_type, purposes in types.items():
+                    for purpose in purposes or [None]:
+                        labels.append({"app_id": app_id, "label": "expanded", "section": key, "purpose": purpose,
+                                       "category": category, "data_type": data_type})
+        else:
+            labels.append({"app_id": app_id, "label": "compact", "section": key, "purpose": None,
+                           "category": value, "data_type": None})
+    return (app_row, labels)
+
+
+# the compact labels of an app's saved data, every value that is neither app info nor an expanded label section
+def compact_labels(all_data):
+    return {key: value for key, value in all_data.items() if key not in APP_INFO_FIELDS and not isinstance(value, dict)}
+
+
+# checks an app for changed labels at a fraction of the cost of scraping it again: the details page is
+# requested with the validators of the last check and only its compact labels are parsed. the data safety
+# page and the JSON rewrite are skipped on a 304 or when the compact labels hash the same as last time.
+# returns True if the labels changed and the app was saved again
+def refresh_app(url, store, http_client=None):
+    app = AndroidScraper(url, http_client=http_client)
+    app_key = android_app_id(url)
+    res = app.http.get(app.compact_url, headers={**app.header, **store.conditional_headers(app_key)})
+    if res.status_code == 304:
+        store.record(app_key, url, changed=False, response=res)
+        return False
+    if res.status_code != 200:
+        raise requests.HTTPError(f"status code {res.status_code} for {url}", response=res)
+
+    soup = make_soup(res.text)
+    app.scrape_compact_labels(soup)
+    labels_hash = label_hash(app.compact_dict)
+    stored = store.get(app_key)
+    if stored is not None and stored["label_hash"] == labels_hash:
+        store.record(app_key, url, changed=False, response=res, labels_hash=labels_hash)
+        return False
+
+    # the details page is reused, only the data safety page is fetched
+    app.pages[app.compact_url] = soup
+    app.scrape_data()
+    app.write_to_json()
+    sync_corpus()
+    store.record(app_key, url, changed=True, response=res, labels_hash=labels_hash)
+    return True
+
+
+# writes an app's data to the corpus shards if configured, otherwise to json_android_files/<App ID>.json
+def write_app_json(all_data):
+    if corpus_writer is not None:
+        with crawl_metrics.stage("json_write"):
+            corpus_writer.write(all_data)
+        crawl_metrics.count("apps")
+        return
+
+    directory_path = 'json_android_files'
+    if not os.path.exists(directory_path):
+        os.makedirs(directory_path)
+
+    file_path = os.path.join(directory_path, str(all_data['App ID']) + '.json')
+
+    with crawl_metrics.stage("json_write"):
         with open(file_path, "w") as file:
-            json.dump(self.all_data, file, indent=4)    
-
-
-# def crawl_app_links(url):
-#     try:
-#         if url in processed_apps:  # base case
-#             return
-#         print(f"processing link: {url}")
-#         app = AndroidScraper(url)
-#         app.scrape_data
-#         app.write_to_json()
-#         processed_apps[url] = True
-#         similar_apps = similar_app_scraper(url)
-#         for link in similar_apps:  # recurisve case
-#             if link in processed_apps:
-#                 continue
-#             else:
-#                 crawl_app_links(link)
-    
-#     except Exception as e:
-#         print(f"error occured at URL: {url} - {e}")
+            json.dump(all_data, file, indent=4)
+    crawl_metrics.count("apps")
+
+
+# parse stage of the crawl pipeline, runs in a parser process on pages that were already fetched
+# and returns the app's data and the similar apps linked from its page
+def parse_app_pages(url, pages):
+    app = AndroidScraper(url)
+    app.pages[url] = make_soup(pages["details"])
+    # only fetched when the compact labels do not prove it empty, see PlayStoreCrawler.fetch_pages
+    if "datasafety" in pages:
+        app.pages[app.expanded_url] = make_soup(pages["datasafety"])
+    app.scrape_data()
+    return (app.all_data, app.similar_app_links())
+
+
+# client reading from the page archive, one per re-parse worker process
+replay_client = None
+
+
+def init_replay_worker(directory, parser=None):
+    global replay_client
+    if parser is not None:
+        configure_parser(parser)
+    replay_client = HttpClient(archive=PageArchive(directory, replay=True))
+
+
+# rebuilds an app's JSON file from the page archive without touching the network
+def reparse_app(url):
+    try:
+        app = AndroidScraper(url, http_client=replay_client)
+        app.scrape_data()
+        app.write_to_json()
+        return (url, None)
+    except Exception as e:
+        return (url, str(e))
+
+
+# rebuilds the JSON file of every archived app page offline, spread over all cores
+def reparse_archive(directory, processes=None):
+    archive = PageArchive(directory, replay=True)
+    app_urls = [url for url in archive.urls() if "/store/apps/details?" in url]
+    archive.close()
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_replay_worker, initargs=(directory, get_parser())) as executor:
+        for url, error in executor.map(reparse_app, app_urls, chunksize=16):
+            if error is not None:
+                print(f"error occured at URL: {url} - {error}")
+
+
+# iterative crawler that scrapes apps with a pool of worker threads and expands the crawl
+# through the similar apps linked from every scraped app
+class PlayStoreCrawler:
+    def __init__(self, workers=8, max_apps=None, http_client=None, driver_pool=None, frontier_capacity=None,
+                 dead_letter_path=None):
+        self.workers = workers
+        self.max_apps = max_apps
+        self.http = http_client if http_client is not None else get_client()
+        self.driver_pool = driver_pool
+        self.work_queue = queue.Queue()
+        self.lock = threading.Lock()
+        # app IDs that were scraped, and app IDs that were ever put on the work queue,
+        # a Bloom filter sized for frontier_capacity apps if given
+        self.processed_apps = VisitedSet()
+        self.scheduled_apps = BloomFilter(frontier_capacity) if frontier_capacity is not None else VisitedSet()
+        # apps that failed after every retry, re-driven later by redrive_dead_letters
+        self.dead_letters = DeadLetterQueue(dead_letter_path) if dead_letter_path is not None else None
+
+
+    # returns the app ID of a details page link, or None for other links
+    def app_key(self, url):
+        return android_app_id(url)
+
+
+    # marks the apps already saved in a directory, as JSON files or in corpus shards, as processed.
+    # configure_corpus should be called first, so the records it recovers from a killed crawl are included
+    def load_processed_apps(self, directory):
+        self.processed_apps.update(filename[:-len(".json")] for filename in os.listdir(directory)
+                                   if filename.endswith(".json"))
+        self.processed_apps.update(data["App ID"] for data in read_shards(directory))
+
+
+    # marks an app as scheduled and returns its canonical link, or None if it was already scheduled or processed
+    def claim(self, url):
+        app_id = self.app_key(url)
+        if app_id is None:
+            return None
+        with self.lock:
+            if app_id in self.scheduled_apps or app_id in self.processed_apps:
+                return None
+            self.scheduled_apps.add(app_id)
+        return canonical_android_url(url)
+
+
+    # adds an app to the work queue unless it was already scheduled or processed
+    def schedule(self, url):
+        url = self.claim(url)
+        if url is not None:
+            self.work_queue.put(url)
+
+
+    # scrapes one app, saves it and schedules the similar apps found on its page
+    def process(self, url):
+        with self.lock:
+            if self.max_apps is not None and len(self.processed_apps) >= self.max_apps:
+                return
+        print(f"processing link: {url}")
+        app = AndroidScraper(url, http_client=self.http)
+        app.scrape_data()
+        app.write_to_json()
+        with self.lock:
+            self.processed_apps.add(self.app_key(url))
+        for link in app.similar_app_links():
+            self.schedule(link)
+
+
+    def worker(self):
+        while True:
+            url = self.work_queue.get()
+            try:
+                if url is None:
+                    return
+                self.process(url)
+            except Exception as e:
+                print(f"error occured at URL: {url} - {e}")
+                crawl_metrics.error("app", e)
+                self.dead_letter(url, e)
+            finally:
+                self.work_queue.task_done()
+
+
+    # crawls until no new apps are found, starting from the given app links
+    # the seed links may be a generator that is still finding them, the workers start on the first ones right away
+    def crawl(self, seed_urls):
+        threads = self.start_workers()
+        for url in seed_urls:
+            self.schedule(url)
+        print(f"the queue currently has {self.work_queue.qsize()} items")
+        self.finish_workers(threads)
+
+
+    def start_workers(self):
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+
+    # waits until the work queue is empty and stops the worker threads
+    def finish_workers(self, threads):
+        self.work_queue.join()
+
+        for _ in threads:
+            self.work_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+
+    # puts an app that failed on the dead-letter queue, if the crawl has one
+    def dead_letter(self, url, error):
+        if self.dead_letters is not None:
+            self.dead_letters.add(url, error)
+
+
+    # crawls the failed apps that are due for another attempt, and the similar apps found on their pages
+    def redrive_dead_letters(self, limit=None):
+        if self.dead_letters is None:
+            print("no dead-letter queue to re-drive, the crawler was built without dead_letter_path")
+            return
+        due = self.dead_letters.due(limit)
+        # put on the queue directly, the failed apps were already scheduled when they were first found
+        for url in due:
+            if self.app_key(url) not in self.processed_apps:
+                self.work_queue.put(url)
+        print(f"re-driving {len(due)} apps from the dead-letter queue")
+        self.finish_workers(self.start_workers())
+
+        # apps that failed again were pushed back with a longer delay, the rest are done once they are on disk
+        sync_corpus()
+        for url in due:
+            if self.app_key(url) in self.processed_apps:
+                self.dead_letters.remove(url)
+
+
+    # re-checks the labels of the apps in the corpus that are due, the most overdue first, see refresh_app.
+    # apps saved since the last refresh start being tracked with the hash of their saved labels
+    def refresh_corpus(self, directory, store_path, limit=None):
+        store = RefreshStore(store_path)
+        try:
+            tracked = []
+            for all_data in read_corpus(directory):
+                url = canonical_android_url(all_data.get("URL", ""))
+                if url is not None:
+                    tracked.append((android_app_id(url), url, label_hash(compact_labels(all_data))))
+            store.track(tracked)
+
+            due = store.due(limit)
+            print(f"{len(due)} apps are due for a refresh")
+
+            def refresh(url):
+                try:
+                    return refresh_app(url, store, self.http)
+                except Exception as e:
+                    print(f"error occured at URL: {url} - {e}")
+                    crawl_metrics.error("refresh", e)
+                    return False
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                changed = sum(executor.map(refresh, [url for app_key, url in due]))
+            crawl_metrics.count("labels_changed", changed)
+            print(f"{changed} of {len(due)} apps had changed labels")
+        finally:
+            store.close()
+
+
+    # seeds the crawl with every app listed on the given store pages
+    # apps are scheduled as they appear on the scrolled page, not once the whole page has loaded
+    def crawl_from_pages(self, page_urls):
+        def seed_urls():
+            for page_url in page_urls:
+                try:
+                    yield from iter_all_pages(page_url, self.driver_pool)
+                except Exception as e:
+                    print(f"error occured at URL: {page_url} - {e}")
+                    crawl_metrics.error("seed", e)
+        self.crawl(seed_urls())
+
+
+    # fetch stage of the crawl pipeline, downloads the details page of an app, and its data safety page unless
+    # the compact labels prove it empty. only the compact label elements are parsed here, the parser processes
+    # build the full pages
+    def fetch_pages(self, url):
+        app = AndroidScraper(url, http_client=self.http)
+
+        def fetch(page_url):
+            res = self.http.get(page_url, headers=app.header)
+            if res.status_code != 200:
+                raise requests.HTTPError(f"status code {res.status_code} for {page_url}", response=res)
+            return res.text
+
+        pages = {"details": fetch(app.compact_url)}
+        app.scrape_compact_labels(make_soup(pages["details"], parse_only=COMPACT_LABEL_STRAINER))
+        if app.needs_data_safety():
+            pages["datasafety"] = fetch(app.expanded_url)
+        else:
+            crawl_metrics.count("expanded_labels_skipped")
+        return pages
+
+
+    # last stage of the crawl pipeline, saves the app and puts the similar apps on the pipeline
+    def handle_result(self, pipeline, url, result, error):
+        if error is not None:
+            print(f"error occured at URL: {url} - {error}")
+            crawl_metrics.error("app", error)
+            self.dead_letter(url, error)
+            return
+        all_data, similar_links = result
+        print(f"processing link: {url}")
+        write_app_json(all_data)
+        with self.lock:
+            self.processed_apps.add(self.app_key(url))
+            if self.max_apps is not None and len(self.processed_apps) >= self.max_apps:
+                return
+        for link in similar_links:
+            link = self.claim(link)
+            if link is not None:
+                pipeline.put(link)
+
+
+    # same crawl as crawl, but fetch threads download pages while a pool of processes parses them
+    def crawl_pipeline(self, seed_urls, fetch_workers=16, parse_workers=None):
+        seed_urls = [url for url in map(self.claim, seed_urls) if url is not None]
+        print(f"the queue currently has {len(seed_urls)} items")
+
+        pipeline = FetchParsePipeline(
+            self.fetch_pages, parse_app_pages,
+            lambda url, result, error: self.handle_result(pipeline, url, result, error),
+            fetch_workers=fetch_workers, parse_workers=parse_workers,
+            initializer=configure_parser, initargs=(get_parser(),))
+        pipeline.run(seed_urls)
 
 
 
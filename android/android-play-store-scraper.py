@@ -1,7 +1,11 @@
-
 import json
 import os 
+import sys
 import pytest
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.corpus import load_line, read_shard, record_app_id, ShardedJsonlWriter, SHARD_SUFFIX
 
 def check_json_consistency(data):
     # get app ID
@@ -40,6 +44,98 @@ def check_json_consistency(data):
     return None
 
 
+# checks every app in a JSON file or corpus shard, returns the list of inconsistencies found and the App IDs
+# in the file. an app saved twice in the same shard, e.g. again by a refresh, is checked with the record written last
+def check_file(path):
+    try:
+        if path.endswith(SHARD_SUFFIX):
+            records = read_shard(path)
+        else:
+            with open(path, 'rb') as f:
+                records = [load_line(f.read())]
+        latest = {}
+        unknown = []
+        for data in records:
+            app_id = record_app_id(data)
+            if app_id is None:
+                unknown.append(data)
+            else:
+                latest[app_id] = data
+        inconsistencies = []
+        for data in unknown + list(latest.values()):
+            inconsistency = check_json_consistency(data)
+            if inconsistency is not None:
+                inconsistencies.append(inconsistency)
+        return (inconsistencies, list(latest))
+    except Exception as e:
+        return ([("Unknown ID", f"could not be read: {e}")], [])
+
+
+# checks a directory of JSON files and corpus shards in parallel. Results are kept in a manifest of
+# (mtime, size, inconsistencies, app IDs) per file, so files that did not change since the last run are not read again.
+# like common.corpus.read_corpus, only the record of an app written last is reported, the newest shard first
+# and the JSON files after the shards. Returns the report, which is also written to report_path if given.
+def check_corpus(directory_path, manifest_path=None, report_path=None, processes=None):
+    if manifest_path is None:
+        manifest_path = os.path.join(directory_path, ".consistency_manifest.json")
+
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'rb') as f:
+            manifest = load_line(f.read())
+
+    # a single directory scan gets the sizes and modification times of every file
+    files = {}
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            # hidden files such as the manifest itself are skipped
+            if entry.name.startswith("."):
+                continue
+            if entry.is_file() and (entry.name.endswith(".json") or entry.name.endswith(SHARD_SUFFIX)):
+                stat = entry.stat()
+                files[entry.name] = [stat.st_mtime_ns, stat.st_size]
+
+    # manifests written before the app IDs were kept are checked again
+    changed = [name for name, stat in files.items()
+               if name not in manifest or manifest[name][:2] != stat or len(manifest[name]) < 4]
+    paths = [os.path.join(directory_path, name) for name in changed]
+
+    # new manifest, files that were deleted since the last run are dropped
+    new_manifest = {name: manifest[name] for name in files if name not in changed}
+    if paths:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for name, (inconsistencies, app_ids) in zip(changed, executor.map(check_file, paths, chunksize=64)):
+                new_manifest[name] = files[name] + [inconsistencies, app_ids]
+
+    # written to a temporary file first, so an interrupted run never leaves a broken manifest
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump(new_manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # the inconsistencies of records that a newer file saved again are dropped
+    shards = sorted((name for name in new_manifest if name.endswith(SHARD_SUFFIX)), reverse=True)
+    seen = set()
+    superseded = set()
+    for name in shards + [name for name in new_manifest if not name.endswith(SHARD_SUFFIX)]:
+        for app_id, reason in new_manifest[name][2]:
+            if app_id in seen:
+                superseded.add((name, app_id))
+        seen.update(new_manifest[name][3])
+
+    report = {
+        "directory": directory_path,
+        "files": len(files),
+        "checked": len(changed),
+        "inconsistent": [{"file": name, "app_id": app_id, "reason": reason}
+                         for name, entry in sorted(new_manifest.items())
+                         for app_id, reason in entry[2] if (name, app_id) not in superseded],
+    }
+    if report_path is not None:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=4)
+    return report
+
+
 def test_check_json_consistency():
     # Test case 1: 'Data Linked to You' is present but 'data_linked' is empty
     data = {
@@ -86,30 +182,57 @@ def test_check_json_consistency():
     assert result is None, "Expected no inconsistency but found one"
 
 
-def main():
-    # initialize an empty list
-    inconsistent_apps = []
+def test_check_corpus(tmp_path):
+    consistent = {"app_info": {"App ID": 1}, "compact_dict": {"Data Not Collected": None},
+                  "data_linked": {}, "data_not_linked": {}, "data_track": {}}
+    inconsistent = {"app_info": {"App ID": 2}, "compact_dict": {"Data Linked to You": None},
+                    "data_linked": {}, "data_not_linked": {}, "data_track": {}}
+    for data in [consistent, inconsistent]:
+        with open(tmp_path / f"{data['app_info']['App ID']}.json", 'w') as f:
+            json.dump(data, f)
+    writer = ShardedJsonlWriter(str(tmp_path))
+    writer.write(consistent)
+    writer.write(inconsistent)
+    writer.close()
+
+    report = check_corpus(str(tmp_path), processes=2)
+    assert report["files"] == 3 and report["checked"] == 3
+    # app 2 was saved again in the shard, only its latest record is reported
+    assert [(entry["file"].endswith(SHARD_SUFFIX), entry["app_id"]) for entry in report["inconsistent"]] == [(True, 2)]
+
+    # unchanged files are not checked again, but their inconsistencies are still reported
+    report = check_corpus(str(tmp_path), processes=2)
+    assert report["checked"] == 0
+    assert len(report["inconsistent"]) == 1
+
+    with open(tmp_path / "2.json", 'w') as f:
+        json.dump({**consistent, "app_info": {"App ID": 2}}, f)
+    os.utime(tmp_path / "2.json", ns=(0, 0))
+    report = check_corpus(str(tmp_path), processes=2)
+    assert report["checked"] == 1
+    assert len(report["inconsistent"]) == 1
+
+    # a refresh saves app 2 again in a newer shard, the last record written in it is consistent
+    writer = ShardedJsonlWriter(str(tmp_path))
+    writer.write(inconsistent)
+    writer.write({**consistent, "app_info": {"App ID": 2}})
+    writer.close()
+    report = check_corpus(str(tmp_path), processes=2)
+    assert report["files"] == 4 and report["checked"] == 1
+    assert report["inconsistent"] == []
+
 
+def main():
     # directory_path = 'ios_scraper/json_files-06-21'
     directory_path = '/Users/earnsmacbookair/Downloads/ios_files'
-    json_files = os.listdir(directory_path)
 
-    # assuming json_files is a list of all your json file paths
-    for json_file in json_files:
-        full_path = os.path.join(directory_path, json_file) # create the full path to the file
-        with open(full_path, 'r') as f: 
-            data = json.load(f)
-            inconsistency = check_json_consistency(data)
-            if inconsistency is not None:
-                inconsistent_apps.append(inconsistency)
-            
+    # only new or changed files are checked, the full report is written to consistency_report.json
+    report = check_corpus(directory_path, report_path="consistency_report.json")
+    print(f"Checked {report['checked']} of {report['files']} files")
 
     # print the inconsistent apps
-    for app_id, reason in inconsistent_apps:
-        print(f"App ID: {app_id}, Reason: {reason}")
-        
-    if not inconsistent_apps:
-        print      
+    for entry in report["inconsistent"]:
+        print(f"App ID: {entry['app_id']}, Reason: {entry['reason']}")
         
 if __name__ == "__main__":
     main()
@@ -1,45 +1,24 @@
-import requests
 import json
-from bs4 import BeautifulSoup
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.http import get_client
+from common.parser import make_soup
+from datasafety import parse_data_safety
 
 class DataScraper:
-    def __init__(self, url, header):
+    def __init__(self, url, header, http_client=None):
         self.url = url
         self.header = header
+        self.http = http_client if http_client is not None else get_client()
         self.data_dict = {}
 
     def scrape_data(self):
-        res = requests.get(self.url, headers=self.header)
-        soup = BeautifulSoup(res.text, 'html.parser')
-
-        data_collection = soup.find_all('h2', {'class': "q1rIdc"})
-
-        for elem in data_collection:
-            y = elem.find_next_sibling('div', {'class': "XgPdwe"})
-
-            h3_elements = y.find_all('h3', {'class': "aFEzEb"})
-            h4_elements = y.find_all('h4', {'class': "pcmFvf"})
-            purposes_elements = y.find_all('div', {'class': "FnWDne"})
-
-            sub_dict = {}
-
-            for h3_elem in h3_elements:
-                h3_text = h3_elem.text
-                h4_texts = []
-                purposes_texts = []
-
-                for h4_elem, purposes_elem in zip(h4_elements, purposes_elements):
-                    if h4_elem.find_previous('h3') == h3_elem:
-                        h4_texts.append(h4_elem.text)
-                        purposes_texts.append(purposes_elem.text)
-
-                data_items = {}
-                for data, purpose in zip(h4_texts, purposes_texts):
-                    data_items[data] = [purpose]
-
-                sub_dict[h3_text] = data_items
+        res = self.http.get(self.url, headers=self.header)
+        soup = make_soup(res.text)
 
-            self.data_dict[elem.text] = sub_dict
+        self.data_dict.update(parse_data_safety(soup))
 
     def save_data_to_file(self, filename):
         # Serializing json
@@ -3,43 +3,44 @@ header = {
 }
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
-from bs4 import BeautifulSoup
-import time
-
-def scrape_all_pages(url):
-    s = Service("/Users/eusilakitur/Downloads/chromedriver_mac64/chromedriver")
-    driver = webdriver.Chrome(service=s)
-    driver.get(url)
-    prefix = "https://play.google.com "
-    scraped_data = []
-
-    old_scroll_position = 0
-    new_scroll_position = None
-
-    while new_scroll_position != old_scroll_position:
-        old_scroll_position = driver.execute_script("return window.scrollY;")
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(2)
-        new_scroll_position = driver.execute_script("return window.scrollY;")
-        
-
-    # Create BeautifulSoup object with the page source
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-
-    # Scrape the desired data
-    links = soup.find_all("a", {'class':"Si6A0c ZD8Cqc"})
-    scraped_data.extend([prefix + link['href'] for link in links if 'href' in link.attrs])
-
-    # Close the Selenium WebDriver
-    driver.quit()
-
-    return scraped_data
-
-# Example usage
-url = 'https://play.google.com/store/apps'
-
-scraped_data = scrape_all_pages(url)
-
-# Print the scraped data
-print(scraped_data)
-print(len(scraped_data))
\ No newline at end of file
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.scroll import ScrollLoader
+
+# yields the app links on a store page while it is still being scrolled: after every scroll step only the
+# links that appeared since the last step are read from the live page, so the apps found first can be
+# scraped while the page keeps loading and the whole page source is never parsed at once
+def iter_all_pages(url, driver_pool=None):
+    # borrow a browser from the shared pool when one is given, otherwise start one for this call
+    if driver_pool is not None:
+        driver = driver_pool.acquire()
+    else:
+        s = Service("/Users/eusilakitur/Downloads/chromedriver_mac64/chromedriver")
+        driver = webdriver.Chrome(service=s)
+    try:
+        driver.get(url)
+
+        # scrolls until no new apps load, waiting on the page instead of a fixed sleep
+        yield from ScrollLoader(driver, item_selector="a.Si6A0c.ZD8Cqc").scroll_and_harvest()
+    finally:
+        # Give back or close the Selenium WebDriver
+        if driver_pool is not None:
+            driver_pool.release(driver)
+        else:
+            driver.quit()
+
+
+def scrape_all_pages(url, driver_pool=None):
+    return list(iter_all_pages(url, driver_pool))
+
+if __name__ == "__main__":
+    # Example usage
+    url = 'https://play.google.com/store/apps'
+
+    scraped_data = scrape_all_pages(url)
+
+    # Print the scraped data
+    print(scraped_data)
+    print(len(scraped_data))
\ No newline at end of file
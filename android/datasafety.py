@@ -0,0 +1,57 @@
+# parses the data safety page of an app in a single pass over the document
+
+
+# matches the category headings, data types and purposes of a data safety section
+def is_data_safety_tag(tag):
+    classes = tag.get("class") or []
+    if tag.name == "h3":
+        return "aFEzEb" in classes
+    if tag.name == "h4":
+        return "pcmFvf" in classes
+    if tag.name == "div":
+        return "FnWDne" in classes
+    return False
+
+
+# removes the " · Optional" suffix some data types end in
+def strip_optional_suffix(type_text):
+    if len(type_text) >= 12 and type_text[-10] == "·":
+        return type_text[0:-11]
+    return type_text
+
+
+# returns {section heading: {category: {data type: [purpose]}}}
+# every data type is assigned to the category heading it follows in document order,
+# and paired with the purpose that follows it, so each section is walked once
+def parse_data_safety(soup, strip_optional=False):
+    data_safety = {}
+
+    for elem in soup.find_all('h2', {'class': "q1rIdc"}):
+        y = elem.find_next_sibling('div', {'class': "XgPdwe"})
+
+        sub_dict = {}
+        data_types = []
+        purposes = []
+        data_items = None
+
+        for tag in y.find_all(is_data_safety_tag):
+            if tag.name == "h3":
+                data_items = {}
+                sub_dict[tag.text] = data_items
+            elif tag.name == "h4":
+                data_types.append((data_items, tag.text))
+            else:
+                purposes.append(tag.text)
+
+        for (items, type_text), purpose in zip(data_types, purposes):
+            # data types listed before the first category heading have no category
+            if items is None:
+                continue
+            if strip_optional:
+                type_text = strip_optional_suffix(type_text)
+            # a data type listed twice in a category keeps its first purpose
+            items.setdefault(type_text, [purpose])
+
+        data_safety[elem.text] = sub_dict
+
+    return data_safety
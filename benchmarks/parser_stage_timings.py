@@ -0,0 +1,291 @@
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "ios"))
+sys.path.append(os.path.join(ROOT, "android"))
+from common.archive import PageArchive
+from common.parser import make_soup, configure_parser, get_parser, PARSER_BACKENDS
+from ios import iOS
+
+# android-info-compiler.py cannot be imported by name because of the dashes
+spec = importlib.util.spec_from_file_location("android_info_compiler", os.path.join(ROOT, "android", "android-info-compiler.py"))
+android_info_compiler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(android_info_compiler)
+AndroidScraper = android_info_compiler.AndroidScraper
+
+# store pages the timings run on by default, a PageArchive. The checked-in pages are synthetic, built by hand
+# in the markup the scrapers parse, three apps of 5-55 KB per store. Live store pages are hundreds of KB with
+# large embedded JSON, so timings on these are only good for comparing stages and runs with each other.
+# Representative timings need pages recorded during a crawl, see select_fixtures
+SYNTHETIC_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_fixtures")
+# where --select-from copies recorded pages to, used instead of the synthetic pages once it holds an archive
+RECORDED_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded_fixtures")
+
+
+def is_ios_app(url):
+    return "apps.apple.com" in url and "/id" in url and "see-all" not in url
+
+
+def is_android_app(url):
+    return "/store/apps/details?" in url
+
+
+def select_fixtures(source, destination, per_platform=6):
+    """
+    Copies a few app pages of varied size from a crawl's page archive into a small fixture archive,
+    from the smallest to the largest page of each store. The pages an app needs are copied with it,
+    the pop up page source for iOS apps and the data safety page for Android apps.
+
+    Args:
+        source (str): Directory of the page archive recorded during a crawl.
+        destination (str): Directory of the fixture archive.
+        per_platform (int, optional): Number of apps picked per store. Defaults to 6.
+    """
+    archive = PageArchive(source, replay=True)
+    fixtures = PageArchive(destination)
+
+    for is_app in [is_ios_app, is_android_app]:
+        sized = []
+        for url in archive.urls():
+            if not is_app(url):
+                continue
+            record = archive.get(url)
+            if record[0] == 200:
+                sized.append((len(record[1]), url))
+        sized.sort()
+        if not sized:
+            continue
+
+        # evenly spaced through the size distribution, so both ends are always included
+        count = min(per_platform, len(sized))
+        picks = sorted({round(i * (len(sized) - 1) / max(count - 1, 1)) for i in range(count)})
+        for i in picks:
+            url = sized[i][1]
+            fixtures.store(url, archive.get(url)[1])
+            if is_app is is_ios_app:
+                record = archive.get(url, kind="browser")
+                if record is not None:
+                    fixtures.store(url, record[1], kind="browser")
+            else:
+                expanded_url = "datasafety?".join(url.split("details?"))
+                record = archive.get(expanded_url)
+                if record is not None:
+                    fixtures.store(expanded_url, record[1], record[0])
+
+    archive.close()
+    fixtures.close()
+
+
+def measure(setup, run, repeat):
+    """
+    Times one stage. The setup is not measured, it builds the state the stage runs on.
+
+    Args:
+        setup (function): Returns the input of the stage.
+        run (function): The stage, takes the output of setup.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        tuple: The median time in seconds and the peak memory allocated by the stage in bytes.
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc slows everything down, so memory is measured in a separate run
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (statistics.median(times), peak)
+
+
+def ios_stages(url, page, modal_page):
+    """
+    Builds the stages of parsing an iOS app: building the soup and each extractor of the iOS class.
+
+    Args:
+        url (str): URL of the app page.
+        page (str): HTML of the app page.
+        modal_page (str): Page source with the privacy details pop up open, or None.
+
+    Returns:
+        list: (name, setup, run) for every stage.
+    """
+    def new_app(*attributes):
+        app = iOS(url, page=page, modal_page=modal_page, use_browser=False)
+        for attribute in attributes:
+            setattr(app, attribute, {})
+        return app
+
+    return [
+        ("parse", lambda: page, make_soup),
+        ("scrape_appinfo", lambda: new_app("app_info"), lambda app: app.scrape_appinfo()),
+        ("scrape_compact_labels", lambda: new_app("compact_dict"), lambda app: app.scrape_compact_labels()),
+        ("expanded_labels", lambda: new_app("data_linked", "data_not_linked", "data_track"),
+         lambda app: app.update_collection_categories()),
+        ("count_labels", lambda: new_app("compact_count", "expanded_count"), lambda app: app.count_labels()),
+        ("total", lambda: None,
+         lambda _: iOS(url, page=page, modal_page=modal_page, use_browser=False)),
+    ]
+
+
+def android_stages(url, page, expanded_page):
+    """
+    Builds the stages of parsing an Android app: building both soups and each extractor of AndroidScraper.
+
+    Args:
+        url (str): URL of the details page.
+        page (str): HTML of the details page.
+        expanded_page (str): HTML of the data safety page.
+
+    Returns:
+        list: (name, setup, run) for every stage.
+    """
+    soup = make_soup(page)
+    expanded_soup = make_soup(expanded_page)
+
+    def new_app():
+        app = AndroidScraper(url)
+        app.pages[url] = soup
+        app.pages[app.expanded_url] = expanded_soup
+        return app
+
+    return [
+        ("parse", lambda: page, make_soup),
+        ("parse_datasafety", lambda: expanded_page, make_soup),
+        ("scrape_expanded_labels", new_app, lambda app: app.scrape_expanded_labels(expanded_soup)),
+        ("scrape_compact_labels", new_app, lambda app: app.scrape_compact_labels(soup)),
+        ("scrape_appinfo", new_app, lambda app: app.scrape_appinfo(soup)),
+        ("total", lambda: None,
+         lambda _: android_info_compiler.parse_app_pages(url, {"details": page, "datasafety": expanded_page})),
+    ]
+
+
+def has_fixtures(directory):
+    """
+    Checks for a fixture archive without creating one, opening a PageArchive creates its index.
+
+    Args:
+        directory (str): Directory of the fixture archive.
+
+    Returns:
+        bool: True if the directory holds an archive index.
+    """
+    return os.path.exists(os.path.join(directory, "index.sqlite"))
+
+
+def run_benchmarks(directory, repeat=5):
+    """
+    Runs every stage on every app in the fixture archive.
+
+    Args:
+        directory (str): Directory of the fixture archive.
+        repeat (int, optional): Number of timed runs per stage. Defaults to 5.
+
+    Returns:
+        list[dict]: One result per app and stage.
+    """
+    archive = PageArchive(directory, replay=True)
+    results = []
+    for url in sorted(archive.urls()):
+        page = archive.get(url)[1]
+        if is_ios_app(url):
+            platform = "ios"
+            record = archive.get(url, kind="browser")
+            stages = ios_stages(url, page, record[1] if record is not None else None)
+        elif is_android_app(url):
+            platform = "android"
+            record = archive.get("datasafety?".join(url.split("details?")))
+            if record is None:
+                print(f"Skipping {url}, its data safety page is not in the fixtures")
+                continue
+            stages = android_stages(url, page, record[1])
+        else:
+            continue
+
+        for name, setup, run in stages:
+            try:
+                seconds, peak = measure(setup, run, repeat)
+            except Exception as e:
+                print(f"Error occurred at URL: {url} in stage {name} - {e}")
+                continue
+            results.append({
+                "platform": platform,
+                "url": url,
+                "page_bytes": len(page),
+                "parser": get_parser(),
+                "stage": name,
+                "median_ms": round(seconds * 1000, 3),
+                "peak_kb": round(peak / 1024, 1),
+            })
+    archive.close()
+    return results
+
+
+def print_results(results):
+    print(f"{'platform':<8} {'page KB':>8} {'stage':<24} {'median ms':>10} {'peak KB':>10}  url")
+    for result in results:
+        print(f"{result['platform']:<8} {result['page_bytes'] / 1024:>8.0f} {result['stage']:<24} "
+              f"{result['median_ms']:>10.2f} {result['peak_kb']:>10.0f}  {result['url']}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Times the iOS and Android parsers stage by stage on archived store pages.")
+    arg_parser.add_argument("--fixtures", help="fixture archive to run on, defaults to the recorded fixtures "
+                                               "if there are any and to the synthetic pages checked in otherwise")
+    arg_parser.add_argument("--parser", choices=PARSER_BACKENDS, help="parser backend, defaults to the fastest installed one")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage")
+    arg_parser.add_argument("--output", help="also write the results as JSON lines, to compare runs")
+    arg_parser.add_argument("--select-from", metavar="ARCHIVE",
+                            help="first copy apps of varied size from a crawl's page archive into the recorded fixtures")
+    args = arg_parser.parse_args()
+
+    if args.parser is not None:
+        configure_parser(args.parser)
+    fixtures = args.fixtures
+    if fixtures is None:
+        fixtures = RECORDED_FIXTURES if args.select_from is not None or has_fixtures(RECORDED_FIXTURES) else SYNTHETIC_FIXTURES
+    if args.select_from is not None:
+        select_fixtures(args.select_from, fixtures)
+    if not has_fixtures(fixtures):
+        sys.exit(f"No fixture archive in {fixtures}, record one with --select-from")
+
+    results = run_benchmarks(fixtures, args.repeat)
+    if not results:
+        sys.exit(f"No app pages could be benchmarked in {fixtures}")
+    print_results(results)
+    if os.path.abspath(fixtures) == os.path.abspath(SYNTHETIC_FIXTURES):
+        print("Timed on the synthetic fixture pages, not representative of live store pages. "
+              "Record pages with --select-from for representative timings.")
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+
+
+
+def test_fixtures_cover_every_stage():
+    results = run_benchmarks(SYNTHETIC_FIXTURES, repeat=1)
+    stages = {}
+    for result in results:
+        stages.setdefault((result["platform"], result["url"]), set()).add(result["stage"])
+    # every stage of every app ran without an error
+    assert sorted(platform for platform, url in stages) == ["android"] * 3 + ["ios"] * 3
+    assert all(len(names) == 6 for names in stages.values())
+
+
+if __name__ == "__main__":
+    main()
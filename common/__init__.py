@@ -0,0 +1 @@
+"""Helpers shared by the iOS and Android scrapers."""
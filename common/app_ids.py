@@ -0,0 +1,67 @@
+from urllib.parse import parse_qs, urljoin, urlsplit
+import re
+
+# path of an app page, /<country>/app/<name>/id<number> or /app/id<number>
+IOS_APP_ID = re.compile(r"/app/(?:[^/]+/)?id(\d+)$")
+
+
+def ios_app_id(url):
+    """Returns the numeric ID of an App Store app link. Query strings, fragments and
+    trailing slashes are ignored, so every link to the same app gives the same ID.
+
+    Args:
+        url (str): App link, e.g. https://apps.apple.com/us/app/instagram/id389801252?see-all=reviews
+
+    Returns:
+        int: The app's ID, or None for links that are not app pages.
+    """
+    match = IOS_APP_ID.search(urlsplit(url.strip()).path.rstrip("/"))
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def canonical_ios_url(url):
+    """Normalizes an App Store app link to https://apps.apple.com/<path> without query string or fragment.
+
+    Args:
+        url (str): App link, absolute or relative to apps.apple.com.
+
+    Returns:
+        str: The canonical link, or None for links that are not app pages.
+    """
+    parts = urlsplit(urljoin("https://apps.apple.com/", url.strip()))
+    path = parts.path.rstrip("/")
+    if IOS_APP_ID.search(path) is None:
+        return None
+    return "https://apps.apple.com" + path
+
+
+def android_app_id(url):
+    """Returns the package name of a Play Store details page link.
+
+    Args:
+        url (str): Details page link, e.g. https://play.google.com/store/apps/details?id=com.snapchat.android&hl=en
+
+    Returns:
+        str: The app's package name, or None for links without an app ID.
+    """
+    query = parse_qs(urlsplit(url.strip()).query)
+    if "id" not in query:
+        return None
+    return query["id"][0]
+
+
+def canonical_android_url(url):
+    """Normalizes a Play Store app link to its details page without any other query parameter.
+
+    Args:
+        url (str): Details or data safety page link, absolute or relative to play.google.com.
+
+    Returns:
+        str: The canonical link, or None for links without an app ID.
+    """
+    app_id = android_app_id(urljoin("https://play.google.com/", url.strip()))
+    if app_id is None:
+        return None
+    return "https://play.google.com/store/apps/details?id=" + app_id
@@ -0,0 +1,172 @@
+import zstandard
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class ArchivedResponse:
+    def __init__(self, url, status_code, text):
+        """A response read back from the archive. It has the same status_code and text 
+        attributes the scrapers use on a requests response.
+
+        Args:
+            url (str): URL the page was fetched from.
+            status_code (int): HTTP status of the original response.
+            text (str): Body of the original response.
+        """
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+
+
+class PageArchive:
+    def __init__(self, directory, replay=False, segment_size=256 * 1024 * 1024, level=3):
+        """An append-only archive of every fetched page. Bodies are compressed with zstd and stored 
+        once per SHA-256 digest in segment files, and an SQLite index maps each fetch to its body.
+        Only one process should record into an archive at a time, any number can replay from it.
+
+        Args:
+            directory (str): Directory holding the segment files and the index.
+            replay (bool, optional): Whether pages are read from the archive instead of the network. Defaults to False.
+            segment_size (int, optional): Size in bytes after which a new segment file is started. Defaults to 256 MB.
+            level (int, optional): zstd compression level. Defaults to 3.
+        """
+        self.directory = directory
+        self.replay = replay
+        self.segment_size = segment_size
+        self.level = level
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.lock = threading.Lock()
+        self.index = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("PRAGMA synchronous=NORMAL")
+        self.index.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS records_url ON records (url, kind);
+        """)
+        self.index.commit()
+
+        segments = sorted(name for name in os.listdir(directory) if name.endswith(".zst"))
+        self.segment_number = len(segments)
+        self.segment = None
+
+    def open_segment(self):
+        """Returns the segment file new bodies are appended to, starting a new one when it is full.
+
+        Returns:
+            file: The segment file, opened for appending.
+        """
+        if self.segment is None:
+            self.segment_number = max(self.segment_number, 1)
+            self.segment = open(os.path.join(self.directory, f"segment-{self.segment_number:05d}.zst"), "ab")
+        if self.segment.tell() >= self.segment_size:
+            self.segment.close()
+            self.segment_number += 1
+            self.segment = open(os.path.join(self.directory, f"segment-{self.segment_number:05d}.zst"), "ab")
+        return self.segment
+
+    def store(self, url, body, status=200, kind="http"):
+        """Appends a fetched page to the archive. Does nothing in replay mode.
+
+        Args:
+            url (str): URL the page was fetched from.
+            body (str): Body of the page.
+            status (int, optional): HTTP status of the response. Defaults to 200.
+            kind (str, optional): "http" for plain requests, "browser" for Selenium page sources. Defaults to "http".
+        """
+        if self.replay:
+            return
+        data = body.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            known = self.index.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if known is None:
+                compressed = zstandard.ZstdCompressor(level=self.level).compress(data)
+                segment = self.open_segment()
+                offset = segment.tell()
+                segment.write(compressed)
+                segment.flush()
+                self.index.execute("INSERT INTO blobs (digest, segment, offset, length) VALUES (?, ?, ?, ?)",
+                                   (digest, os.path.basename(segment.name), offset, len(compressed)))
+            self.index.execute("INSERT INTO records (url, kind, status, fetched_at, digest) VALUES (?, ?, ?, ?, ?)",
+                               (url, kind, status, time.time(), digest))
+            self.index.commit()
+
+    def get(self, url, kind="http"):
+        """Reads the most recent copy of a page from the archive.
+
+        Args:
+            url (str): URL the page was fetched from.
+            kind (str, optional): "http" for plain requests, "browser" for Selenium page sources. Defaults to "http".
+
+        Returns:
+            tuple: The HTTP status and body of the page, or None if the page was never archived.
+        """
+        with self.lock:
+            row = self.index.execute(
+                "SELECT records.status, blobs.segment, blobs.offset, blobs.length FROM records "
+                "JOIN blobs ON blobs.digest = records.digest "
+                "WHERE records.url = ? AND records.kind = ? ORDER BY records.id DESC LIMIT 1",
+                (url, kind)).fetchone()
+        if row is None:
+            return None
+        status, segment, offset, length = row
+        with open(os.path.join(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            compressed = f.read(length)
+        return (status, zstandard.ZstdDecompressor().decompress(compressed).decode("utf-8"))
+
+    def response(self, url):
+        """Builds a response for a page from the archive, for use in place of a network request.
+
+        Args:
+            url (str): URL of the page.
+
+        Returns:
+            ArchivedResponse: The archived response, with status 404 if the page was never archived.
+        """
+        record = self.get(url)
+        if record is None:
+            return ArchivedResponse(url, 404, "")
+        return ArchivedResponse(url, record[0], record[1])
+
+    def urls(self, kind="http"):
+        """Returns every archived URL.
+
+        Args:
+            kind (str, optional): "http" for plain requests, "browser" for Selenium page sources. Defaults to "http".
+
+        Returns:
+            list[str]: The archived URLs.
+        """
+        with self.lock:
+            return [row[0] for row in self.index.execute("SELECT DISTINCT url FROM records WHERE kind = ?", (kind,))]
+
+    def close(self):
+        """Closes the current segment file and the index.
+
+        No parameters or return values.
+        """
+        with self.lock:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
+            self.index.close()
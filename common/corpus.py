@@ -0,0 +1,423 @@
+import zstandard
+import glob
+import io
+import json
+import os
+import threading
+import time
+
+from common.visited import VisitedSet
+
+# a writer holds a lock on its open shard, so recover_shards can tell the shards of dead writers
+# from the ones still being written. Without fcntl open shards are never recovered
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# orjson encodes and decodes several times faster when it is installed
+try:
+    import orjson
+
+    def dump_line(record):
+        return orjson.dumps(record) + b"\n"
+
+    load_line = orjson.loads
+except ImportError:
+    def dump_line(record):
+        return (json.dumps(record) + "\n").encode("utf-8")
+
+    load_line = json.loads
+
+SHARD_SUFFIX = ".jsonl.zst"
+
+
+class ShardedJsonlWriter:
+    def __init__(self, directory, max_records=10000, max_bytes=128 * 1024 * 1024, batch_size=256, level=3):
+        """Writes app records as JSON lines into zstd compressed shards instead of one JSON file per app.
+        Records are buffered and written in batches. A shard is written under a temporary name and
+        only renamed to its final name once it is complete, so readers never see half a shard.
+        sync makes the records written so far durable, crawl state that marks apps as done must only
+        be committed after it. Records synced to the shard of a writer that was killed are committed by
+        recover_shards when the next writer opens the directory.
+
+        Args:
+            directory (str): Directory the shards are written to.
+            max_records (int, optional): Number of records after which a new shard is started. Defaults to 10000.
+            max_bytes (int, optional): Uncompressed size in bytes after which a new shard is started. Defaults to 128 MB.
+            batch_size (int, optional): Number of records buffered before they are compressed and written. Defaults to 256.
+            level (int, optional): zstd compression level. Defaults to 3.
+        """
+        self.directory = directory
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.level = level
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        recover_shards(directory, level)
+
+        # unique per process and run, so crawls and re-parse workers never write to the same shard
+        self.prefix = f"part-{int(time.time() * 1000)}-{os.getpid()}"
+        self.shard_number = 0
+
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.shard = None
+        self.shard_file = None
+        self.shard_path = None
+        self.shard_records = 0
+        self.shard_bytes = 0
+        # whether records were written since the last sync
+        self.unsynced = False
+
+    def write(self, record):
+        """Adds a record to the corpus. The record is only durable once sync or close returned.
+
+        Args:
+            record (dict): The app's data.
+        """
+        line = dump_line(record)
+        with self.lock:
+            self.buffer.append(line)
+            self.unsynced = True
+            if len(self.buffer) >= self.batch_size:
+                self.flush_buffer()
+
+    def sync(self):
+        """Writes the buffered records and syncs the current shard to disk, so they survive the
+        process being killed or the machine losing power. The shard stays open, its compressed
+        blocks are flushed without ending the zstd frame.
+
+        No parameters or return values.
+        """
+        with self.lock:
+            if not self.unsynced:
+                return
+            self.flush_buffer()
+            if self.shard is not None:
+                self.shard.flush(zstandard.FLUSH_BLOCK)
+                self.shard_file.flush()
+                os.fsync(self.shard_file.fileno())
+            self.unsynced = False
+
+    def flush_buffer(self):
+        """Compresses the buffered records into the current shard, and commits the shard when it is full.
+        Must be called with the lock held.
+        """
+        if not self.buffer:
+            return
+        if self.shard is None:
+            self.open_shard()
+        data = b"".join(self.buffer)
+        self.shard.write(data)
+        self.shard_records += len(self.buffer)
+        self.shard_bytes += len(data)
+        self.buffer = []
+        if self.shard_records >= self.max_records or self.shard_bytes >= self.max_bytes:
+            self.commit_shard()
+
+    def open_shard(self):
+        """Starts a new shard under its temporary name. Must be called with the lock held.
+        """
+        self.shard_number += 1
+        self.shard_path = os.path.join(self.directory, f"{self.prefix}-{self.shard_number:05d}{SHARD_SUFFIX}")
+        self.shard_file = open(self.shard_path + ".tmp", "wb")
+        if fcntl is not None:
+            # held until the shard is committed, the kernel releases it however the process dies
+            fcntl.flock(self.shard_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.shard = zstandard.ZstdCompressor(level=self.level).stream_writer(self.shard_file, closefd=False)
+        self.shard_records = 0
+        self.shard_bytes = 0
+
+    def commit_shard(self):
+        """Finishes the current shard, syncs it to disk and renames it to its final name.
+        Must be called with the lock held.
+        """
+        # ends the zstd frame, the file is left open to be synced
+        self.shard.close()
+        self.shard_file.flush()
+        os.fsync(self.shard_file.fileno())
+        # renamed before the file and its lock are released, so recover_shards never sees a committed shard
+        os.replace(self.shard_path + ".tmp", self.shard_path)
+        self.shard_file.close()
+        sync_directory(self.directory)
+        self.shard = None
+
+    def close(self):
+        """Writes the buffered records and commits the last shard.
+
+        No parameters or return values.
+        """
+        with self.lock:
+            self.flush_buffer()
+            if self.shard is not None:
+                self.commit_shard()
+            self.unsynced = False
+
+
+def sync_directory(directory):
+    """Syncs a directory to disk, so a file renamed into it survives a power loss.
+
+    Args:
+        directory (str): The directory.
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_synced_records(file):
+    """Reads the complete records from a shard that was never committed. Its zstd frame is cut off
+    after the last synced block, and the last line may be cut off as well.
+
+    Args:
+        file (file): The shard, opened for binary reading.
+
+    Returns:
+        bytes: The complete JSON lines.
+    """
+    reader = zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True)
+    chunks = []
+    try:
+        while True:
+            chunk = reader.read(1024 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except zstandard.ZstdError:
+        # a block that was only partly written before the crash
+        pass
+    data = b"".join(chunks)
+    return data[:data.rfind(b"\n") + 1]
+
+
+def recover_shards(directory, level=3):
+    """Commits the shards left behind by writers that were killed, e.g. by SIGKILL, the OOM killer or
+    a power loss, with the records that were synced to them. Shards whose writer is still running are
+    left alone.
+
+    Args:
+        directory (str): Directory holding the shards.
+        level (int, optional): zstd compression level of the recovered shards. Defaults to 3.
+
+    Returns:
+        int: Number of records recovered.
+    """
+    if fcntl is None:
+        return 0
+    recovered = 0
+    for tmp_path in sorted(glob.glob(os.path.join(directory, "*" + SHARD_SUFFIX + ".tmp"))):
+        try:
+            file = open(tmp_path, "rb")
+        except FileNotFoundError:
+            # committed in the meantime
+            continue
+        with file:
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # its writer is still running
+                continue
+            try:
+                if os.stat(tmp_path).st_ino != os.fstat(file.fileno()).st_ino:
+                    continue
+            except FileNotFoundError:
+                continue
+            data = read_synced_records(file)
+
+        shard_path = tmp_path[:-len(".tmp")]
+        if data:
+            # the shard keeps the name its writer gave it, so recovering it twice after a crash is harmless
+            with open(shard_path + ".recover", "wb") as output:
+                output.write(zstandard.ZstdCompressor(level=level).compress(data))
+                output.flush()
+                os.fsync(output.fileno())
+            os.replace(shard_path + ".recover", shard_path)
+            recovered += data.count(b"\n")
+        os.remove(tmp_path)
+        sync_directory(directory)
+    if recovered:
+        print(f"Recovered {recovered} records from uncommitted shards in {directory}")
+    return recovered
+
+
+def read_shards(directory):
+    """Reads every record from the committed shards in a directory. Shards that were never
+    committed, e.g. because the crawl was killed, are skipped.
+
+    Args:
+        directory (str): Directory holding the shards.
+
+    Yields:
+        dict: The data of one app.
+    """
+    for path in sorted(glob.glob(os.path.join(directory, "*" + SHARD_SUFFIX))):
+        yield from read_shard(path)
+
+
+def read_shard(path):
+    """Reads every record from one shard.
+
+    Args:
+        path (str): Path of the shard.
+
+    Yields:
+        dict: The data of one app.
+    """
+    with open(path, "rb") as file:
+        reader = zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True)
+        for line in io.BufferedReader(reader):
+            if line.strip():
+                yield load_line(line)
+
+
+def record_app_id(record):
+    """Returns the App ID of a record, in the iOS layout with an app_info dictionary or the flat Android layout.
+
+    Args:
+        record (dict): The data of one app.
+
+    Returns:
+        int | str: The App ID, or None if the record has none.
+    """
+    app_info = record.get("app_info")
+    return (app_info if isinstance(app_info, dict) else record).get("App ID")
+
+
+def read_corpus(directory):
+    """Reads every app in a directory, from the shards and from JSON files written one per app.
+    An app saved more than once, e.g. again by a refresh, is read once, with the record written last.
+    Shards are read newest first, their names start with the time their writer opened, and the JSON
+    files after them, as apps are only written to JSON files while no shards are written.
+
+    Args:
+        directory (str): Directory holding the shards and JSON files.
+
+    Yields:
+        dict: The data of one app.
+    """
+    seen = VisitedSet()
+
+    def latest(records):
+        for record in records:
+            app_id = record_app_id(record)
+            if app_id is not None:
+                if app_id in seen:
+                    continue
+                seen.add(app_id)
+            yield record
+
+    for path in sorted(glob.glob(os.path.join(directory, "*" + SHARD_SUFFIX)), reverse=True):
+        # a shard is read whole to go through it backwards, it holds at most max_records records
+        yield from latest(reversed(list(read_shard(path))))
+    for filename in os.listdir(directory):
+        if filename.endswith(".json"):
+            with open(os.path.join(directory, filename), "rb") as file:
+                yield from latest([load_line(file.read())])
+
+
+def column_array(values):
+    """Builds an Arrow array from a column. Columns mixing types, e.g. False and "9+",
+    are stored as strings.
+
+    Args:
+        values (list): The values of the column.
+
+    Returns:
+        pyarrow.Array: The column.
+    """
+    import pyarrow as pa
+    types = {type(value) for value in values if value is not None}
+    if len(types) > 1:
+        values = [None if value is None else str(value) for value in values]
+    return pa.array(values)
+
+
+def rows_to_table(rows):
+    """Builds an Arrow table from a list of dictionaries. Keys missing from a row become nulls.
+
+    Args:
+        rows (list[dict]): The rows.
+
+    Returns:
+        pyarrow.Table: The table.
+    """
+    import pyarrow as pa
+    columns = {}
+    for row in rows:
+        for key in row:
+            columns.setdefault(key, None)
+    return pa.table({key: column_array([row.get(key) for row in rows]) for key in columns})
+
+
+def export_parquet(directory, output_directory, flatten):
+    """Exports a corpus to two Parquet files, apps.parquet with one row per app and labels.parquet
+    with one row per privacy label entry. Needs pyarrow.
+
+    Args:
+        directory (str): Directory holding the shards and JSON files.
+        output_directory (str): Directory the Parquet files are written to.
+        flatten (function): Takes an app's data and returns its app row and its label rows.
+    """
+    import pyarrow.parquet as pq
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    apps = []
+    labels = []
+    for record in read_corpus(directory):
+        app_row, label_rows = flatten(record)
+        apps.append(app_row)
+        labels.extend(label_rows)
+
+    pq.write_table(rows_to_table(apps), os.path.join(output_directory, "apps.parquet"))
+    pq.write_table(rows_to_table(labels), os.path.join(output_directory, "labels.parquet"))
+
+
+def test_killed_writer_keeps_visited_apps(tmp_path):
+    import pytest
+    import signal
+    import subprocess
+    import sys
+    from common.frontier import CrawlFrontier
+
+    if fcntl is None:
+        pytest.skip("open shards are only recovered where fcntl is available")
+
+    corpus = tmp_path / "corpus"
+    frontier_path = tmp_path / "frontier.db"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # a crawl marking apps visited as it writes them, killed halfway through its first shard
+    crawl = f"""
+import os, signal, sys
+sys.path.insert(0, {root!r})
+from common.corpus import ShardedJsonlWriter
+from common.frontier import CrawlFrontier
+writer = ShardedJsonlWriter({str(corpus)!r}, max_records=1000, batch_size=8)
+frontier = CrawlFrontier({str(frontier_path)!r}, checkpoint_every=10, before_commit=writer.sync)
+for app_id in range(495):
+    writer.write({{"app_info": {{"App ID": app_id}}}})
+    frontier.finish(str(app_id))
+os.kill(os.getpid(), signal.SIGKILL)
+"""
+    result = subprocess.run([sys.executable, "-c", crawl])
+    assert result.returncode == -signal.SIGKILL
+
+    frontier = CrawlFrontier(str(frontier_path))
+    visited = {int(app_key) for app_key in frontier.visited_keys()}
+    frontier.close()
+    assert len(visited) >= 490
+    # the shard was never committed
+    assert list(read_shards(str(corpus))) == []
+
+    # the next writer recovers it, every app the frontier says is done is in the corpus
+    ShardedJsonlWriter(str(corpus)).close()
+    saved = {record["app_info"]["App ID"] for record in read_shards(str(corpus))}
+    assert visited <= saved
+    assert glob.glob(str(corpus / "*.tmp")) == []
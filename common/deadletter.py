@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+import time
+
+
+class DeadLetterQueue:
+    def __init__(self, path, backoff=600, max_backoff=7 * 24 * 3600):
+        """A persistent queue of the links that failed after every retry, kept in SQLite so failed
+        apps are not lost when the crawl moves on. Each link is due for another attempt after a
+        delay that doubles with every failure.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            backoff (float, optional): Seconds until the first re-drive of a link. Defaults to 10 minutes.
+            max_backoff (float, optional): Longest delay between re-drives in seconds. Defaults to a week.
+        """
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                url TEXT PRIMARY KEY,
+                error TEXT NOT NULL,
+                error_type TEXT NOT NULL,
+                failures INTEGER NOT NULL,
+                first_failed REAL NOT NULL,
+                last_failed REAL NOT NULL,
+                next_attempt REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.connection.commit()
+
+    def add(self, url, error):
+        """Records a failed link, or one more failure of a link that is already queued.
+
+        Args:
+            url (str): The link that failed.
+            error (Exception): Why it failed.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT failures FROM dead_letters WHERE url = ?", (url,)).fetchone()
+            failures = 1 if row is None else row[0] + 1
+            next_attempt = now + min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+            self.connection.execute(
+                "INSERT INTO dead_letters (url, error, error_type, failures, first_failed, last_failed, next_attempt) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET error = excluded.error, error_type = excluded.error_type, "
+                "failures = excluded.failures, last_failed = excluded.last_failed, next_attempt = excluded.next_attempt",
+                (url, str(error), type(error).__name__, failures, now, now, next_attempt))
+            self.connection.commit()
+
+    def due(self, limit=None):
+        """Returns the links whose next attempt is due, oldest first.
+
+        Args:
+            limit (int, optional): Maximum number of links. Defaults to every due link.
+
+        Returns:
+            list[str]: The links.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT url FROM dead_letters WHERE next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+                (time.time(), -1 if limit is None else limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def remove(self, url):
+        """Removes a link that succeeded on a later attempt.
+
+        Args:
+            url (str): The link.
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM dead_letters WHERE url = ?", (url,))
+            self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def close(self):
+        """Closes the database.
+
+        No parameters or return values.
+        """
+        with self.lock:
+            self.connection.close()
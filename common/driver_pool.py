@@ -0,0 +1,143 @@
+from selenium import webdriver
+from contextlib import contextmanager
+import queue
+import threading
+
+from common.metrics import crawl_metrics
+
+
+class DriverPool:
+    def __init__(self, service, size=2, max_pages=100, headless=True):
+        """A bounded pool of long lived Chrome sessions that scrapers borrow instead of 
+        starting a new browser for every page.
+
+        Args:
+            service (selenium.webdriver.chrome.service.Service): Chromedriver service used to start browsers.
+            size (int, optional): Maximum number of browsers open at once. Defaults to 2.
+            max_pages (int, optional): Number of pages a browser serves before it is recycled. Defaults to 100.
+            headless (bool, optional): Whether to run Chrome without a window. Defaults to True.
+        """
+        self.service = service
+        self.size = size
+        self.max_pages = max_pages
+        self.headless = headless
+        
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        
+        self.page_counts = {}
+        
+        self.closed = False
+
+    def create_driver(self):
+        """Starts a new Chrome session.
+
+        Returns:
+            selenium.webdriver.Chrome: The new browser.
+        """
+        options = webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument("--headless=new")
+        with crawl_metrics.stage("selenium_startup"):
+            driver = webdriver.Chrome(service=self.service, options=options)
+        with self.lock:
+            self.page_counts[driver] = 0
+        return driver
+
+    def is_healthy(self, driver):
+        """Checks that a browser still responds to commands.
+
+        Args:
+            driver (selenium.webdriver.Chrome): The browser to check.
+
+        Returns:
+            bool: True if the browser responded, False if it has crashed or hung up.
+        """
+        try:
+            driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def discard(self, driver):
+        """Quits a browser and forgets it.
+
+        Args:
+            driver (selenium.webdriver.Chrome): The browser to quit.
+        """
+        with self.lock:
+            self.page_counts.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"Failed to quit WebDriver: {e}")
+
+    def acquire(self, timeout=None):
+        """Borrows a healthy browser from the pool, starting one if none are idle.
+        Blocks while all browsers are in use.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a free browser. Defaults to waiting forever.
+
+        Returns:
+            selenium.webdriver.Chrome: The borrowed browser.
+        """
+        if self.closed:
+            raise RuntimeError("WebDriver pool is closed")
+        if not self.slots.acquire(timeout=timeout):
+            raise TimeoutError("No WebDriver became available in the pool")
+        try:
+            while True:
+                try:
+                    driver = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.create_driver()
+                if self.is_healthy(driver):
+                    return driver
+                self.discard(driver)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, driver):
+        """Returns a borrowed browser to the pool. Browsers that have served max_pages pages
+        or that no longer respond are quit so a fresh one is started on the next acquire.
+
+        Args:
+            driver (selenium.webdriver.Chrome): The browser to return.
+        """
+        with self.lock:
+            self.page_counts[driver] = self.page_counts.get(driver, 0) + 1
+            recycle = self.closed or self.page_counts[driver] >= self.max_pages
+        if recycle or not self.is_healthy(driver):
+            self.discard(driver)
+        else:
+            self.idle.put(driver)
+        self.slots.release()
+
+    @contextmanager
+    def borrow(self):
+        """Context manager that acquires a browser and always releases it afterwards.
+
+        Yields:
+            selenium.webdriver.Chrome: The borrowed browser.
+        """
+        driver = self.acquire()
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close(self):
+        """Quits every idle browser. Browsers still borrowed are quit when they are released.
+
+        No parameters or return values.
+        """
+        self.closed = True
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+import time
+
+
+class CrawlFrontier:
+    def __init__(self, path, checkpoint_every=100, checkpoint_interval=30, before_commit=None):
+        """An on-disk crawl frontier stored in SQLite. The queue of app links, the set of visited
+        apps and the links discovered between apps survive restarts, so a crawl resumes
+        where it stopped without fetching anything again.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            checkpoint_every (int, optional): Number of changes after which they are committed. Defaults to 100.
+            checkpoint_interval (float, optional): Seconds after which pending changes are committed. Defaults to 30.
+            before_commit (function, optional): Called before every commit, e.g. to sync the corpus the visited
+                apps were written to, so no app is marked visited before its data is on disk. Defaults to None.
+        """
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.before_commit = before_commit
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                app_key TEXT UNIQUE NOT NULL,
+                url TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS visited (
+                app_key TEXT PRIMARY KEY
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS edges (
+                src TEXT NOT NULL,
+                dst TEXT NOT NULL,
+                PRIMARY KEY (src, dst)
+            ) WITHOUT ROWID;
+        """)
+        self.connection.commit()
+
+        # links handed out by pop during this run, they stay on disk until they are finished
+        self.last_seq = 0
+
+        self.pending_changes = 0
+        self.last_checkpoint = time.monotonic()
+
+    def is_empty(self):
+        """Checks whether the crawl has not started yet.
+
+        Returns:
+            bool: True if nothing has been queued or visited.
+        """
+        with self.lock:
+            queued = self.connection.execute("SELECT 1 FROM frontier LIMIT 1").fetchone()
+            visited = self.connection.execute("SELECT 1 FROM visited LIMIT 1").fetchone()
+        return queued is None and visited is None
+
+    def visited_keys(self):
+        """Returns the keys of every app that has been visited.
+
+        Returns:
+            list[str]: The visited app keys.
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT app_key FROM visited")]
+
+    def queued_urls(self):
+        """Returns the links still waiting in the frontier, oldest first.
+
+        Returns:
+            list[str]: The queued app links.
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT url FROM frontier ORDER BY seq")]
+
+    def push(self, app_key, url):
+        """Adds an app link to the end of the frontier, unless the app is already queued or visited.
+
+        Args:
+            app_key (str): Key identifying the app.
+            url (str): Link of the app.
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO frontier (app_key, url) "
+                "SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM visited WHERE app_key = ?)",
+                (app_key, url, app_key))
+            self.record_change()
+
+    def pop(self):
+        """Returns the oldest app link that has not been handed out during this run.
+        The link stays in the frontier until finish is called, so it is crawled again after a crash.
+
+        Returns:
+            str: The app link, or None if the frontier is exhausted.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT seq, url FROM frontier WHERE seq > ? ORDER BY seq LIMIT 1", (self.last_seq,)).fetchone()
+        if row is None:
+            return None
+        self.last_seq = row[0]
+        return row[1]
+
+    def finish(self, app_key, visited=True):
+        """Removes an app from the frontier.
+
+        Args:
+            app_key (str): Key identifying the app.
+            visited (bool, optional): Whether the app was scraped and belongs in the visited set. Defaults to True.
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM frontier WHERE app_key = ?", (app_key,))
+            if visited:
+                self.connection.execute("INSERT OR IGNORE INTO visited (app_key) VALUES (?)", (app_key,))
+            self.record_change()
+
+    def add_edges(self, src, dsts):
+        """Stores the links discovered on an app's page.
+
+        Args:
+            src (str): Key of the app the links were found on.
+            dsts (list[str]): Keys of the apps that were linked to.
+        """
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO edges (src, dst) VALUES (?, ?)", [(src, dst) for dst in dsts])
+            self.record_change()
+
+    def record_change(self):
+        """Counts a change and commits once enough changes or time have accumulated.
+        Must be called with the lock held.
+        """
+        self.pending_changes += 1
+        if (self.pending_changes >= self.checkpoint_every
+                or time.monotonic() - self.last_checkpoint >= self.checkpoint_interval):
+            self.commit()
+
+    def commit(self):
+        """Commits the pending changes, after before_commit. Must be called with the lock held.
+        """
+        if self.before_commit is not None:
+            self.before_commit()
+        self.connection.commit()
+        self.pending_changes = 0
+        self.last_checkpoint = time.monotonic()
+
+    def checkpoint(self):
+        """Commits every pending change to disk.
+
+        No parameters or return values.
+        """
+        with self.lock:
+            self.commit()
+
+    def close(self):
+        """Commits pending changes and closes the database.
+
+        No parameters or return values.
+        """
+        self.checkpoint()
+        self.connection.close()
@@ -0,0 +1,173 @@
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import time
+from urllib.parse import urlsplit
+
+from common.metrics import crawl_metrics
+from common.ratelimit import HostRateLimiter, RETRY_STATUSES, parse_retry_after, retry_delay
+
+# brotli responses can only be decoded when the brotli package is installed
+try:
+    import brotli
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+class HttpClient:
+    def __init__(self, pool_size=20, connect_timeout=5, read_timeout=30, http2=False, archive=None,
+                 rate_limiter=None, retries=3, backoff=0.5, max_backoff=60):
+        """A transport shared by every scraper. Connections are kept alive and pooled per host,
+        so the TCP and TLS handshakes are only paid once per host instead of once per request.
+
+        Args:
+            pool_size (int, optional): Number of keep-alive connections kept per host. Defaults to 20.
+            connect_timeout (float, optional): Seconds to wait for a connection. Defaults to 5.
+            read_timeout (float, optional): Seconds to wait for the response. Defaults to 30.
+            http2 (bool, optional): Whether to multiplex requests over HTTP/2, which needs httpx[http2]. Defaults to False.
+            archive (common.archive.PageArchive, optional): Archive every response is saved to, or read from in replay mode. Defaults to None.
+            rate_limiter (common.ratelimit.HostRateLimiter, optional): Paces the requests to each host. Defaults to a new HostRateLimiter.
+            retries (int, optional): Number of retries after a connection error, a timeout or a 429 or 5xx response. Defaults to 3.
+            backoff (float, optional): Base delay of the jittered exponential backoff between retries in seconds. Defaults to 0.5.
+            max_backoff (float, optional): Longest delay between retries in seconds. Defaults to 60.
+        """
+        self.archive = archive
+        self.rate_limiter = rate_limiter if rate_limiter is not None else HostRateLimiter()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2
+
+        if http2:
+            import httpx
+            self.transport_errors = (httpx.TransportError,)
+            self.session = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                follow_redirects=True)
+        else:
+            self.transport_errors = (requests.ConnectionError, requests.Timeout)
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": ACCEPT_ENCODING})
+
+    def get(self, url, headers=None, timeout=None):
+        """Sends a GET request over a pooled connection, paced by the rate limiter of its host.
+        Connection errors, timeouts and 429 or 5xx responses are retried after a jittered backoff,
+        or after the Retry-After the server sent.
+
+        Args:
+            url (str): URL to fetch.
+            headers (dict, optional): Extra headers for this request. Defaults to None.
+            timeout (float, optional): Read timeout for this request. Defaults to the client's read_timeout.
+
+        Returns:
+            requests.Response | httpx.Response: The response, with status_code and text. The last response
+                if every retry failed with a retryable status.
+
+        Raises:
+            requests.RequestException | httpx.HTTPError: The error of the last attempt if none got a response.
+        """
+        if self.archive is not None and self.archive.replay:
+            return self.archive.response(url)
+        if timeout is None:
+            timeout = self.read_timeout
+        host = urlsplit(url).netloc
+
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire(host)
+            try:
+                res = self.send(url, headers, timeout)
+            except self.transport_errors as e:
+                self.rate_limiter.record(host, None)
+                if attempt == self.retries:
+                    raise
+                crawl_metrics.count("retries")
+                print(f"Retrying {url} - {e}")
+                time.sleep(retry_delay(attempt, self.backoff, self.max_backoff))
+                continue
+
+            retry_after = parse_retry_after(res.headers.get("Retry-After"))
+            self.rate_limiter.record(host, res.status_code, retry_after)
+            if res.status_code not in RETRY_STATUSES or attempt == self.retries:
+                break
+            crawl_metrics.count("retries")
+            crawl_metrics.count(f"http_{res.status_code}")
+            time.sleep(retry_delay(attempt, self.backoff, self.max_backoff, retry_after))
+
+        # time from sending the request until the response headers arrived, including connecting
+        crawl_metrics.observe("fetch_headers", res.elapsed.total_seconds())
+        if res.status_code >= 400:
+            crawl_metrics.count("http_errors")
+        if res.status_code == 304:
+            # answer to a conditional request, the page has no body and the archived copy is still current
+            crawl_metrics.count("not_modified")
+            return res
+        if self.archive is not None:
+            with crawl_metrics.stage("archive_write"):
+                self.archive.store(url, res.text, res.status_code)
+        return res
+
+    def send(self, url, headers, timeout):
+        """Sends one GET request, without pacing or retries.
+
+        Args:
+            url (str): URL to fetch.
+            headers (dict): Extra headers for this request, or None.
+            timeout (float): Read timeout in seconds.
+
+        Returns:
+            requests.Response | httpx.Response: The response.
+        """
+        with crawl_metrics.stage("fetch"):
+            if self.http2:
+                import httpx
+                return self.session.get(url, headers=headers, timeout=httpx.Timeout(timeout, connect=self.connect_timeout))
+            return self.session.get(url, headers=headers, timeout=(self.connect_timeout, timeout))
+
+    def close(self):
+        """Closes every pooled connection.
+
+        No parameters or return values.
+        """
+        self.session.close()
+
+
+shared_client = None
+shared_client_lock = threading.Lock()
+
+
+def configure_client(**kwargs):
+    """Replaces the shared HttpClient with one built from the given options, e.g. to attach an archive.
+
+    Args:
+        **kwargs: Arguments passed to HttpClient.
+
+    Returns:
+        HttpClient: The new shared client.
+    """
+    global shared_client
+    with shared_client_lock:
+        if shared_client is not None:
+            shared_client.close()
+        shared_client = HttpClient(**kwargs)
+        return shared_client
+
+
+def get_client():
+    """Returns the HttpClient shared by all scrapers in this process, creating it on first use.
+
+    Returns:
+        HttpClient: The shared client.
+    """
+    global shared_client
+    with shared_client_lock:
+        if shared_client is None:
+            shared_client = HttpClient()
+        return shared_client
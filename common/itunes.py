@@ -0,0 +1,241 @@
+from collections import OrderedDict
+import json
+import threading
+from urllib.parse import urlencode
+
+from common.http import get_client
+
+LOOKUP_URL = "https://itunes.apple.com/lookup"
+
+
+def app_info_fields(result):
+    """Maps a Lookup API result to the app_info fields of iOS.scrape_appinfo it has exactly.
+
+    Args:
+        result (dict): One entry of the "results" of a Lookup response.
+
+    Returns:
+        dict: App name, category, price, rating, number of ratings and age rating.
+    """
+    return {
+        "App Name": result.get("trackName"),
+        "App Category": result.get("primaryGenreName"),
+        "Price": result.get("formattedPrice"),
+        "App Rating": float(result.get("averageUserRating") or 0.0),
+        "No. of Ratings": int(result.get("userRatingCount") or 0),
+        "Age Rating": result.get("contentAdvisoryRating"),
+    }
+
+
+class ITunesLookup:
+    def __init__(self, http_client=None, country="us", batch_size=200, url=LOOKUP_URL, max_results=10000):
+        """Reads app metadata from the iTunes Lookup API, which answers for up to ~200 app IDs per
+        request with exact numbers, e.g. 7534 ratings where the app page shows "7.5K". Apps the crawl
+        is about to scrape are registered with expect, the lookup of one app then fetches the
+        others in the same request.
+
+        Args:
+            http_client (common.http.HttpClient, optional): Client for the requests. Defaults to the shared client.
+            country (str, optional): Store front to look the apps up in. Defaults to "us".
+            batch_size (int, optional): Maximum number of app IDs per request. Defaults to 200.
+            url (str, optional): URL of the Lookup endpoint, e.g. a local stub in tests. Defaults to LOOKUP_URL.
+            max_results (int, optional): Maximum number of results kept for apps that were not asked for yet.
+                The oldest are dropped first, an app whose result was dropped is looked up again. Defaults to 10000.
+        """
+        self.http = http_client if http_client is not None else get_client()
+        self.country = country
+        self.batch_size = batch_size
+        self.url = url
+        self.max_results = max_results
+
+        self.lock = threading.Lock()
+        # app IDs expected to be looked up soon, in the order they were registered
+        self.expected = {}
+        # app ID -> app_info fields, dropped once they were handed out so the cache stays small.
+        # Apps that are never scraped, e.g. because they were already processed, are evicted oldest first
+        self.results = OrderedDict()
+        # app ID -> event set once the batch looking it up returned, so every app is looked up once
+        self.in_flight = {}
+
+    def expect(self, app_ids):
+        """Registers apps that will be looked up soon, so they are fetched in the batch of an earlier lookup.
+
+        Args:
+            app_ids (iterable): App IDs, None entries are ignored.
+        """
+        with self.lock:
+            for app_id in app_ids:
+                if app_id is not None and app_id not in self.results and app_id not in self.in_flight:
+                    self.expected[app_id] = None
+
+    def get(self, app_id):
+        """Returns the metadata of an app, fetching it together with up to batch_size - 1 expected apps.
+        If the app is in a batch another thread is looking up, waits for that batch instead.
+
+        Args:
+            app_id (int): The app's ID.
+
+        Returns:
+            dict: The app_info fields from app_info_fields, or None if the app is not in the store front
+                or the lookup failed.
+        """
+        with self.lock:
+            if app_id in self.results:
+                return self.results.pop(app_id)
+            done = self.in_flight.get(app_id)
+            if done is None:
+                self.expected.pop(app_id, None)
+                batch = [app_id]
+                for expected_id in list(self.expected):
+                    if len(batch) >= self.batch_size:
+                        break
+                    del self.expected[expected_id]
+                    batch.append(expected_id)
+                for batch_id in batch:
+                    self.in_flight[batch_id] = threading.Event()
+
+        if done is not None:
+            done.wait()
+            with self.lock:
+                return self.results.pop(app_id, None)
+
+        results = {}
+        try:
+            results = self.fetch(batch)
+        finally:
+            # also when the fetch was interrupted, e.g. by KeyboardInterrupt, so no thread waits forever.
+            # Threads waiting for an app of an interrupted batch get None, as for a failed request
+            with self.lock:
+                for other_id in batch[1:]:
+                    if other_id in results:
+                        self.results[other_id] = results[other_id]
+                while len(self.results) > self.max_results:
+                    self.results.popitem(last=False)
+                for batch_id in batch:
+                    self.in_flight.pop(batch_id).set()
+        return results.get(app_id)
+
+    def fetch(self, app_ids):
+        """Looks up a batch of apps in one request.
+
+        Args:
+            app_ids (list[int]): Up to batch_size app IDs.
+
+        Returns:
+            dict: The app_info fields of every app found, by app ID.
+        """
+        query = urlencode({"id": ",".join(str(app_id) for app_id in app_ids), "country": self.country, "entity": "software"})
+        try:
+            res = self.http.get(f"{self.url}?{query}")
+            if res.status_code != 200:
+                print(f"Error looking up {len(app_ids)} apps - Status code: {res.status_code}")
+                return {}
+            data = json.loads(res.text)
+        except Exception as e:
+            print(f"Error looking up {len(app_ids)} apps - {e}")
+            return {}
+        return {result["trackId"]: app_info_fields(result)
+                for result in data.get("results", []) if result.get("trackId") is not None}
+
+
+def run_lookup_stub(requests, delay=0.0):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlsplit
+    import time
+
+    class LookupStub(BaseHTTPRequestHandler):
+        def do_GET(self):
+            ids = parse_qs(urlsplit(self.path).query)["id"][0].split(",")
+            requests.append(ids)
+            time.sleep(delay)
+            # app 3 is not in the store front
+            results = [{"trackId": int(app_id), "trackName": f"App {app_id}", "primaryGenreName": "Games",
+                        "formattedPrice": "Free", "averageUserRating": 4.61, "userRatingCount": 7534,
+                        "contentAdvisoryRating": "4+"} for app_id in ids if app_id != "3"]
+            body = json.dumps({"resultCount": len(results), "results": results}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LookupStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_itunes_lookup_batches():
+    from common.http import HttpClient
+
+    requests = []
+    server = run_lookup_stub(requests)
+    try:
+        lookup = ITunesLookup(HttpClient(), batch_size=2, url=f"http://127.0.0.1:{server.server_port}/lookup")
+        lookup.expect([1, 2, 3])
+        assert lookup.get(1)["No. of Ratings"] == 7534
+        # app 2 came with app 1
+        assert lookup.get(2)["App Name"] == "App 2"
+        assert lookup.get(3) is None
+        assert requests == [["1", "2"], ["3"]]
+
+        # results of apps that are never asked for are evicted, oldest first
+        lookup = ITunesLookup(HttpClient(), batch_size=4, url=f"http://127.0.0.1:{server.server_port}/lookup", max_results=1)
+        lookup.expect([5, 6, 7])
+        lookup.get(4)
+        assert list(lookup.results) == [7]
+    finally:
+        server.shutdown()
+
+
+def test_itunes_lookup_in_flight_batch():
+    from common.http import HttpClient
+    import time
+
+    requests = []
+    server = run_lookup_stub(requests, delay=0.3)
+    try:
+        lookup = ITunesLookup(HttpClient(), batch_size=2, url=f"http://127.0.0.1:{server.server_port}/lookup")
+        lookup.expect([1, 2])
+        first = threading.Thread(target=lookup.get, args=(1,))
+        first.start()
+        time.sleep(0.1)
+        # app 2 is in the batch of app 1, which is still in flight
+        assert lookup.get(2)["App Name"] == "App 2"
+        first.join()
+        assert requests == [["1", "2"]]
+        assert not lookup.in_flight and not lookup.results
+    finally:
+        server.shutdown()
+
+
+def test_itunes_lookup_interrupted_batch():
+    import pytest
+    import time
+
+    class InterruptedLookup(ITunesLookup):
+        def fetch(self, app_ids):
+            self.fetched.append(app_ids)
+            # long enough for the other thread to wait for app 2
+            time.sleep(0.3)
+            raise KeyboardInterrupt
+
+    lookup = InterruptedLookup(batch_size=2)
+    lookup.fetched = []
+    lookup.expect([1, 2])
+    results = []
+
+    def wait_for_app_2():
+        while 2 not in lookup.in_flight:
+            time.sleep(0.01)
+        results.append(lookup.get(2))
+
+    waiter = threading.Thread(target=wait_for_app_2, daemon=True)
+    waiter.start()
+    with pytest.raises(KeyboardInterrupt):
+        lookup.get(1)
+    waiter.join(timeout=5)
+    # the waiting thread was woken up instead of blocking forever
+    assert not waiter.is_alive() and results == [None]
+    assert lookup.fetched == [[1, 2]] and not lookup.in_flight
@@ -0,0 +1,241 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+# upper bounds in seconds of the latency histogram buckets, from a cached parse to a slow browser start
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class CrawlMetrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Counters and latency histograms for every stage of a crawl, e.g. fetch, parse,
+        Selenium startup and JSON writes. Snapshots can be appended to a JSONL file or written
+        in the Prometheus text format, once or periodically from a background thread.
+
+        Args:
+            buckets (list[float], optional): Upper bounds in seconds of the histogram buckets. Defaults to LATENCY_BUCKETS.
+        """
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+        self.counters = {}
+        # (stage, exception type) -> count
+        self.errors = {}
+        # stage -> {"buckets": counts per bucket with one more for +Inf, "sum": seconds, "count": observations}
+        self.stages = {}
+
+        # apps done at the last snapshot, for the recent apps per minute rate
+        self.last_snapshot = (self.started, 0)
+
+        self.exporter = None
+        self.exporter_stop = threading.Event()
+
+    def count(self, name, amount=1):
+        """Adds to a counter, e.g. "apps" for every app that was scraped.
+
+        Args:
+            name (str): Name of the counter.
+            amount (int, optional): How much to add. Defaults to 1.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def error(self, stage, error):
+        """Counts an exception raised in a stage, by its type.
+
+        Args:
+            stage (str): Name of the stage.
+            error (Exception): The exception.
+        """
+        key = (stage, type(error).__name__)
+        with self.lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def observe(self, stage, seconds):
+        """Records how long one run of a stage took.
+
+        Args:
+            stage (str): Name of the stage.
+            seconds (float): Duration in seconds.
+        """
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self.stages[stage] = histogram
+            histogram["buckets"][bisect_left(self.buckets, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    @contextmanager
+    def stage(self, name):
+        """Times the body of a with statement as a run of the given stage. Exceptions are
+        counted as errors of the stage and passed on.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.error(name, e)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Returns the current state of every counter and histogram.
+
+        Returns:
+            dict: The snapshot, with apps per minute since the start and since the previous snapshot.
+        """
+        now = time.time()
+        with self.lock:
+            apps = self.counters.get("apps", 0)
+            last_time, last_apps = self.last_snapshot
+            self.last_snapshot = (now, apps)
+            stages = {}
+            for name, histogram in self.stages.items():
+                stages[name] = {
+                    "count": histogram["count"],
+                    "sum": round(histogram["sum"], 6),
+                    "mean": round(histogram["sum"] / histogram["count"], 6),
+                    "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], histogram["buckets"])),
+                }
+            return {
+                "time": now,
+                "uptime": round(now - self.started, 3),
+                "apps_per_minute": round(60 * (apps - last_apps) / max(now - last_time, 1e-9), 3),
+                "apps_per_minute_overall": round(60 * apps / max(now - self.started, 1e-9), 3),
+                "counters": dict(self.counters),
+                "errors": [{"stage": stage, "type": error_type, "count": count}
+                           for (stage, error_type), count in sorted(self.errors.items())],
+                "stages": stages,
+            }
+
+    def prometheus_text(self, snapshot=None):
+        """Formats a snapshot in the Prometheus text exposition format.
+
+        Args:
+            snapshot (dict, optional): Snapshot to format. Defaults to a new snapshot.
+
+        Returns:
+            str: The metrics, one sample per line.
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE scraper_{name}_total counter")
+            lines.append(f"scraper_{name}_total {value}")
+
+        lines.append("# TYPE scraper_apps_per_minute gauge")
+        lines.append(f"scraper_apps_per_minute {snapshot['apps_per_minute']}")
+
+        lines.append("# TYPE scraper_errors_total counter")
+        for error in snapshot["errors"]:
+            lines.append(f'scraper_errors_total{{stage="{error["stage"]}",type="{error["type"]}"}} {error["count"]}')
+
+        lines.append("# TYPE scraper_stage_seconds histogram")
+        for name, histogram in sorted(snapshot["stages"].items()):
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f'scraper_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'scraper_stage_seconds_sum{{stage="{name}"}} {histogram["sum"]}')
+            lines.append(f'scraper_stage_seconds_count{{stage="{name}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, jsonl_path=None, prometheus_path=None):
+        """Takes a snapshot, appends it to a JSONL file and replaces a Prometheus text file with it.
+
+        Args:
+            jsonl_path (str, optional): File the snapshot is appended to as one JSON line. Defaults to None.
+            prometheus_path (str, optional): File rewritten with the snapshot in the Prometheus format,
+                e.g. for the node exporter's textfile collector. Defaults to None.
+        """
+        snapshot = self.snapshot()
+        if jsonl_path is not None:
+            with open(jsonl_path, "a") as file:
+                file.write(json.dumps(snapshot) + "\n")
+        if prometheus_path is not None:
+            # written next to the target and renamed, so a scrape never reads half a file
+            temp_path = prometheus_path + ".tmp"
+            with open(temp_path, "w") as file:
+                file.write(self.prometheus_text(snapshot))
+            os.replace(temp_path, prometheus_path)
+
+    def start_exporter(self, jsonl_path=None, prometheus_path=None, interval=60):
+        """Exports a snapshot every interval seconds from a background thread until stop_exporter is called.
+
+        Args:
+            jsonl_path (str, optional): See export. Defaults to None.
+            prometheus_path (str, optional): See export. Defaults to None.
+            interval (float, optional): Seconds between snapshots. Defaults to 60.
+        """
+        def export_periodically():
+            while not self.exporter_stop.wait(interval):
+                try:
+                    self.export(jsonl_path, prometheus_path)
+                except OSError as e:
+                    print(f"Error exporting metrics - {e}")
+
+        self.exporter_paths = (jsonl_path, prometheus_path)
+        self.exporter_stop.clear()
+        self.exporter = threading.Thread(target=export_periodically, daemon=True)
+        self.exporter.start()
+
+    def stop_exporter(self):
+        """Stops the background exporter and exports one last snapshot.
+
+        No parameters or return values.
+        """
+        if self.exporter is None:
+            return
+        self.exporter_stop.set()
+        self.exporter.join()
+        self.exporter = None
+        self.export(*self.exporter_paths)
+
+
+# metrics of this process, shared by every scraper and crawler in it
+crawl_metrics = CrawlMetrics()
+
+
+def aiohttp_trace_config(metrics=None):
+    """Builds an aiohttp trace config that records DNS lookups and new connections as the
+    "dns" and "connect" stages. Pooled connections that are reused are not recorded.
+
+    Args:
+        metrics (CrawlMetrics, optional): Metrics to record into. Defaults to crawl_metrics.
+
+    Returns:
+        aiohttp.TraceConfig: Trace config to pass to aiohttp.ClientSession.
+    """
+    import aiohttp
+    if metrics is None:
+        metrics = crawl_metrics
+
+    async def on_dns_resolvehost_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def on_dns_resolvehost_end(session, context, params):
+        metrics.observe("dns", time.perf_counter() - context.dns_start)
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params):
+        metrics.observe("connect", time.perf_counter() - context.connect_start)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
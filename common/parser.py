@@ -0,0 +1,66 @@
+from bs4 import BeautifulSoup
+import threading
+
+from common.metrics import crawl_metrics
+
+# tree builders BeautifulSoup can run on, fastest first
+PARSER_BACKENDS = ["lxml", "html.parser", "html5lib"]
+
+parser_backend = None
+parser_lock = threading.Lock()
+
+
+def default_parser():
+    """Picks the fastest parser backend that is installed. html.parser ships with Python
+    and is always available, lxml builds the same tree several times faster. html5lib is
+    the slowest of the three and is never picked on its own.
+
+    Returns:
+        str: Name of the parser backend.
+    """
+    try:
+        import lxml
+        return "lxml"
+    except ImportError:
+        return "html.parser"
+
+
+def configure_parser(backend):
+    """Selects the parser backend every scraper builds its soup with.
+
+    Args:
+        backend (str): One of PARSER_BACKENDS.
+    """
+    global parser_backend
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend: {backend}, expected one of {PARSER_BACKENDS}")
+    with parser_lock:
+        parser_backend = backend
+
+
+def get_parser():
+    """Returns the configured parser backend, falling back to the fastest installed one.
+
+    Returns:
+        str: Name of the parser backend.
+    """
+    global parser_backend
+    with parser_lock:
+        if parser_backend is None:
+            parser_backend = default_parser()
+        return parser_backend
+
+
+def make_soup(markup, parse_only=None):
+    """Parses an HTML document with the configured backend.
+
+    Args:
+        markup (str): HTML of the page.
+        parse_only (bs4.SoupStrainer, optional): Builds only the matching elements, much faster when a few
+            elements of a large page are needed. html5lib ignores it. Defaults to the whole page.
+
+    Returns:
+        BeautifulSoup: The parsed page.
+    """
+    with crawl_metrics.stage("parse"):
+        return BeautifulSoup(markup, get_parser(), parse_only=parse_only)
@@ -0,0 +1,150 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import queue
+import threading
+
+
+class FetchParsePipeline:
+    def __init__(self, fetch, parse, handle_result, fetch_workers=16, parse_workers=None,
+                 queue_size=64, initializer=None, initargs=()):
+        """A staged pipeline that keeps the network and every CPU core busy at the same time.
+        Fetch threads download raw pages into a bounded queue, and a pool of parser processes turns
+        them into dictionaries. When the parsers fall behind the queue fills up and the fetchers wait,
+        and the number of pages handed to the parsers at once is capped as well.
+
+        Args:
+            fetch (function): Takes an item and returns its raw pages. Runs in a fetch thread.
+            parse (function): Takes an item and its raw pages and returns the parsed result. Runs in a
+                parser process, so it has to be a module level function.
+            handle_result (function): Takes an item, its result and the exception raised while fetching
+                or parsing it, or None. Runs in the main process and may put new items on the pipeline.
+            fetch_workers (int, optional): Number of fetch threads. Defaults to 16.
+            parse_workers (int, optional): Number of parser processes. Defaults to the number of cores.
+            queue_size (int, optional): Number of fetched pages waiting to be parsed before fetching pauses. Defaults to 64.
+            initializer (function, optional): Called at the start of every parser process. Defaults to None.
+            initargs (tuple, optional): Arguments for the initializer. Defaults to ().
+        """
+        self.fetch = fetch
+        self.parse = parse
+        self.handle_result = handle_result
+        self.fetch_workers = fetch_workers
+
+        if parse_workers is None:
+            parse_workers = os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=parse_workers, initializer=initializer, initargs=initargs)
+        # at most twice as many pages in the parser pool as there are parser processes
+        self.parse_slots = threading.BoundedSemaphore(2 * parse_workers)
+
+        self.items = queue.Queue()
+        self.fetched = queue.Queue(maxsize=queue_size)
+
+        # items put on the pipeline whose result has not been handled yet
+        self.pending = 0
+        self.done = threading.Condition()
+
+        self.threads = []
+
+    def put(self, item):
+        """Adds an item to the pipeline.
+
+        Args:
+            item: The item to fetch and parse, e.g. an app link.
+        """
+        with self.done:
+            self.pending += 1
+        self.items.put(item)
+
+    def finish(self, item, result, error):
+        """Hands a result to handle_result and marks the item as done.
+
+        Args:
+            item: The item that was processed.
+            result: The parsed result, or None if processing failed.
+            error (Exception): The exception raised while processing, or None.
+        """
+        try:
+            self.handle_result(item, result, error)
+        except Exception as e:
+            print(f"Error occurred while handling {item} - {e}")
+        finally:
+            with self.done:
+                self.pending -= 1
+                self.done.notify_all()
+
+    def fetch_worker(self):
+        """Fetch thread, downloads the pages of each item and queues them for parsing.
+
+        No parameters or return values.
+        """
+        while True:
+            item = self.items.get()
+            if item is None:
+                return
+            try:
+                pages = self.fetch(item)
+            except Exception as e:
+                self.finish(item, None, e)
+                continue
+            self.fetched.put((item, pages))
+
+    def dispatch_worker(self):
+        """Dispatch thread, hands fetched pages to the parser processes as parse slots free up.
+
+        No parameters or return values.
+        """
+        while True:
+            entry = self.fetched.get()
+            if entry is None:
+                return
+            item, pages = entry
+            self.parse_slots.acquire()
+            try:
+                future = self.executor.submit(self.parse, item, pages)
+            except Exception as e:
+                self.parse_slots.release()
+                self.finish(item, None, e)
+                continue
+            future.add_done_callback(lambda future, item=item: self.parsed(item, future))
+
+    def parsed(self, item, future):
+        """Called when a parser process is done with an item.
+
+        Args:
+            item: The item that was parsed.
+            future (concurrent.futures.Future): The finished parse task.
+        """
+        self.parse_slots.release()
+        error = future.exception()
+        self.finish(item, None if error is not None else future.result(), error)
+
+    def run(self, items):
+        """Puts the given items on the pipeline and blocks until they and every item added
+        by handle_result have been handled.
+
+        Args:
+            items (iterable): The first items to process. A generator may still be discovering them,
+                the items it yielded are processed in the meantime.
+        """
+        self.threads = [threading.Thread(target=self.fetch_worker, daemon=True) for _ in range(self.fetch_workers)]
+        self.threads.append(threading.Thread(target=self.dispatch_worker, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+        for item in items:
+            self.put(item)
+
+        try:
+            with self.done:
+                while self.pending > 0:
+                    self.done.wait()
+        except BaseException:
+            # the threads are daemons and may be blocked on a full queue, so only the parsers are stopped
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        for _ in range(self.fetch_workers):
+            self.items.put(None)
+        self.fetched.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.executor.shutdown()
@@ -0,0 +1,146 @@
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+# responses that mean the host is overloaded or throttling, they are retried and slow the host down
+THROTTLE_STATUSES = {429, 503}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    """Parses a Retry-After header, which is either a number of seconds or an HTTP date.
+
+    Args:
+        value (str): The header value, or None.
+
+    Returns:
+        float: Seconds to wait, or None if the header is missing or malformed.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt, backoff=0.5, max_backoff=60, retry_after=None):
+    """Returns how long to wait before a retry, exponential in the attempt with full jitter,
+    so clients that failed together do not retry together. A Retry-After from the server wins.
+
+    Args:
+        attempt (int): Number of the retry, starting at 0.
+        backoff (float, optional): Base delay in seconds. Defaults to 0.5.
+        max_backoff (float, optional): Longest delay in seconds. Defaults to 60.
+        retry_after (float, optional): Seconds the server asked to wait. Defaults to None.
+
+    Returns:
+        float: Seconds to wait.
+    """
+    if retry_after is not None:
+        return min(retry_after, max_backoff)
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+class HostRateLimiter:
+    def __init__(self, rate=10, burst=10, min_rate=0.2, max_rate=50, increase=0.5, decrease=0.5):
+        """A token bucket per host whose rate adapts to the host's responses. Every successful
+        response raises the rate a little, every 429 or 503 cuts it and pauses the host for its
+        Retry-After, so the crawl settles just below the rate where a host starts throttling.
+
+        Args:
+            rate (float, optional): Requests per second a host starts at. Defaults to 10.
+            burst (int, optional): Requests a host may get at once after being idle. Defaults to 10.
+            min_rate (float, optional): Lowest requests per second. Defaults to 0.2.
+            max_rate (float, optional): Highest requests per second. Defaults to 50.
+            increase (float, optional): Requests per second the rate grows by per second of successful responses. Defaults to 0.5.
+            decrease (float, optional): Factor the rate is multiplied with when the host throttles. Defaults to 0.5.
+        """
+        self.initial_rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+        self.lock = threading.Lock()
+        # host -> {"rate", "tokens", "updated", "paused_until"}
+        self.hosts = {}
+
+    def bucket(self, host):
+        """Returns the bucket of a host, creating it on first use. Must be called with the lock held.
+
+        Args:
+            host (str): The host, e.g. apps.apple.com.
+
+        Returns:
+            dict: The host's bucket.
+        """
+        bucket = self.hosts.get(host)
+        if bucket is None:
+            bucket = {"rate": self.initial_rate, "tokens": self.burst, "updated": time.monotonic(), "paused_until": 0.0}
+            self.hosts[host] = bucket
+        return bucket
+
+    def reserve(self, host):
+        """Takes a token for one request to a host and returns how long to wait before sending it.
+        Does not block, so it serves threads and asyncio tasks alike.
+
+        Args:
+            host (str): The host.
+
+        Returns:
+            float: Seconds to wait before sending the request.
+        """
+        with self.lock:
+            bucket = self.bucket(host)
+            now = time.monotonic()
+            bucket["tokens"] = min(self.burst, bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+            bucket["updated"] = now
+            # tokens go negative for reservations that are waiting, later callers queue up behind them
+            bucket["tokens"] -= 1
+            wait = 0.0 if bucket["tokens"] >= 0 else -bucket["tokens"] / bucket["rate"]
+            return max(wait, bucket["paused_until"] - now)
+
+    def acquire(self, host):
+        """Blocks until a request to the host may be sent.
+
+        Args:
+            host (str): The host.
+        """
+        wait = self.reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+
+    def record(self, host, status, retry_after=None):
+        """Adapts a host's rate to a response.
+
+        Args:
+            host (str): The host.
+            status (int): HTTP status of the response, or None if the request failed without one.
+            retry_after (float, optional): Seconds the server asked to wait. Defaults to None.
+        """
+        with self.lock:
+            bucket = self.bucket(host)
+            if status in THROTTLE_STATUSES:
+                bucket["rate"] = max(self.min_rate, bucket["rate"] * self.decrease)
+                bucket["tokens"] = min(bucket["tokens"], 0)
+                if retry_after is not None:
+                    bucket["paused_until"] = max(bucket["paused_until"], time.monotonic() + retry_after)
+            elif status is not None and status < 400:
+                # spread over the responses of one second, so the rate grows linearly in time
+                bucket["rate"] = min(self.max_rate, bucket["rate"] + self.increase / bucket["rate"])
+
+    def rates(self):
+        """Returns the current rate of every host.
+
+        Returns:
+            dict: Requests per second by host.
+        """
+        with self.lock:
+            return {host: bucket["rate"] for host, bucket in self.hosts.items()}
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DAY = 24 * 3600
+
+
+def label_hash(compact_labels):
+    """Hashes an app's compact labels, so a refresh can tell whether they changed without
+    comparing them to the stored corpus.
+
+    Args:
+        compact_labels (dict): The compact labels as scraped.
+
+    Returns:
+        str: Hex SHA-256 digest of the labels.
+    """
+    encoded = json.dumps(compact_labels, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class RefreshStore:
+    def __init__(self, path, min_interval=DAY, max_interval=30 * DAY):
+        """Remembers for every app the validators of its page, ETag and Last-Modified, the hash of its
+        compact labels and when it is due for a refresh. An app whose labels did not change is
+        checked half as often next time, one whose labels changed goes back to min_interval,
+        so refreshes are spent on the apps that actually change.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            min_interval (float, optional): Shortest time between two checks of an app in seconds. Defaults to a day.
+            max_interval (float, optional): Longest time between two checks of an app in seconds. Defaults to 30 days.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS apps (
+                app_key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                label_hash TEXT,
+                checked_at REAL,
+                changed_at REAL,
+                interval REAL NOT NULL,
+                next_check REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS apps_next_check ON apps (next_check);
+        """)
+        self.connection.commit()
+
+    def track(self, items):
+        """Starts tracking apps, due right away. Apps that are already tracked are left as they are.
+
+        Args:
+            items (list[tuple]): (app_key, url, labels_hash) of every app. The hash of the labels in the corpus
+                spares the first refresh from rewriting apps whose labels did not change, it may be None.
+        """
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO apps (app_key, url, label_hash, interval, next_check) VALUES (?, ?, ?, ?, 0)",
+                [(str(app_key), url, labels_hash, self.min_interval) for app_key, url, labels_hash in items])
+            self.connection.commit()
+
+    def due(self, limit=None):
+        """Returns the apps due for a refresh, the most overdue first.
+
+        Args:
+            limit (int, optional): Maximum number of apps. Defaults to every due app.
+
+        Returns:
+            list[tuple]: (app_key, url) of every due app.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT app_key, url FROM apps WHERE next_check <= ? ORDER BY next_check LIMIT ?",
+                (time.time(), -1 if limit is None else limit)).fetchall()
+
+    def get(self, app_key):
+        """Returns what is stored about an app.
+
+        Args:
+            app_key (str): Key identifying the app.
+
+        Returns:
+            dict: The stored row, or None if the app is not tracked.
+        """
+        with self.lock:
+            cursor = self.connection.execute("SELECT * FROM apps WHERE app_key = ?", (str(app_key),))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def conditional_headers(self, app_key):
+        """Builds the headers that let the server answer 304 Not Modified if the page did not change.
+
+        Args:
+            app_key (str): Key identifying the app.
+
+        Returns:
+            dict: If-None-Match and If-Modified-Since, for the validators that are known.
+        """
+        row = self.get(app_key)
+        headers = {}
+        if row is not None:
+            if row["etag"]:
+                headers["If-None-Match"] = row["etag"]
+            if row["last_modified"]:
+                headers["If-Modified-Since"] = row["last_modified"]
+        return headers
+
+    def record(self, app_key, url, changed, response=None, labels_hash=None):
+        """Records a check of an app and schedules the next one.
+
+        Args:
+            app_key (str): Key identifying the app.
+            url (str): Link of the app.
+            changed (bool): Whether the compact labels changed.
+            response (requests.Response, optional): The response, whose validators are kept. Defaults to None.
+            labels_hash (str, optional): Hash of the compact labels. Defaults to the stored hash.
+        """
+        now = time.time()
+        row = self.get(app_key)
+        if changed or row is None:
+            interval = self.min_interval
+        else:
+            interval = min(self.max_interval, row["interval"] * 2)
+
+        # a 304 carries no new validators, the stored ones stay valid
+        etag = row["etag"] if row is not None else None
+        last_modified = row["last_modified"] if row is not None else None
+        if response is not None and response.status_code != 304:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+        if labels_hash is None and row is not None:
+            labels_hash = row["label_hash"]
+        changed_at = now if changed else (row["changed_at"] if row is not None else None)
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO apps (app_key, url, etag, last_modified, label_hash, checked_at, changed_at, "
+                "interval, next_check) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(app_key), url, etag, last_modified, labels_hash, now, changed_at, interval, now + interval))
+            self.connection.commit()
+
+    def close(self):
+        """Closes the database.
+
+        No parameters or return values.
+        """
+        with self.lock:
+            self.connection.close()
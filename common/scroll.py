@@ -0,0 +1,163 @@
+from collections import deque
+
+# Scrolls to the bottom and resolves as soon as the page has grown and then stayed quiet,
+# i.e. no DOM mutations and no new network requests for quiet_ms, or after timeout_ms.
+SCROLL_STEP_SCRIPT = """
+const done = arguments[arguments.length - 1];
+const timeoutMs = arguments[0];
+const quietMs = arguments[1];
+const selector = arguments[2];
+
+const count = () => selector ? document.querySelectorAll(selector).length : 0;
+const itemsBefore = count();
+const heightBefore = document.body.scrollHeight;
+const grew = () => count() > itemsBefore || document.body.scrollHeight > heightBefore;
+const start = performance.now();
+
+let quietTimer = null;
+let finished = false;
+const observers = [];
+const finish = () => {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    observers.forEach(observer => observer.disconnect());
+    clearTimeout(quietTimer);
+    clearTimeout(limitTimer);
+    done({grew: grew(), elapsed: performance.now() - start});
+};
+const activity = () => {
+    if (grew()) {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(finish, quietMs);
+    }
+};
+
+const mutations = new MutationObserver(activity);
+mutations.observe(document.body, {childList: true, subtree: true});
+observers.push(mutations);
+if (window.PerformanceObserver) {
+    const network = new PerformanceObserver(activity);
+    network.observe({entryTypes: ["resource"]});
+    observers.push(network);
+}
+const limitTimer = setTimeout(finish, timeoutMs);
+
+window.scrollTo(0, document.body.scrollHeight);
+activity();
+"""
+
+# Returns the links of the items matching a selector that were not returned before, and marks them,
+# so each step only sends the new links over the driver connection instead of the whole page source.
+HARVEST_SCRIPT = """
+const links = [];
+document.querySelectorAll(arguments[0]).forEach(item => {
+    if (item.dataset.harvested) {
+        return;
+    }
+    item.dataset.harvested = "1";
+    const href = item.getAttribute("href");
+    if (href) {
+        links.push(new URL(href, document.baseURI).href);
+    }
+});
+return links;
+"""
+
+
+class ScrollLoader:
+    def __init__(self, driver, item_selector=None, min_timeout=0.5, max_timeout=5, quiet_period=0.2):
+        """Loads an infinite scroll page by waiting on the page itself instead of sleeping a fixed time.
+        Each step scrolls to the bottom and returns as soon as new content arrived and the page went
+        quiet. The time a step may take adapts to how fast the page has been loading.
+
+        Args:
+            driver (selenium.webdriver.Chrome): Browser with the page open.
+            item_selector (str, optional): CSS selector of the items the page appends. Defaults to watching the page height.
+            min_timeout (float, optional): Shortest time in seconds a step waits for new content. Defaults to 0.5.
+            max_timeout (float, optional): Longest time in seconds a step waits for new content. Defaults to 5.
+            quiet_period (float, optional): Seconds without DOM or network activity after which a load is done. Defaults to 0.2.
+        """
+        self.driver = driver
+        self.item_selector = item_selector
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.quiet_period = quiet_period
+
+        # how long the last few successful steps took, in seconds
+        self.latencies = deque(maxlen=10)
+
+    def step_timeout(self):
+        """Returns how long the next step may wait, three times the recent average load time.
+
+        Returns:
+            float: The timeout in seconds.
+        """
+        if not self.latencies:
+            return self.max_timeout
+        average = sum(self.latencies) / len(self.latencies)
+        return min(self.max_timeout, max(self.min_timeout, 3 * average))
+
+    def scroll_step(self, timeout):
+        """Scrolls to the bottom once and waits for the page to load more content.
+
+        Args:
+            timeout (float): Seconds to wait for new content.
+
+        Returns:
+            bool: True if the page grew.
+        """
+        self.driver.set_script_timeout(timeout + 5)
+        result = self.driver.execute_async_script(
+            SCROLL_STEP_SCRIPT, int(timeout * 1000), int(self.quiet_period * 1000), self.item_selector)
+        if result["grew"]:
+            self.latencies.append(result["elapsed"] / 1000)
+        return result["grew"]
+
+    def harvest(self):
+        """Returns the links of the items that appeared since the last harvest, read from the live page.
+
+        Returns:
+            list[str]: Absolute links of the new items, in page order.
+        """
+        return self.driver.execute_script(HARVEST_SCRIPT, self.item_selector)
+
+    def scroll_and_harvest(self):
+        """Scrolls until the page stops growing like scroll_to_bottom, yielding the links of the new
+        items after every step, so they can be worked on while the page is still loading.
+        Needs an item_selector.
+
+        Yields:
+            str: Absolute link of every item, each once.
+        """
+        seen = set()
+
+        def new_links():
+            for link in self.harvest():
+                if link not in seen:
+                    seen.add(link)
+                    yield link
+
+        yield from new_links()
+        while True:
+            timeout = self.step_timeout()
+            if self.scroll_step(timeout) or (timeout < self.max_timeout and self.scroll_step(self.max_timeout)):
+                yield from new_links()
+                continue
+            break
+        # items added by a step that grew the page after its timeout
+        yield from new_links()
+
+    def scroll_to_bottom(self):
+        """Keeps scrolling until the page stops growing. A step that finds nothing new within the
+        adaptive timeout is retried once with the longest timeout before loading is considered done.
+
+        No parameters or return values.
+        """
+        while True:
+            timeout = self.step_timeout()
+            if self.scroll_step(timeout):
+                continue
+            if timeout >= self.max_timeout or not self.scroll_step(self.max_timeout):
+                break
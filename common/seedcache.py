@@ -0,0 +1,56 @@
+import json
+import os
+import threading
+import time
+
+
+class SeedCache:
+    def __init__(self, path, ttl=6 * 3600):
+        """A JSON file on disk remembering the app links found on each seed page, e.g. a chart,
+        so a crawl restarted within the TTL starts scraping apps without fetching the seed pages again.
+
+        Args:
+            path (str): Path of the JSON file.
+            ttl (float, optional): Seconds a seed page's app links stay valid. Defaults to 6 hours.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # seed page link -> {"fetched_at": time, "apps": app links}
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.entries = json.load(file)
+            except ValueError as e:
+                print(f"Ignoring unreadable seed cache {path} - {e}")
+
+    def get(self, url):
+        """Returns the cached app links of a seed page.
+
+        Args:
+            url (str): Link of the seed page.
+
+        Returns:
+            list[str]: The app links, or None if the page was never cached or its entry expired.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry is None or time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        return entry["apps"]
+
+    def put(self, url, apps):
+        """Caches the app links of a seed page and writes the cache to disk.
+
+        Args:
+            url (str): Link of the seed page.
+            apps (list[str]): The app links found on it.
+        """
+        with self.lock:
+            self.entries[url] = {"fetched_at": time.time(), "apps": apps}
+            # written next to the cache and renamed, so a crash never leaves half a file
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as file:
+                json.dump(self.entries, file)
+            os.replace(temp_path, self.path)
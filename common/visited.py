@@ -0,0 +1,161 @@
+from array import array
+from bisect import bisect_left
+import hashlib
+import heapq
+import math
+import threading
+
+
+def int_key(app_id):
+    """Maps an app ID to a 64-bit integer. Numeric App Store IDs are kept as they are,
+    Play Store package names are hashed.
+
+    Args:
+        app_id (int | str): The app ID.
+
+    Returns:
+        int: The key.
+    """
+    if isinstance(app_id, int):
+        return app_id
+    return int.from_bytes(hashlib.blake2b(app_id.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+class VisitedSet:
+    def __init__(self, app_ids=()):
+        """A set of app IDs stored as 64-bit integers in a sorted array, about 8 bytes per app instead
+        of the ~100 a dictionary entry of a string key takes. New IDs go to a small buffer that
+        is merged into the array once it grows, so adding stays cheap. Safe to share between threads.
+
+        Args:
+            app_ids (iterable, optional): App IDs to load. Defaults to ().
+        """
+        self.lock = threading.Lock()
+        self.keys = array("q")
+        self.buffer = set()
+        self.update(app_ids)
+
+    def __contains__(self, app_id):
+        if app_id is None:
+            return False
+        key = int_key(app_id)
+        with self.lock:
+            return self.contains_key(key)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.keys) + len(self.buffer)
+
+    def contains_key(self, key):
+        """Checks for a key in the buffer and the array. Must be called with the lock held.
+
+        Args:
+            key (int): Key from int_key.
+
+        Returns:
+            bool: Whether the key was added.
+        """
+        if key in self.buffer:
+            return True
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def add(self, app_id):
+        """Adds an app ID.
+
+        Args:
+            app_id (int | str): The app ID.
+        """
+        if app_id is None:
+            return
+        key = int_key(app_id)
+        with self.lock:
+            if self.contains_key(key):
+                return
+            self.buffer.add(key)
+            # merging rewrites the array, so the buffer may grow with it to keep adding amortized O(log n)
+            if len(self.buffer) >= max(4096, len(self.keys) // 8):
+                self.merge()
+
+    def update(self, app_ids):
+        """Adds many app IDs at once with a single sort, e.g. when loading a corpus.
+
+        Args:
+            app_ids (iterable): The app IDs.
+        """
+        keys = [int_key(app_id) for app_id in app_ids if app_id is not None]
+        with self.lock:
+            self.buffer.update(keys)
+            self.merge()
+
+    def merge(self):
+        """Merges the sorted buffer into the sorted array in one linear pass, so besides the new array
+        only the buffer is held in memory. Must be called with the lock held.
+
+        No parameters or return values.
+        """
+        if not self.buffer:
+            return
+        merged = array("q")
+        last = None
+        for key in heapq.merge(self.keys, sorted(self.buffer)):
+            if key != last:
+                merged.append(key)
+                last = key
+        self.keys = merged
+        self.buffer = set()
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        """A fixed size probabilistic set for the crawl frontier. It never forgets an app that was
+        added, but reports an app that was not added as present with probability error_rate,
+        so about that share of new apps is skipped. Takes ~1.8 bytes per app at 0.1%.
+
+        Args:
+            capacity (int): Number of apps the filter is sized for.
+            error_rate (float, optional): False positive rate at capacity. Defaults to 0.001.
+        """
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def positions(self, app_id):
+        # double hashing, two 64-bit halves of one digest give every bit position
+        digest = hashlib.blake2b(str(app_id).encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def __contains__(self, app_id):
+        if app_id is None:
+            return False
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(app_id))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, app_id):
+        """Adds an app ID.
+
+        Args:
+            app_id (int | str): The app ID.
+        """
+        if app_id is None:
+            return
+        positions = self.positions(app_id)
+        with self.lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def update(self, app_ids):
+        """Adds many app IDs.
+
+        Args:
+            app_ids (iterable): The app IDs.
+        """
+        for app_id in app_ids:
+            self.add(app_id)
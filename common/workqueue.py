@@ -0,0 +1,600 @@
+import sqlite3
+import threading
+import time
+
+from common.visited import int_key
+
+# states of an item in a work queue
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def partition_of(app_key, partitions):
+    """Returns the partition an app belongs to. The hash is stable across processes and machines,
+    unlike Python's hash, so every node agrees on it.
+
+    Args:
+        app_key (str): Key identifying the app.
+        partitions (int): Number of partitions.
+
+    Returns:
+        int: The partition, from 0 to partitions - 1.
+    """
+    return int_key(str(app_key)) % partitions
+
+
+def node_partitions(node, nodes, partitions):
+    """Splits the partitions evenly between the nodes of a crawl.
+
+    Args:
+        node (int): Number of this node, from 0 to nodes - 1.
+        nodes (int): Number of nodes.
+        partitions (int): Number of partitions of the work queue.
+
+    Returns:
+        list[int]: The partitions this node works on first.
+    """
+    return [partition for partition in range(partitions) if partition % nodes == node]
+
+
+class SqliteWorkQueue:
+    def __init__(self, path, partitions=16, lease_seconds=300, max_attempts=3):
+        """A work queue shared by crawler processes through a SQLite file, e.g. on a shared disk.
+        Every app is queued once, whichever node finds it. A worker claims apps with a lease and
+        completes them when done. Apps whose lease runs out, because their worker crashed, are
+        claimed by the next worker, until they failed max_attempts times.
+
+        The rollback journal is used instead of WAL, which needs shared memory and does not work
+        across machines. Claims lock the whole file, so claim several apps at once.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            partitions (int, optional): Number of partitions apps are split into by their hash. Defaults to 16.
+            lease_seconds (float, optional): Seconds a claimed app stays with its worker. Defaults to 5 minutes.
+            max_attempts (int, optional): Claims after which an app is given up. Defaults to 3.
+        """
+        self.partitions = partitions
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self.lock = threading.Lock()
+        # waits for other nodes holding the write lock instead of failing right away
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS work (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                app_key TEXT UNIQUE NOT NULL,
+                url TEXT NOT NULL,
+                partition INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS work_claim ON work (state, partition, seq);
+        """)
+
+    def transaction(self, statements):
+        """Runs a function inside a write transaction. Must be called with the lock held.
+
+        Args:
+            statements (function): Takes the connection and returns the result.
+
+        Returns:
+            The result of statements.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(self.connection)
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        return result
+
+    def push_many(self, items):
+        """Queues apps, skipping the ones that were ever queued before.
+
+        Args:
+            items (list[tuple]): (app_key, url) of every app.
+
+        Returns:
+            int: Number of apps that were new.
+        """
+        rows = [(str(app_key), url, partition_of(app_key, self.partitions), QUEUED) for app_key, url in items]
+        with self.lock:
+            def insert(connection):
+                before = connection.total_changes
+                connection.executemany(
+                    "INSERT OR IGNORE INTO work (app_key, url, partition, state) VALUES (?, ?, ?, ?)", rows)
+                return connection.total_changes - before
+            return self.transaction(insert)
+
+    def push(self, app_key, url):
+        """Queues an app unless it was ever queued before.
+
+        Args:
+            app_key (str): Key identifying the app.
+            url (str): Link of the app.
+
+        Returns:
+            bool: True if the app was new.
+        """
+        return self.push_many([(app_key, url)]) == 1
+
+    def claim(self, worker_id, partitions=None, limit=1):
+        """Leases the oldest queued apps of the given partitions to a worker. Expired leases are
+        claimable again, or given up once the app used up its attempts.
+
+        Args:
+            worker_id (str): Name of the worker, unique across nodes.
+            partitions (list[int], optional): Partitions to claim from. Defaults to every partition.
+            limit (int, optional): Maximum number of apps to claim. Defaults to 1.
+
+        Returns:
+            list[tuple]: (app_key, url) of every claimed app.
+        """
+        if partitions is None:
+            partitions = range(self.partitions)
+        partition_list = ",".join(str(int(partition)) for partition in partitions)
+        with self.lock:
+            def claim(connection):
+                now = time.time()
+                connection.execute(
+                    "UPDATE work SET state = ?, lease_owner = NULL WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, LEASED, now, self.max_attempts))
+                rows = connection.execute(
+                    f"SELECT seq, app_key, url FROM work WHERE partition IN ({partition_list}) "
+                    "AND (state = ? OR (state = ? AND lease_expires < ?)) ORDER BY seq LIMIT ?",
+                    (QUEUED, LEASED, now, limit)).fetchall()
+                connection.executemany(
+                    "UPDATE work SET state = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE seq = ?",
+                    [(LEASED, worker_id, now + self.lease_seconds, row[0]) for row in rows])
+                return [(row[1], row[2]) for row in rows]
+            return self.transaction(claim)
+
+    def renew(self, worker_id, app_key):
+        """Extends the lease of an app the worker still holds.
+
+        Args:
+            worker_id (str): Name of the worker.
+            app_key (str): Key identifying the app.
+
+        Returns:
+            bool: False if the lease expired and the app may have been claimed by another worker.
+        """
+        with self.lock:
+            def renew(connection):
+                return connection.execute(
+                    "UPDATE work SET lease_expires = ? WHERE app_key = ? AND state = ? AND lease_owner = ? AND lease_expires >= ?",
+                    (time.time() + self.lease_seconds, str(app_key), LEASED, worker_id, time.time())).rowcount == 1
+            return self.transaction(renew)
+
+    def complete(self, app_key):
+        """Marks an app as done.
+
+        Args:
+            app_key (str): Key identifying the app.
+        """
+        with self.lock:
+            self.transaction(lambda connection: connection.execute(
+                "UPDATE work SET state = ?, lease_owner = NULL WHERE app_key = ?", (DONE, str(app_key))))
+
+    def fail(self, app_key):
+        """Puts a failed app back on the queue, or gives it up once it used up its attempts.
+
+        Args:
+            app_key (str): Key identifying the app.
+        """
+        with self.lock:
+            self.transaction(lambda connection: connection.execute(
+                "UPDATE work SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_owner = NULL WHERE app_key = ?",
+                (self.max_attempts, FAILED, QUEUED, str(app_key))))
+
+    def counts(self):
+        """Counts the apps in every state.
+
+        Returns:
+            dict: Number of apps by state.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM work GROUP BY state").fetchall()
+        counts = {QUEUED: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(rows)
+        return counts
+
+    def pending(self):
+        """Counts the apps that are queued or held by a worker, i.e. the crawl is not over.
+
+        Returns:
+            int: Number of pending apps.
+        """
+        counts = self.counts()
+        return counts[QUEUED] + counts[LEASED]
+
+    def close(self):
+        """Closes the database.
+
+        No parameters or return values.
+        """
+        with self.lock:
+            self.connection.close()
+
+
+# Lua scripts run atomically on the Redis server, so concurrent workers never claim the same app
+REDIS_PUSH = """
+local prefix, key = ARGV[1], ARGV[2]
+if redis.call('SADD', prefix .. ':seen', key) == 0 then
+    return 0
+end
+redis.call('HSET', prefix .. ':url', key, ARGV[3])
+redis.call('HSET', prefix .. ':partition', key, ARGV[4])
+redis.call('RPUSH', prefix .. ':queue:' .. ARGV[4], key)
+return 1
+"""
+
+REDIS_CLAIM = """
+local prefix, worker = ARGV[1], ARGV[2]
+local now, lease, limit, max_attempts = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', prefix .. ':leases', '-inf', '(' .. now)) do
+    redis.call('ZREM', prefix .. ':leases', key)
+    redis.call('HDEL', prefix .. ':owner', key)
+    if tonumber(redis.call('HGET', prefix .. ':attempts', key) or '0') >= max_attempts then
+        redis.call('SADD', prefix .. ':failed', key)
+    else
+        redis.call('LPUSH', prefix .. ':queue:' .. redis.call('HGET', prefix .. ':partition', key), key)
+    end
+end
+local claimed = {}
+for i = 7, #ARGV do
+    while #claimed < 2 * limit do
+        local key = redis.call('LPOP', prefix .. ':queue:' .. ARGV[i])
+        if not key then
+            break
+        end
+        redis.call('ZADD', prefix .. ':leases', now + lease, key)
+        redis.call('HSET', prefix .. ':owner', key, worker)
+        redis.call('HINCRBY', prefix .. ':attempts', key, 1)
+        table.insert(claimed, key)
+        table.insert(claimed, redis.call('HGET', prefix .. ':url', key))
+    end
+end
+return claimed
+"""
+
+REDIS_RENEW = """
+local prefix, worker, key = ARGV[1], ARGV[2], ARGV[3]
+if redis.call('HGET', prefix .. ':owner', key) ~= worker then
+    return 0
+end
+redis.call('ZADD', prefix .. ':leases', 'XX', ARGV[4], key)
+return 1
+"""
+
+REDIS_FINISH = """
+local prefix, key, failed, max_attempts = ARGV[1], ARGV[2], ARGV[3] == '1', tonumber(ARGV[4])
+redis.call('ZREM', prefix .. ':leases', key)
+redis.call('HDEL', prefix .. ':owner', key)
+if not failed then
+    redis.call('SADD', prefix .. ':done', key)
+elseif tonumber(redis.call('HGET', prefix .. ':attempts', key) or '0') >= max_attempts then
+    redis.call('SADD', prefix .. ':failed', key)
+else
+    redis.call('RPUSH', prefix .. ':queue:' .. redis.call('HGET', prefix .. ':partition', key), key)
+end
+"""
+
+
+class RedisWorkQueue:
+    def __init__(self, url="redis://localhost:6379/0", prefix="crawl", partitions=16, lease_seconds=300, max_attempts=3):
+        """The same work queue as SqliteWorkQueue kept in Redis, for crawls spread over many machines.
+        Each partition is a Redis list, leases are a sorted set by expiry time. Needs the redis package.
+        The scripts build key names at run time, so it runs on a single Redis server, not a cluster.
+
+        Args:
+            url (str, optional): URL of the Redis server. Defaults to "redis://localhost:6379/0".
+            prefix (str, optional): Prefix of every key, so several crawls can share a server. Defaults to "crawl".
+            partitions (int, optional): Number of partitions apps are split into by their hash. Defaults to 16.
+            lease_seconds (float, optional): Seconds a claimed app stays with its worker. Defaults to 5 minutes.
+            max_attempts (int, optional): Claims after which an app is given up. Defaults to 3.
+        """
+        import redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.partitions = partitions
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self.push_script = self.client.register_script(REDIS_PUSH)
+        self.claim_script = self.client.register_script(REDIS_CLAIM)
+        self.renew_script = self.client.register_script(REDIS_RENEW)
+        self.finish_script = self.client.register_script(REDIS_FINISH)
+
+    def push_many(self, items):
+        """Queues apps, skipping the ones that were ever queued before.
+
+        Args:
+            items (list[tuple]): (app_key, url) of every app.
+
+        Returns:
+            int: Number of apps that were new.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for app_key, url in items:
+            self.push_script(args=[self.prefix, str(app_key), url, partition_of(app_key, self.partitions)], client=pipe)
+        return sum(pipe.execute())
+
+    def push(self, app_key, url):
+        """Queues an app unless it was ever queued before.
+
+        Args:
+            app_key (str): Key identifying the app.
+            url (str): Link of the app.
+
+        Returns:
+            bool: True if the app was new.
+        """
+        return self.push_many([(app_key, url)]) == 1
+
+    def claim(self, worker_id, partitions=None, limit=1):
+        """Leases the oldest queued apps of the given partitions to a worker. See SqliteWorkQueue.claim.
+
+        Args:
+            worker_id (str): Name of the worker, unique across nodes.
+            partitions (list[int], optional): Partitions to claim from. Defaults to every partition.
+            limit (int, optional): Maximum number of apps to claim. Defaults to 1.
+
+        Returns:
+            list[tuple]: (app_key, url) of every claimed app.
+        """
+        if partitions is None:
+            partitions = range(self.partitions)
+        claimed = self.claim_script(args=[self.prefix, worker_id, time.time(), self.lease_seconds, limit,
+                                          self.max_attempts, *partitions])
+        return list(zip(claimed[0::2], claimed[1::2]))
+
+    def renew(self, worker_id, app_key):
+        """Extends the lease of an app the worker still holds.
+
+        Args:
+            worker_id (str): Name of the worker.
+            app_key (str): Key identifying the app.
+
+        Returns:
+            bool: False if the lease expired and the app may have been claimed by another worker.
+        """
+        return self.renew_script(args=[self.prefix, worker_id, str(app_key), time.time() + self.lease_seconds]) == 1
+
+    def complete(self, app_key):
+        """Marks an app as done.
+
+        Args:
+            app_key (str): Key identifying the app.
+        """
+        self.finish_script(args=[self.prefix, str(app_key), 0, self.max_attempts])
+
+    def fail(self, app_key):
+        """Puts a failed app back on the queue, or gives it up once it used up its attempts.
+
+        Args:
+            app_key (str): Key identifying the app.
+        """
+        self.finish_script(args=[self.prefix, str(app_key), 1, self.max_attempts])
+
+    def counts(self):
+        """Counts the apps in every state.
+
+        Returns:
+            dict: Number of apps by state.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for partition in range(self.partitions):
+            pipe.llen(f"{self.prefix}:queue:{partition}")
+        pipe.zcard(f"{self.prefix}:leases")
+        pipe.scard(f"{self.prefix}:done")
+        pipe.scard(f"{self.prefix}:failed")
+        results = pipe.execute()
+        return {QUEUED: sum(results[:-3]), LEASED: results[-3], DONE: results[-2], FAILED: results[-1]}
+
+    def pending(self):
+        """Counts the apps that are queued or held by a worker, i.e. the crawl is not over.
+
+        Returns:
+            int: Number of pending apps.
+        """
+        counts = self.counts()
+        return counts[QUEUED] + counts[LEASED]
+
+    def close(self):
+        """Closes the connections to Redis.
+
+        No parameters or return values.
+        """
+        self.client.close()
+
+
+class MemoryWorkQueue:
+    def __init__(self, partitions=16, lease_seconds=300, max_attempts=3, clock=time.time):
+        """The same work queue as SqliteWorkQueue held in memory, shared by the threads of one process.
+        For tests and for trying out a distributed crawl on a single machine.
+
+        Args:
+            partitions (int, optional): Number of partitions apps are split into by their hash. Defaults to 16.
+            lease_seconds (float, optional): Seconds a claimed app stays with its worker. Defaults to 5 minutes.
+            max_attempts (int, optional): Claims after which an app is given up. Defaults to 3.
+            clock (function, optional): Returns the current time in seconds, replaced in tests. Defaults to time.time.
+        """
+        self.partitions = partitions
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        # app_key -> {"seq", "url", "partition", "state", "lease_owner", "lease_expires", "attempts"}
+        self.items = {}
+
+    def push_many(self, items):
+        """Queues apps, skipping the ones that were ever queued before.
+
+        Args:
+            items (list[tuple]): (app_key, url) of every app.
+
+        Returns:
+            int: Number of apps that were new.
+        """
+        new = 0
+        with self.lock:
+            for app_key, url in items:
+                app_key = str(app_key)
+                if app_key in self.items:
+                    continue
+                self.items[app_key] = {"seq": len(self.items), "url": url,
+                                       "partition": partition_of(app_key, self.partitions),
+                                       "state": QUEUED, "lease_owner": None, "lease_expires": None, "attempts": 0}
+                new += 1
+        return new
+
+    def push(self, app_key, url):
+        """Queues an app unless it was ever queued before.
+
+        Args:
+            app_key (str): Key identifying the app.
+            url (str): Link of the app.
+
+        Returns:
+            bool: True if the app was new.
+        """
+        return self.push_many([(app_key, url)]) == 1
+
+    def claim(self, worker_id, partitions=None, limit=1):
+        """Leases the oldest queued apps of the given partitions to a worker. See SqliteWorkQueue.claim.
+
+        Args:
+            worker_id (str): Name of the worker.
+            partitions (list[int], optional): Partitions to claim from. Defaults to every partition.
+            limit (int, optional): Maximum number of apps to claim. Defaults to 1.
+
+        Returns:
+            list[tuple]: (app_key, url) of every claimed app.
+        """
+        partitions = set(range(self.partitions) if partitions is None else partitions)
+        now = self.clock()
+        claimed = []
+        with self.lock:
+            for app_key, item in self.items.items():
+                if item["state"] == LEASED and item["lease_expires"] < now and item["attempts"] >= self.max_attempts:
+                    item["state"] = FAILED
+                    item["lease_owner"] = None
+            # items are kept in insertion order, which is the order they were queued in
+            for app_key, item in self.items.items():
+                if len(claimed) == limit:
+                    break
+                if item["partition"] not in partitions:
+                    continue
+                if item["state"] == QUEUED or (item["state"] == LEASED and item["lease_expires"] < now):
+                    item.update(state=LEASED, lease_owner=worker_id, lease_expires=now + self.lease_seconds,
+                                attempts=item["attempts"] + 1)
+                    claimed.append((app_key, item["url"]))
+        return claimed
+
+    def renew(self, worker_id, app_key):
+        """Extends the lease of an app the worker still holds.
+
+        Args:
+            worker_id (str): Name of the worker.
+            app_key (str): Key identifying the app.
+
+        Returns:
+            bool: False if the lease expired and the app may have been claimed by another worker.
+        """
+        now = self.clock()
+        with self.lock:
+            item = self.items.get(str(app_key))
+            if item is None or item["state"] != LEASED or item["lease_owner"] != worker_id or item["lease_expires"] < now:
+                return False
+            item["lease_expires"] = now + self.lease_seconds
+            return True
+
+    def complete(self, app_key):
+        """Marks an app as done.
+
+        Args:
+            app_key (str): Key identifying the app.
+        """
+        with self.lock:
+            self.items[str(app_key)].update(state=DONE, lease_owner=None)
+
+    def fail(self, app_key):
+        """Puts a failed app back on the queue, or gives it up once it used up its attempts.
+
+        Args:
+            app_key (str): Key identifying the app.
+        """
+        with self.lock:
+            item = self.items[str(app_key)]
+            item.update(state=FAILED if item["attempts"] >= self.max_attempts else QUEUED, lease_owner=None)
+
+    def counts(self):
+        """Counts the apps in every state.
+
+        Returns:
+            dict: Number of apps by state.
+        """
+        counts = {QUEUED: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        with self.lock:
+            for item in self.items.values():
+                counts[item["state"]] += 1
+        return counts
+
+    def pending(self):
+        """Counts the apps that are queued or held by a worker, i.e. the crawl is not over.
+
+        Returns:
+            int: Number of pending apps.
+        """
+        counts = self.counts()
+        return counts[QUEUED] + counts[LEASED]
+
+    def close(self):
+        """Nothing to close, kept so every work queue can be used the same way.
+
+        No parameters or return values.
+        """
+
+
+def test_work_queue_leases(tmp_path):
+    now = [1000.0]
+    queues = [SqliteWorkQueue(str(tmp_path / "work.db"), partitions=4, lease_seconds=60, max_attempts=2),
+              MemoryWorkQueue(partitions=4, lease_seconds=60, max_attempts=2, clock=lambda: now[0])]
+    for work in queues:
+        assert work.push_many([("1", "u1"), ("2", "u2"), ("3", "u3")]) == 3
+        assert not work.push("1", "u1")
+
+        claimed = work.claim("a", limit=2)
+        assert len(claimed) == 2
+        # the other worker only gets what is left
+        assert work.claim("b", limit=5) == [item for item in [("1", "u1"), ("2", "u2"), ("3", "u3")] if item not in claimed]
+        assert work.claim("b") == []
+
+        work.complete(claimed[0][0])
+        work.fail(claimed[1][0])
+        assert work.counts() == {QUEUED: 1, LEASED: 1, DONE: 1, FAILED: 0}
+        # second claim of the failed app, after which it is used up
+        assert work.claim("b") == [claimed[1]]
+        assert work.renew("b", claimed[1][0])
+        assert not work.renew("a", claimed[1][0])
+        work.fail(claimed[1][0])
+        assert work.counts()[FAILED] == 1
+        assert work.pending() == 1
+        work.close()
+
+    # a crashed worker's lease runs out and the app is claimed by another worker
+    memory = MemoryWorkQueue(partitions=1, lease_seconds=60, clock=lambda: now[0])
+    memory.push("1", "u1")
+    assert memory.claim("crashed") == [("1", "u1")]
+    assert memory.claim("b") == []
+    now[0] += 61
+    assert memory.claim("b") == [("1", "u1")]
+    assert not memory.renew("crashed", "1")
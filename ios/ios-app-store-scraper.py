@@ -1,17 +1,38 @@
-import json
-from bs4 import BeautifulSoup
 import requests
-from ios import iOS
+from ios import iOS, init_replay_worker, reparse_app, write_app_json, fetch_modal_page, parse_app_pages, configure_corpus, close_corpus, sync_corpus, refresh_app
 import time
-from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 import os
 import queue 
+import sys
+import asyncio
+import threading
+import socket
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import aiohttp
+from urllib.parse import urlsplit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.driver_pool import DriverPool
+from common.frontier import CrawlFrontier
+from common.http import get_client
+from common.archive import PageArchive
+from common.parser import make_soup, get_parser, configure_parser
+from common.pipeline import FetchParsePipeline
+from common.metrics import crawl_metrics, aiohttp_trace_config
+from common.scroll import ScrollLoader
+from common.corpus import read_shards, read_corpus
+from common.app_ids import ios_app_id, canonical_ios_url
+from common.visited import VisitedSet, BloomFilter
+from common.ratelimit import RETRY_STATUSES, parse_retry_after, retry_delay
+from common.deadletter import DeadLetterQueue
+from common.refresh import RefreshStore, label_hash
+from common.seedcache import SeedCache
+from common.itunes import ITunesLookup
 
 class AppStoreScraper:
-    def __init__(self):
+    def __init__(self, pool_size=2, frontier_capacity=None, dead_letter_path=None, seed_cache_path=None, seed_cache_ttl=6 * 3600,
+                 use_lookup=False):
         self.header = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.5615.137 Safari/537.36"
         }
@@ -20,6 +41,11 @@ class AppStoreScraper:
         self.service = Service('../../../chromedriver_mac64/chromedriver')
         
         self.driver = None
+        
+        self.http = get_client()
+        
+        # browsers are borrowed from the pool by the scroll search and by every iOS app
+        self.driver_pool = DriverPool(self.service, size=pool_size)
 
         self.categories = {
             "weather-apps": "6001",
@@ -75,20 +101,56 @@ class AppStoreScraper:
         
         self.links = []
         
-        self.processed_apps = {}
+        # IDs of the scraped apps, see common.visited
+        self.processed_apps = VisitedSet()
+        
+        # number of apps the frontier is sized for when a Bloom filter should remember the scheduled apps
+        self.frontier_capacity = frontier_capacity
+        
+        # common.frontier.CrawlFrontier persisting the crawl, only set while resuming a crawl
+        self.store = None
+        
+        # apps that failed after every retry, kept to be re-driven later by redrive_dead_letters
+        self.dead_letters = DeadLetterQueue(dead_letter_path) if dead_letter_path is not None else None
+        
+        # app links found on each chart page, reused by crawls started within the TTL
+        self.seed_cache = SeedCache(seed_cache_path, seed_cache_ttl) if seed_cache_path is not None else None
+        
+        # exact app info from the iTunes Lookup API, fetched in batches for the apps about to be scraped
+        self.metadata = ITunesLookup(self.http) if use_lookup else None
             
         self.generate_links()
         
     def load_processed_apps(self, directory):
-        """Loads the names of the processed apps from a given directory into the processed_apps dictionary.
+        """Loads the IDs of the processed apps from a given directory into the processed_apps set.
+        Call configure_corpus first, so the records it recovers from a killed crawl are included.
 
         Args:
-            directory (str): Directory where the JSON files are stored.
+            directory (str): Directory where the JSON files and corpus shards are stored.
         """
+        app_ids = []
         for filename in os.listdir(directory):
             if filename.endswith(".json"):  # make sure the files are .json
-                app_name = filename.rstrip('.json')  # remove .json from filename to get app name
-                self.processed_apps[app_name] = True
+                app_id = filename[:-len(".json")]  # remove the .json suffix from filename to get the app ID
+                if app_id.isdigit():
+                    app_ids.append(int(app_id))
+        
+        for data in read_shards(directory):
+            app_ids.append(data['app_info']['App ID'])
+        
+        # loaded with a single sort
+        self.processed_apps.update(app_ids)
+    
+    def new_scheduled_set(self):
+        """Creates the set that remembers which apps were already put on the queue during a crawl.
+
+        Returns:
+            common.visited.VisitedSet | common.visited.BloomFilter: An exact set, or a Bloom filter sized 
+                for frontier_capacity apps that uses less memory but skips about 0.1% of the apps.
+        """
+        if self.frontier_capacity is not None:
+            return BloomFilter(self.frontier_capacity)
+        return VisitedSet()
                 
     def generate_links(self):
         """Generates a list of links for each category and chart type 
@@ -114,34 +176,71 @@ class AppStoreScraper:
         Returns:
             list[str]: List of app links found on the page.
         """
-        res = requests.get(url, headers=self.header)
+        res = self.http.get(url, headers=self.header)
         if res.status_code == requests.codes.ok:
-            soup = BeautifulSoup(res.text, "html.parser")
-            
-            links = soup.find_all("a", {'class': "we-lockup targeted-link"})
+            return self.extract_app_links(res.text)
+    
+    def discover_seeds(self, workers=16):
+        """Fetches the chart pages concurrently and yields the app links of each chart as soon as it 
+        returns, so the crawl starts on the first chart instead of waiting for all of them. Charts 
+        in the seed cache are yielded first without a request.
 
-            urls = [link['href'] for link in links if 'href' in link.attrs]
-            
-            return urls
+        Args:
+            workers (int, optional): Number of chart pages fetched at once. Defaults to 16.
+
+        Yields:
+            tuple: The chart link and the app links found on it.
+        """
+        uncached = []
+        for link in self.links:
+            app_links = self.seed_cache.get(link) if self.seed_cache is not None else None
+            if app_links is not None:
+                yield (link, app_links)
+            else:
+                uncached.append(link)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.search_app_link, link): link for link in uncached}
+            for future in as_completed(futures):
+                link = futures[future]
+                try:
+                    app_links = future.result()
+                except Exception as e:
+                    print(f"Error occurred at URL: {link} - {e}")
+                    crawl_metrics.error("seed", e)
+                    continue
+                # charts that could not be fetched are not cached, so the next crawl tries them again
+                if app_links is None:
+                    continue
+                if self.seed_cache is not None:
+                    self.seed_cache.put(link, app_links)
+                yield (link, app_links)
     
-    def scroll_to_bottom(self):
-        """Scrolls to the bottom of the page using JavaScript.
+    @staticmethod
+    def extract_app_links(page):
+        """Extracts the app links from the HTML of a chart page.
+
+        Args:
+            page (str): HTML of the chart page.
 
+        Returns:
+            list[str]: List of app links found on the page.
         """
-        old_scroll_position = 0
-        new_scroll_position = None
+        soup = make_soup(page)
+        
+        links = soup.find_all("a", {'class': "we-lockup targeted-link"})
+
+        # canonical links, so the same app is never queued twice under different URLs
+        urls = [canonical_ios_url(link['href']) for link in links if 'href' in link.attrs]
+        
+        return [url for url in urls if url is not None]
+    
+    def scroll_to_bottom(self):
+        """Scrolls to the bottom of the page using JavaScript, waiting for each batch of 
+        apps to load instead of a fixed time.
 
-        while new_scroll_position != old_scroll_position:
-            old_scroll_position = self.driver.execute_script(
-                "return window.scrollY;"
-            )
-            self.driver.execute_script(
-                "window.scrollTo(0, document.body.scrollHeight);"
-            )
-            time.sleep(2)
-            new_scroll_position = self.driver.execute_script(
-                "return window.scrollY;"
-            )
+        """
+        ScrollLoader(self.driver, item_selector="a.we-lockup").scroll_to_bottom()
     
     def search_see_all_links_scroll(self, url):
         """Scrolls page and searches for all links on the given URL page.
@@ -153,21 +252,27 @@ class AppStoreScraper:
             list[str]: List of all links found on the page.
         """
         
-        self.driver = webdriver.Chrome(service=self.service)
-        self.driver.get(url)
+        self.driver = self.driver_pool.acquire()
+        try:
+            self.driver.get(url)
 
-        # Scrolls to the bottom of the page
-        self.scroll_to_bottom()
-        
-        soup = BeautifulSoup(self.driver.page_source, "html.parser")
+            # Scrolls to the bottom of the page
+            self.scroll_to_bottom()
+            
+            page_source = self.driver.page_source
+            if self.http.archive is not None:
+                self.http.archive.store(url, page_source, kind="browser")
+            
+            soup = make_soup(page_source)
+        finally:
+            self.driver_pool.release(self.driver)
         
         links = soup.find_all("a", {'class': "we-lockup targeted-link l-column--grid small-valign-top we-lockup--in-app-shelf l-column small-6 medium-3 large-2"})
 
-        urls = [link['href'] for link in links if 'href' in link.attrs]
-            
-        self.driver.quit()
+        # canonical links, so the same app is never queued twice under different URLs
+        urls = [canonical_ios_url(link['href']) for link in links if 'href' in link.attrs]
         
-        return urls
+        return [url for url in urls if url is not None]
     
     def search_see_all_links(self, url):
         """Searches for all links on the given URL page.
@@ -175,19 +280,33 @@ class AppStoreScraper:
         Args:
             url (str): URL of the page to search for all links.
 
+        Returns:
+            list[str]: List of all links found on the page, empty if the page could not be fetched.
+        """
+        res = self.http.get(url, headers=self.header)
+        if res.status_code != requests.codes.ok:
+            print(f"Error fetching 'See All' page: {url} - Status code: {res.status_code}")
+            return []
+        return self.extract_see_all_links(res.text)
+    
+    @staticmethod
+    def extract_see_all_links(page):
+        """Extracts the app links from the HTML of a 'See All' page.
+
+        Args:
+            page (str): HTML of the 'See All' page.
+
         Returns:
             list[str]: List of all links found on the page.
         """
-        res = requests.get(url, headers=self.header)
-        if res.status_code == requests.codes.ok:
-            
-            soup = BeautifulSoup(res.text, "html.parser")
-            
-            links = soup.find_all("a", {'class': "we-lockup targeted-link l-column--grid small-valign-top we-lockup--in-app-shelf l-column small-6 medium-3 large-2"})
+        soup = make_soup(page)
+        
+        links = soup.find_all("a", {'class': "we-lockup targeted-link l-column--grid small-valign-top we-lockup--in-app-shelf l-column small-6 medium-3 large-2"})
 
-            urls = [link['href'] for link in links if 'href' in link.attrs]
-                            
-            return urls
+        # canonical links, so the same app is never queued twice under different URLs
+        urls = [canonical_ios_url(link['href']) for link in links if 'href' in link.attrs]
+        
+        return [url for url in urls if url is not None]
         
     def create_see_all_link(self, url):
         """Creates a URL for the 'See All' page.
@@ -204,51 +323,157 @@ class AppStoreScraper:
 
     def crawl_app_links(self):
         """
-        Run BFS and process each valid link
+        Run BFS and process each valid link. Apps are crawled from the first chart that returns 
+        while the other charts are still being fetched.
         """
       
         working_queue = queue.SimpleQueue()  
         
-        working_dict = {}
-        try: 
-            print(self.processed_apps)
+        working_dict = self.new_scheduled_set()
+        print(f"{len(self.processed_apps)} apps were already processed.")
 
-            for link in self.links:
-                app_links = self.search_app_link(link)
-                for app in app_links:
-                    app_key = app.split("/id")[-1]
-                    if app_key in working_dict or app_key in self.processed_apps:
-                        continue
-                    working_dict[app_key] = True
-                    working_queue.put(app)
-                    
-            print(f"The queue currently has {working_queue.qsize()} items.")
-                
-        except Exception as e:
-                print(f"Error occurred at URL: {app} - {e}")
+        def add_seeds(app_links):
+            for app in app_links:
+                app_key = ios_app_id(app)
+                if app_key in working_dict or app_key in self.processed_apps:
+                    continue
+                working_dict.add(app_key)
+                working_queue.put(app)
+                self.expect_metadata([app_key])
         
-        while not working_queue.empty():
-            url = working_queue.get()
-            
+        self.crawl_queue(working_queue, self.seed_in_background(add_seeds))
+    
+    def seed_in_background(self, add_seeds):
+        """Runs discover_seeds on a thread of its own, so the crawl can work on the apps of the 
+        charts that already returned.
+
+        Args:
+            add_seeds (function): Called with the app links of every chart as it returns.
+
+        Returns:
+            threading.Thread: The seeding thread, alive until every chart has been handled.
+        """
+        def seed():
+            count = 0
+            for link, app_links in self.discover_seeds():
+                add_seeds(app_links)
+                count += len(app_links)
+            print(f"Seeding finished with {count} app links from the charts.")
+        
+        seeder = threading.Thread(target=seed, daemon=True)
+        seeder.start()
+        return seeder
+    
+    def crawl_queue(self, working_queue, seeder=None):
+        """
+        Process the app links in the queue, adding the apps on each 'See All' page, until it is empty.
+        Apps that fail are put on the dead-letter queue if there is one.
+
+        Args:
+            working_queue (queue.SimpleQueue): App links waiting to be processed.
+            seeder (threading.Thread, optional): Thread still adding seeds to the queue, the queue is 
+                only done once it has finished. Defaults to None.
+        """
+        def queue_links(url, app_links):
+            for link in app_links:
+                if ios_app_id(link) not in self.processed_apps:
+                    working_queue.put(link)
+                    self.expect_metadata([ios_app_id(link)])
+        
+        while True:
+            # checked before the queue, so a seed added just before the seeder finished is not missed
+            seeding = seeder is not None and seeder.is_alive()
             try:
-                if url.split("/id")[-1] in self.processed_apps:
+                url = working_queue.get(timeout=0.1) if seeding else working_queue.get_nowait()
+            except queue.Empty:
+                if seeding:
                     continue
-                
-                print(f"Processing link: {url}")
-                app = iOS(url) 
-                app.write_to_json()
-                
-                self.processed_apps[url.split("/id")[-1]] = True
-                
-                see_all_link = self.create_see_all_link(url) # create the see all page link
-                app_links = self.search_see_all_links(see_all_link)  # create list of valid links
-                
-                for link in app_links:
-                    if link.split("/id")[-1] not in self.processed_apps:
-                        working_queue.put(link)
-                        
+                break
+            
+            try:
+                if ios_app_id(url) not in self.processed_apps:
+                    self.crawl_app(url, queue_links)
             except Exception as e:
-                print(f"Error occurred at URL: {url} - {e}")
+                if not self.app_failed(url, e):
+                    self.dead_letter(url, e)
+    
+    def crawl_app(self, url, queue_links):
+        """
+        Scrapes an app, saves it, marks it as processed and queues the apps on its 'See All' page. 
+        Every threaded crawl mode crawls its apps with this, they only differ in where the links go.
+
+        Args:
+            url (str): App link.
+            queue_links (function): Called with the app link and the app links on its 'See All' page.
+        """
+        print(f"Processing link: {url}")
+        app = iOS(url, driver_pool=self.driver_pool, http_client=self.http, metadata=self.metadata)
+        app.write_to_json()
+        
+        self.processed_apps.add(ios_app_id(url))
+        
+        see_all_link = self.create_see_all_link(url) # create the see all page link
+        app_links = self.search_see_all_links(see_all_link)  # create list of valid links
+        queue_links(url, app_links)
+    
+    def app_failed(self, url, error):
+        """Reports an app that raised an error while it was crawled.
+
+        Args:
+            url (str): App link.
+            error (Exception): The error.
+
+        Returns:
+            bool: True if the app was saved before the error, e.g. when its 'See All' page failed. 
+                Such an app is done and must not be crawled again.
+        """
+        print(f"Error occurred at URL: {url} - {error}")
+        crawl_metrics.error("app", error)
+        return ios_app_id(url) in self.processed_apps
+    
+    def expect_metadata(self, app_ids):
+        """Registers apps that are about to be scraped with the metadata source, if there is one, 
+        so their app info is looked up in a few batched requests.
+
+        Args:
+            app_ids (list[int]): IDs of the apps.
+        """
+        if self.metadata is not None:
+            self.metadata.expect(app_ids)
+    
+    def dead_letter(self, url, error):
+        """Puts an app that failed on the dead-letter queue, if the crawl has one.
+
+        Args:
+            url (str): App link.
+            error (Exception): Why the app failed.
+        """
+        if self.dead_letters is not None:
+            self.dead_letters.add(url, error)
+    
+    def redrive_dead_letters(self, limit=None):
+        """
+        Crawls the apps on the dead-letter queue that are due for another attempt, and the apps 
+        found on their 'See All' pages. Apps that fail again go back on the queue with a longer delay.
+
+        Args:
+            limit (int, optional): Maximum number of apps taken off the queue. Defaults to every due app.
+        """
+        if self.dead_letters is None:
+            print("No dead-letter queue to re-drive, the scraper was built without dead_letter_path.")
+            return
+        due = self.dead_letters.due(limit)
+        working_queue = queue.SimpleQueue()
+        for url in due:
+            working_queue.put(url)
+        print(f"Re-driving {len(due)} apps from the dead-letter queue.")
+        self.crawl_queue(working_queue)
+        
+        # apps that failed again were pushed back with a longer delay, the rest are done once they are on disk
+        sync_corpus()
+        for url in due:
+            if ios_app_id(url) in self.processed_apps:
+                self.dead_letters.remove(url)
     
     def load_json_and_generate_queue(self, directory):
         """
@@ -258,20 +483,16 @@ class AppStoreScraper:
         """
         working_queue = queue.SimpleQueue()
 
-        # Load the JSON files
-        for filename in os.listdir(directory):
-            if filename.endswith(".json"):
-                with open(os.path.join(directory, filename)) as f:
-                    data = json.load(f)
-
-                url = data['app_info']['URL']  # extract the URL
+        # Load the JSON files and corpus shards
+        for data in read_corpus(directory):
+            url = data['app_info']['URL']  # extract the URL
 
-                see_all_link = self.create_see_all_link(url)  # create the see all page link
-                app_links = self.search_see_all_links(see_all_link)  # create list of valid links
+            see_all_link = self.create_see_all_link(url)  # create the see all page link
+            app_links = self.search_see_all_links(see_all_link)  # create list of valid links
 
-                for link in app_links:
-                    if link.split("/id")[-1] not in self.processed_apps:
-                        working_queue.put(link)
+            for link in app_links:
+                if ios_app_id(link) not in self.processed_apps:
+                    working_queue.put(link)
 
         return working_queue
     
@@ -286,35 +507,574 @@ class AppStoreScraper:
         working_queue = self.load_json_and_generate_queue(directory)
 
         # Continue processing as per the crawl_app_links function
-        while not working_queue.empty():
-            url = working_queue.get()
+        self.crawl_queue(working_queue)
 
-            try:
-                if url.split("/id")[-1] in self.processed_apps:
+    async def fetch_async(self, session, url):
+        """Fetches a page without blocking the event loop, waiting for both the global 
+        and the per-host concurrency limits and for the rate limiter of the host. Connection errors,
+        timeouts and 429 or 5xx responses are retried like HttpClient.get does.
+
+        Args:
+            session (aiohttp.ClientSession): Session used for the request.
+            url (str): URL of the page to fetch.
+
+        Returns:
+            str: HTML of the page, or None if the page could not be fetched.
+
+        Raises:
+            aiohttp.ClientError: If the host was still failing or throttling after every retry.
+        """
+        archive = self.http.archive
+        if archive is not None and archive.replay:
+            res = archive.response(url)
+            return res.text if res.status_code == requests.codes.ok else None
+        
+        host = urlsplit(url).netloc
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.per_host_concurrency)
+            
+        limiter = self.http.rate_limiter
+        retries = self.http.retries
+            
+        async with self.global_limit, self.host_limits[host]:
+            for attempt in range(retries + 1):
+                await asyncio.sleep(limiter.reserve(host))
+                try:
+                    with crawl_metrics.stage("fetch"):
+                        async with session.get(url, headers=self.header) as res:
+                            page = await res.text()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    limiter.record(host, None)
+                    if attempt == retries:
+                        raise
+                    crawl_metrics.count("retries")
+                    print(f"Retrying {url} - {e!r}")
+                    await asyncio.sleep(retry_delay(attempt, self.http.backoff, self.http.max_backoff))
                     continue
+                
+                retry_after = parse_retry_after(res.headers.get("Retry-After"))
+                limiter.record(host, res.status, retry_after)
+                if res.status not in RETRY_STATUSES or attempt == retries:
+                    break
+                crawl_metrics.count("retries")
+                crawl_metrics.count(f"http_{res.status}")
+                await asyncio.sleep(retry_delay(attempt, self.http.backoff, self.http.max_backoff, retry_after))
+            
+            if archive is not None:
+                await asyncio.to_thread(archive.store, url, page, res.status)
+            if res.status != requests.codes.ok:
+                crawl_metrics.count("http_errors")
+                print(f"Error fetching URL: {url} - Status code: {res.status}")
+                # unlike a missing page, throttling is worth another try later
+                if res.status in RETRY_STATUSES:
+                    res.raise_for_status()
+                return None
+            return page
+    
+    def schedule_app(self, url, frontier, scheduled):
+        """Adds an app link to the frontier unless it was already processed or scheduled.
+
+        Args:
+            url (str): App link to add.
+            frontier (asyncio.Queue): Queue of app links waiting to be processed.
+            scheduled (common.visited.VisitedSet): IDs of the apps that have already been put on the frontier.
+        """
+        app_key = ios_app_id(url)
+        if app_key in scheduled or app_key in self.processed_apps:
+            return
+        scheduled.add(app_key)
+        frontier.put_nowait(url)
+        self.expect_metadata([app_key])
+        if self.store is not None:
+            self.store.push(str(app_key), url)
+    
+    async def process_app_async(self, session, url, frontier, scheduled):
+        """Scrapes a single app and schedules the apps on its 'See All' page. 
+        Parsing and the Selenium fallback are blocking, so they run in a worker thread.
 
-                print(f"Processing link: {url}")
-                app = iOS(url) 
-                app.write_to_json()
+        Args:
+            session (aiohttp.ClientSession): Session used for the requests.
+            url (str): App link to process.
+            frontier (asyncio.Queue): Queue of app links waiting to be processed.
+            scheduled (common.visited.VisitedSet): IDs of the apps that have already been put on the frontier.
+        """
+        page = await self.fetch_async(session, url)
+        if page is None:
+            return
+        
+        app = await asyncio.to_thread(iOS, url, self.driver_pool, page, self.http, metadata=self.metadata)
+        await asyncio.to_thread(app.write_to_json)
+        
+        self.processed_apps.add(ios_app_id(url))
+        
+        see_all_page = await self.fetch_async(session, self.create_see_all_link(url))
+        if see_all_page is not None:
+            app_links = await asyncio.to_thread(self.extract_see_all_links, see_all_page)
+            if self.store is not None:
+                self.store.add_edges(str(ios_app_id(url)), [str(ios_app_id(link)) for link in app_links])
+            for link in app_links:
+                self.schedule_app(link, frontier, scheduled)
+    
+    async def crawl_worker(self, session, frontier, scheduled):
+        """Worker task that keeps taking app links from the frontier and processing them.
+
+        Args:
+            session (aiohttp.ClientSession): Session used for the requests.
+            frontier (asyncio.Queue): Queue of app links waiting to be processed.
+            scheduled (common.visited.VisitedSet): IDs of the apps that have already been put on the frontier.
+        """
+        while True:
+            url = await frontier.get()
+            try:
+                app_key = ios_app_id(url)
+                try:
+                    if app_key not in self.processed_apps:
+                        print(f"Processing link: {url}")
+                        await self.process_app_async(session, url, frontier, scheduled)
+                except Exception as e:
+                    if not self.app_failed(url, e):
+                        self.dead_letter(url, e)
+                
+                # cancelled apps are left in the stored frontier so they are crawled again on restart
+                if self.store is not None:
+                    self.store.finish(str(app_key), visited=app_key in self.processed_apps)
+            finally:
+                frontier.task_done()
+    
+    async def crawl_async(self, seed_pages, extract_links, concurrency, per_host_concurrency, seed_apps=()):
+        """
+        Run BFS over the app links found on the seed pages with many apps in flight at once.
+
+        Args:
+            seed_pages (list[str]): URLs of the pages the first app links are taken from.
+            extract_links (function): Extracts the app links from the HTML of a seed page.
+            concurrency (int): Maximum number of requests in flight and number of worker tasks.
+            per_host_concurrency (int): Maximum number of requests in flight to a single host.
+            seed_apps (list[str], optional): App links put on the frontier before the seed pages are fetched.
+        """
+        self.global_limit = asyncio.Semaphore(concurrency)
+        self.host_limits = {}
+        self.per_host_concurrency = per_host_concurrency
+        
+        frontier = asyncio.Queue()
+        scheduled = self.new_scheduled_set()
+        
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(timeout=timeout, trace_configs=[aiohttp_trace_config()]) as session:
+            workers = [asyncio.create_task(self.crawl_worker(session, frontier, scheduled)) for _ in range(concurrency)]
+            
+            for app in seed_apps:
+                self.schedule_app(app, frontier, scheduled)
+            
+            async def fetch_seed(link):
+                try:
+                    return (link, await self.fetch_async(session, link))
+                except Exception as e:
+                    return (link, e)
+            
+            # the apps of each seed page are scheduled as soon as it returns, the workers start on them right away
+            for seed in asyncio.as_completed([fetch_seed(link) for link in seed_pages]):
+                link, page = await seed
+                if isinstance(page, Exception):
+                    print(f"Error occurred at URL: {link} - {page}")
+                    crawl_metrics.error("seed", page)
+                elif page is not None:
+                    for app in extract_links(page):
+                        self.schedule_app(app, frontier, scheduled)
+            
+            print(f"The queue currently has {frontier.qsize()} items.")
+            
+            await frontier.join()
+            
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    def crawl_app_links_async(self, concurrency=20, per_host_concurrency=8):
+        """
+        Same as crawl_app_links, but overlaps the network waits of many apps using asyncio.
+
+        Args:
+            concurrency (int, optional): Maximum number of requests in flight. Defaults to 20.
+            per_host_concurrency (int, optional): Maximum number of requests in flight to a single host. Defaults to 8.
+        """
+        asyncio.run(self.crawl_async(self.links, self.extract_app_links, concurrency, per_host_concurrency))
+    
+    def restart_crawler_async(self, directory, concurrency=20, per_host_concurrency=8):
+        """
+        Same as restart_crawler, but the 'See All' pages of the processed apps and the 
+        remaining crawl are fetched concurrently using asyncio.
 
-                self.processed_apps[url.split("/id")[-1]] = True
+        Args:
+            directory (str): Directory where the JSON files are stored.
+            concurrency (int, optional): Maximum number of requests in flight. Defaults to 20.
+            per_host_concurrency (int, optional): Maximum number of requests in flight to a single host. Defaults to 8.
+        """
+        seed_pages = []
+        for data in read_corpus(directory):
+            seed_pages.append(self.create_see_all_link(data['app_info']['URL']))
+        
+        asyncio.run(self.crawl_async(seed_pages, self.extract_see_all_links, concurrency, per_host_concurrency))
+    
+    def open_store(self, path):
+        """Opens the crawl frontier stored on disk and marks its visited apps as processed.
+
+        Args:
+            path (str): Path of the SQLite database holding the frontier.
+        """
+        # apps are only marked visited once their data is on disk
+        self.store = CrawlFrontier(path, before_commit=sync_corpus)
+        self.processed_apps.update(int(app_key) for app_key in self.store.visited_keys() if app_key.isdigit())
+    
+    def close_store(self):
+        """Writes the crawl frontier to disk and closes it.
 
-                see_all_link = self.create_see_all_link(url) # create the see all page link
-                app_links = self.search_see_all_links(see_all_link)  # create list of valid links
+        No parameters or return values.
+        """
+        self.store.close()
+        self.store = None
+    
+    def resume_crawler(self, path):
+        """
+        Run BFS on a crawl frontier stored on disk. The first run seeds the frontier from the 
+        chart pages, later runs continue with the queued links without fetching anything again.
 
+        Args:
+            path (str): Path of the SQLite database holding the frontier.
+        """
+        self.open_store(path)
+        try:
+            def add_seeds(app_links):
+                for app in app_links:
+                    self.store.push(str(ios_app_id(app)), app)
+            
+            def queue_links(url, app_links):
+                self.store.add_edges(str(ios_app_id(url)), [str(ios_app_id(link)) for link in app_links])
                 for link in app_links:
-                    if link.split("/id")[-1] not in self.processed_apps:
-                        working_queue.put(link)
+                    if ios_app_id(link) not in self.processed_apps:
+                        self.store.push(str(ios_app_id(link)), link)
+            
+            seeder = None
+            if self.store.is_empty():
+                seeder = self.seed_in_background(add_seeds)
+            
+            url = self.next_frontier_url(seeder)
+            while url is not None:
+                app_key = ios_app_id(url)
+                try:
+                    if app_key not in self.processed_apps:
+                        self.crawl_app(url, queue_links)
+                except Exception as e:
+                    if not self.app_failed(url, e):
+                        self.dead_letter(url, e)
+                
+                # interrupted apps are left in the frontier so they are crawled again on restart
+                self.store.finish(str(app_key), visited=app_key in self.processed_apps)
+                    
+                url = self.next_frontier_url(seeder)
+        finally:
+            self.close_store()
+    
+    def next_frontier_url(self, seeder=None):
+        """Takes the next app link from the stored frontier, waiting for the seeding thread while 
+        the frontier is empty.
+
+        Args:
+            seeder (threading.Thread, optional): Thread still adding seeds to the frontier. Defaults to None.
+
+        Returns:
+            str: The app link, or None once the frontier is exhausted.
+        """
+        while True:
+            # checked before the frontier, so a seed added just before the seeder finished is not missed
+            seeding = seeder is not None and seeder.is_alive()
+            url = self.store.pop()
+            if url is not None or not seeding:
+                return url
+            time.sleep(0.1)
+    
+    def resume_crawler_async(self, path, concurrency=20, per_host_concurrency=8):
+        """
+        Same as resume_crawler, but crawls with asyncio like crawl_app_links_async.
+
+        Args:
+            path (str): Path of the SQLite database holding the frontier.
+            concurrency (int, optional): Maximum number of requests in flight. Defaults to 20.
+            per_host_concurrency (int, optional): Maximum number of requests in flight to a single host. Defaults to 8.
+        """
+        self.open_store(path)
+        try:
+            if self.store.is_empty():
+                asyncio.run(self.crawl_async(self.links, self.extract_app_links, concurrency, per_host_concurrency))
+            else:
+                asyncio.run(self.crawl_async([], self.extract_app_links, concurrency, per_host_concurrency,
+                                             seed_apps=self.store.queued_urls()))
+        finally:
+            self.close_store()
+    
+    def crawl_distributed(self, work_queue, worker_id=None, partitions=None, batch_size=4, poll_interval=5, seed=True):
+        """
+        Run BFS as one of many workers, on this or other machines, sharing a work queue instead of 
+        an in-memory queue. Each worker claims the apps of its own partitions first and takes over 
+        the other partitions once its own are empty, so the crawl finishes even if a node crashes. 
+        Apps found on the 'See All' pages are queued once for the whole crawl.
+
+        Args:
+            work_queue (common.workqueue.SqliteWorkQueue | common.workqueue.RedisWorkQueue | common.workqueue.MemoryWorkQueue): 
+                The queue shared by every worker.
+            worker_id (str, optional): Name of this worker, unique across nodes. Defaults to the host name and process ID.
+            partitions (list[int], optional): Partitions this worker owns, see common.workqueue.node_partitions. 
+                Defaults to every partition.
+            batch_size (int, optional): Number of apps claimed at once. Defaults to 4.
+            poll_interval (float, optional): Seconds to wait while other workers hold the remaining apps. Defaults to 5.
+            seed (bool, optional): Whether to queue the apps on the chart pages first. Only one node needs to, 
+                the others stop right away if they start before it queued anything. Defaults to True.
+        """
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        
+        seeder = None
+        if seed:
+            # each chart is queued as soon as it returns, this and other nodes can start on it right away
+            seeder = self.seed_in_background(
+                lambda app_links: work_queue.push_many([(ios_app_id(app), app) for app in app_links]))
+        print(f"The work queue currently has {work_queue.counts()} items.")
+        
+        def queue_links(url, app_links):
+            work_queue.push_many([(ios_app_id(link), link) for link in app_links])
+        
+        while True:
+            # checked before the queue, so seeds queued just before the seeder finished are not missed
+            seeding = seeder is not None and seeder.is_alive()
+            claimed = work_queue.claim(worker_id, partitions, batch_size)
+            if not claimed and partitions is not None:
+                claimed = work_queue.claim(worker_id, None, batch_size)
+            if not claimed:
+                # apps leased by other workers come back if those workers crash
+                if work_queue.pending() == 0:
+                    if not seeding:
+                        break
+                    # the next chart has not returned yet
+                    time.sleep(0.1)
+                    continue
+                time.sleep(poll_interval)
+                continue
+            
+            self.expect_metadata([int(app_key) for app_key, url in claimed])
+            for app_key, url in claimed:
+                # the lease may have run out while the rest of the batch was crawled
+                if not work_queue.renew(worker_id, app_key):
+                    continue
+                try:
+                    if int(app_key) not in self.processed_apps:
+                        self.crawl_app(url, queue_links)
+                    # the app must be on disk before no node will crawl it again
+                    sync_corpus()
+                    work_queue.complete(app_key)
+                    
+                except Exception as e:
+                    # a saved app is done even if its 'See All' page failed, so no other node saves it twice
+                    if self.app_failed(url, e):
+                        sync_corpus()
+                        work_queue.complete(app_key)
+                    else:
+                        # retried by any worker until the queue gives it up
+                        work_queue.fail(app_key)
+    
+    def refresh_corpus(self, directory, store_path, limit=None):
+        """
+        Re-checks the privacy labels of the apps in the corpus that are due, the most overdue first, 
+        see ios.refresh_app. Apps saved to the corpus since the last refresh start being tracked with 
+        the hash of their saved labels.
+
+        Args:
+            directory (str): Directory of the corpus.
+            store_path (str): Path of the SQLite database of the refresh state, see common.refresh.RefreshStore.
+            limit (int, optional): Maximum number of apps to check. Defaults to every due app.
+        """
+        store = RefreshStore(store_path)
+        try:
+            tracked = []
+            for data in read_corpus(directory):
+                url = canonical_ios_url(data['app_info']['URL'])
+                if url is not None:
+                    tracked.append((ios_app_id(url), url, label_hash(data['compact_dict'])))
+            store.track(tracked)
+            
+            due = store.due(limit)
+            print(f"{len(due)} apps are due for a refresh.")
+            changed = 0
+            for app_key, url in due:
+                try:
+                    if refresh_app(url, store, self.driver_pool, self.http):
+                        changed += 1
+                        print(f"Labels changed: {url}")
+                except Exception as e:
+                    print(f"Error occurred at URL: {url} - {e}")
+                    crawl_metrics.error("refresh", e)
+            crawl_metrics.count("labels_changed", changed)
+            print(f"{changed} of {len(due)} apps had changed labels.")
+        finally:
+            store.close()
+    
+    def reparse_archive(self, directory, processes=None):
+        """
+        Rebuilds the JSON file of every archived app page offline, spread over all cores.
+
+        Args:
+            directory (str): Directory of the page archive.
+            processes (int, optional): Number of worker processes. Defaults to the number of cores.
+        """
+        archive = PageArchive(directory, replay=True)
+        app_urls = [url for url in archive.urls() if "/app/" in url and "?" not in url]
+        archive.close()
+        
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_replay_worker, initargs=(directory, get_parser())) as executor:
+            for url, error in executor.map(reparse_app, app_urls, chunksize=16):
+                if error is not None:
+                    print(f"Error occurred at URL: {url} - {error}")
+                else:
+                    self.processed_apps.add(ios_app_id(url))
+    
+    def fetch_crawl_pages(self, item):
+        """
+        Fetch stage of the crawl pipeline. Downloads the app page and its 'See All' page, or on the 
+        second pass of an app without embedded privacy data, the page with the privacy pop up open.
+        The app page of the first pass travels with the item, so it is not downloaded again.
+
+        Args:
+            item (tuple): The app link, and on the browser pass the HTML of the app page, else None.
+
+        Returns:
+            dict: The raw pages, keyed "app" and "see_all", or "modal" on the browser pass.
+        """
+        url, app_page = item
+        
+        if app_page is not None:
+            return {"modal": fetch_modal_page(url, self.driver_pool, self.service, self.http.archive)}
+        
+        res = self.http.get(url, headers=self.header)
+        if res.status_code != requests.codes.ok:
+            raise requests.HTTPError(f"Status code: {res.status_code}", response=res)
+        pages = {"app": res.text}
+        
+        res = self.http.get(self.create_see_all_link(url), headers=self.header)
+        if res.status_code == requests.codes.ok:
+            pages["see_all"] = res.text
+        return pages
+    
+    def handle_crawl_result(self, pipeline, item, result, error):
+        """
+        Last stage of the crawl pipeline. Saves the parsed app and puts newly found apps on the pipeline.
+
+        Args:
+            pipeline (common.pipeline.FetchParsePipeline): The running pipeline.
+            item (tuple): The app link, and the HTML of the app page on the browser pass.
+            result (tuple): What parse_crawl_pages returned, or None if the app failed.
+            error (Exception): The exception raised for the app, or None.
+        """
+        url = item[0]
+        if error is not None:
+            print(f"Error occurred at URL: {url} - {error}")
+            crawl_metrics.error("app", error)
+            self.dead_letter(url, error)
+            return
+        
+        data, app_page, app_links = result
+        if app_page is not None:
+            pipeline.put((url, app_page))
+        else:
+            print(f"Processing link: {url}")
+            write_app_json(data)
+            self.processed_apps.add(ios_app_id(url))
+        
+        for link in app_links:
+            if self.claim_app(link):
+                pipeline.put((link, None))
+    
+    def claim_app(self, url):
+        """Records that an app is about to be crawled, unless it already was.
+
+        Args:
+            url (str): App link.
+
+        Returns:
+            bool: True if the app still had to be crawled.
+        """
+        app_key = ios_app_id(url)
+        with self.claim_lock:
+            if app_key in self.claimed_apps or app_key in self.processed_apps:
+                return False
+            self.claimed_apps.add(app_key)
+            return True
+    
+    def crawl_app_links_pipeline(self, fetch_workers=16, parse_workers=None):
+        """
+        Same BFS as crawl_app_links, but pages are fetched by a pool of threads while a pool of 
+        processes parses them, so the network and all cores are busy at the same time.
+
+        Args:
+            fetch_workers (int, optional): Number of fetch threads. Defaults to 16.
+            parse_workers (int, optional): Number of parser processes. Defaults to the number of cores.
+        """
+        self.claimed_apps = self.new_scheduled_set()
+        self.claim_lock = threading.Lock()
+        
+        # apps go on the pipeline as their chart returns, while the other charts are still being fetched
+        def seed_items():
+            for link, app_links in self.discover_seeds():
+                for app in app_links:
+                    if self.claim_app(app):
+                        yield (app, None)
+        
+        pipeline = FetchParsePipeline(
+            self.fetch_crawl_pages, parse_crawl_pages,
+            lambda item, result, error: self.handle_crawl_result(pipeline, item, result, error),
+            fetch_workers=fetch_workers, parse_workers=parse_workers,
+            initializer=configure_parser, initargs=(get_parser(),))
+        pipeline.run(seed_items())
+
+
+def parse_crawl_pages(item, pages):
+    """
+    Parse stage of the crawl pipeline, runs in a parser process.
+
+    Args:
+        item (tuple): The app link, and the HTML of the app page on the browser pass, else None.
+        pages (dict): The raw pages returned by AppStoreScraper.fetch_crawl_pages.
+
+    Returns:
+        tuple: The app's data, the HTML of the app page if it still needs the browser pass or None, 
+            and the app links on its 'See All' page.
+    """
+    url, app_page = item
+    if app_page is not None:
+        pages = {**pages, "app": app_page}
+    data, needs_browser = parse_app_pages(url, pages)
+    app_links = AppStoreScraper.extract_see_all_links(pages["see_all"]) if "see_all" in pages else []
+    return (data, pages["app"] if needs_browser else None, app_links)
 
-            except Exception as e:
-                print(f"Error occurred at URL: {url} - {e}")
         
 def main():
     directory = "json_files"
-    scrape = AppStoreScraper()
+    scrape = AppStoreScraper(dead_letter_path="dead_letters.db", seed_cache_path="seed_cache.json", use_lookup=True)
+    crawl_metrics.start_exporter("crawl_metrics.jsonl", "crawl_metrics.prom", interval=60)
+    # new apps go to compressed shards next to the existing JSON files. Opening the writer recovers the
+    # shards of a killed crawl, so it comes before loading the processed apps
+    configure_corpus(directory)
     scrape.load_processed_apps(directory)
-    scrape.restart_crawler(directory)
-    # scrape.crawl_app_links()  
+    try:
+        scrape.restart_crawler(directory)
+        scrape.redrive_dead_letters()
+        # scrape.crawl_app_links()  
+        # scrape.restart_crawler_async(directory)
+        # scrape.resume_crawler("crawl_frontier.db")
+        # scrape.refresh_corpus(directory, "refresh.db")
+    finally:
+        scrape.driver_pool.close()
+        scrape.dead_letters.close()
+        close_corpus()
+        crawl_metrics.stop_exporter()
 
 
 if __name__ == "__main__":
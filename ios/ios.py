@@ -1,4 +1,4 @@
-from bs4 import BeautifulSoup, NavigableString
+from bs4 import NavigableString
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
@@ -7,14 +7,38 @@ from selenium.webdriver.support import expected_conditions as EC
 import requests
 import os 
 import json
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.http import get_client, HttpClient
+from common.archive import PageArchive
+from common.parser import make_soup, configure_parser
+from common.metrics import crawl_metrics
+from common.corpus import ShardedJsonlWriter
+from common.app_ids import ios_app_id
+from common.refresh import label_hash
+
+# compact labels that mean an app has no expanded labels, see iOS.needs_expanded_labels
+NO_EXPANDED_LABELS = {"Data Not Collected", "No Details Provided"}
+
+HEADER = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.5615.137 Safari/537.36"
+}
 
 class iOS:
-    def __init__(self, url):
+    def __init__(self, url, driver_pool=None, page=None, http_client=None, modal_page=None, use_browser=True, metadata=None):
         self.url = url
         
-        self.header = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.5615.137 Safari/537.36"
-        }
+        # optional common.itunes.ITunesLookup the exact app info is read from instead of the page
+        self.metadata = metadata
+        
+        # pooled keep-alive connections shared with every other scraper unless a client is given
+        self.http = http_client if http_client is not None else get_client()
+        
+        # optional common.driver_pool.DriverPool shared between apps
+        self.driver_pool = driver_pool
+        
+        self.header = dict(HEADER)
         #self.service = Service('/Users/earnsmacbookair/Desktop/chromedriver_mac64/chromedriver')
         self.service = Service('../../chromedriver_mac64/chromedriver')
         
@@ -32,9 +56,26 @@ class iOS:
         
         self.data_track = {}
         
-        self.update_collection_categories() # update data_linked, data_not_linked, data_track dictionary
+        self.pages = {}
+        
+        # HTML of the app page that was already fetched by the caller, e.g. the async crawler
+        if page is not None:
+            self.pages[url] = make_soup(page)
+        
+        # page source with the privacy details pop up open, if the caller already captured it
+        self.modal_page = modal_page
         
-        self.scrape_compact_labels() # update the compact label dictionary
+        # whether Selenium may be started when the page has no embedded privacy data,
+        # needs_browser records that it would have been
+        self.use_browser = use_browser
+        self.needs_browser = False
+        
+        self.scrape_compact_labels() # update the compact label dictionary, first because it is the cheapest
+        
+        if self.needs_expanded_labels():
+            self.update_collection_categories() # update data_linked, data_not_linked, data_track dictionary
+        else:
+            crawl_metrics.count("expanded_labels_skipped")
         
         self.scrape_appinfo() # update the app info dictionary
         
@@ -74,30 +115,73 @@ class iOS:
         else:
             return float(shorthand)
     
+    def get_page(self, url=None):
+        """
+        Fetches and parses the page at the given URL. Each page is only requested and parsed once,
+        the parsed document is cached in the pages dictionary and handed to every extractor.
+
+        Args:
+            url (str, optional): URL of the page to fetch. Defaults to the app's URL.
+
+        Returns:
+            BeautifulSoup: The parsed page.
+
+        Raises:
+            requests.HTTPError: If the page could not be fetched, e.g. the store was still throttling after 
+                every retry or the app was removed. The app fails instead of being saved without its data, 
+                also when the iTunes Lookup API still has its app info.
+        """
+        if url is None:
+            url = self.url
+        if url not in self.pages:
+            res = self.http.get(url, headers=self.header)
+            if res.status_code != requests.codes.ok:
+                raise requests.HTTPError(f"Status code: {res.status_code}", response=res)
+            self.pages[url] = make_soup(res.text)
+        return self.pages[url]
+    
     def scrape_appinfo(self):
         """
         Fetches the app information from the URL and stores it in a dictionary called app_info.
+        With a metadata source, the fields the iTunes Lookup API has exactly come from it, and only
+        the in-app purchases and the kids age band are read from the page.
 
         No parameters or return values.
         """
-        res = requests.get(self.url, headers=self.header)
-        if res.status_code == requests.codes.ok:
-            soup = BeautifulSoup(res.text, "html.parser")
+        # Add URL and get ID from it 
+        app_id = ios_app_id(self.url)
+        
+        fields = self.metadata.get(app_id) if self.metadata is not None else None
+        if fields is not None:
+            # the page is still required, an app whose page fails is not saved from the Lookup data alone
+            soup = self.get_page()
+            app_purchases = self.has_in_app_purchases(soup)
+            kids = False
+            try:
+                kids = self.scrape_age_rating(soup)[1]
+            except AttributeError as e:
+                # the exact fields are still worth keeping when the page layout changed
+                print(f"Failed to scrape age rating. Unable to find element: {e}")
+            self.app_info = {"App Name": fields["App Name"],
+                            "App Category": fields["App Category"],
+                            "URL": self.url, 
+                            "App ID": app_id, 
+                            "Price": fields["Price"], 
+                            "App Rating": fields["App Rating"], 
+                            "No. of Ratings": fields["No. of Ratings"],
+                            "Offers In-App Purchases": app_purchases,
+                            "Age Rating": fields["Age Rating"],
+                            "Kids": kids}
+            return
+        
+        soup = self.get_page()
+        if soup is not None:
             
             # Find the title
             title = soup.find('h1', {'class': "product-header__title app-header__title"}).get_text(strip=True)
             
             # Find the age rating
-            age_dt = soup.find('dt', string='Age Rating')
-            age_dd = age_dt.find_next_sibling('dd')
-            age_rating = "".join(t for t in age_dd.contents if isinstance(t, NavigableString)).strip()
-            if "," in age_rating:
-                age = age_rating.split(",")
-                rating = age[0]
-                kids = age[1]
-            else:
-                rating = age_rating
-                kids = False
+            rating, kids = self.scrape_age_rating(soup)
 
             # Find the category
             category_dt = soup.find('dt', string='Category')
@@ -120,27 +204,49 @@ class iOS:
                 no_of_rating = int(self.convert_shorthand_to_number(ratings[2]))
             
             # Find in App Purchases
-            app_purchases = soup.find("li", {"class", "inline-list__item inline-list__item--bulleted app-header__list__item--in-app-purchase"})
-            if app_purchases == None:
-                app_purchases = False
-            else:
-                app_purchases = True
-                
-            # Add URL and get ID from it 
-            app_id = self.url.split("/id")[-1]
+            app_purchases = self.has_in_app_purchases(soup)
             
             self.app_info = {"App Name": title,
                             "App Category": category,
                             "URL": self.url, 
-                            "App ID": int(app_id), 
+                            "App ID": app_id, 
                             "Price": price, 
                             "App Rating": app_rating, 
                             "No. of Ratings": no_of_rating,
                             "Offers In-App Purchases": app_purchases,
                             "Age Rating": rating,
                             "Kids": kids}
-        else:
-            print(f"Error fetching URL: {self.url} - Status code: {res.status_code}")
+    
+    def scrape_age_rating(self, soup):
+        """
+        Reads the age rating and the kids age band from the app page, e.g. "4+, Ages 5 and under".
+
+        Args:
+            soup (BeautifulSoup): The parsed app page.
+
+        Returns:
+            tuple: The age rating, and the kids age band or False if the app is not made for kids.
+        """
+        age_dt = soup.find('dt', string='Age Rating')
+        age_dd = age_dt.find_next_sibling('dd')
+        age_rating = "".join(t for t in age_dd.contents if isinstance(t, NavigableString)).strip()
+        if "," in age_rating:
+            age = age_rating.split(",")
+            return (age[0], age[1])
+        return (age_rating, False)
+    
+    def has_in_app_purchases(self, soup):
+        """
+        Checks the app page for the in-app purchases note, which the Lookup API does not have.
+
+        Args:
+            soup (BeautifulSoup): The parsed app page.
+
+        Returns:
+            bool: True if the app offers in-app purchases.
+        """
+        app_purchases = soup.find("li", {"class", "inline-list__item inline-list__item--bulleted app-header__list__item--in-app-purchase"})
+        return app_purchases is not None
                          
     def scrape_compact_labels(self):
         """
@@ -148,9 +254,8 @@ class iOS:
 
         No parameters or return values.
         """
-        res = requests.get(self.url, headers=self.header)
-        if res.status_code == requests.codes.ok:
-            soup = BeautifulSoup(res.text, "html.parser")
+        soup = self.get_page()
+        if soup is not None:
             try:
                 cards = soup.find_all("div", {'class': "app-privacy__card"})
                 for card in cards:
@@ -166,44 +271,108 @@ class iOS:
                         self.compact_dict[collection_cat].extend(category_text)
             except AttributeError as e:
                 print(f"Failed to scrape compact label. Unable to find element: {e}")
-        else: 
-                print(f"Error fetching URL: {self.url} - Status code: {res.status_code}")
             
             
-    def update_collection_categories(self):
-        """
-        Fetches data from the app's expanded privacy section using Selenium.
-        The data is stored in three dictionaries, data_linked, data_not_linked and data_track
+    def find_privacy_types(self, data):
+        """Recursively searches decoded page data for the list of privacy types.
 
-        No parameters or return values.
-        """
-        # Set up the WebDriver
-        # creating selenium service
-        driver = webdriver.Chrome(service=self.service) # creating web browser instance 
+        Args:
+            data (dict | list): Decoded JSON data embedded in the app page.
 
-        # Open the url
-        driver.get(self.url)
+        Returns:
+            list: The privacy types found in the data, or None if there are none.
+        """
+        if isinstance(data, dict):
+            if "privacyTypes" in data:
+                return data["privacyTypes"]
+            values = data.values()
+        elif isinstance(data, list):
+            values = data
+        else:
+            return None
+        for value in values:
+            privacy_types = self.find_privacy_types(value)
+            if privacy_types is not None:
+                return privacy_types
+        return None
+
+    def scrape_embedded_labels(self):
+        """
+        Reads the expanded privacy labels from the JSON data embedded in the static app page,
+        without opening a browser. The data is stored in the same three dictionaries as 
+        update_collection_categories, data_linked, data_not_linked and data_track
 
-        # Wait for the page to load completely
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, '//button[text()="See Details"]')))
+        Returns:
+            bool: True if the embedded privacy data was found, False otherwise.
+        """
+        soup = self.get_page()
+        if soup is None:
+            return False
 
-        # Click the button to open the pop up
-        button = driver.find_element(By.XPATH, '//button[text()="See Details"]')
+        privacy_types = None
+        for script in soup.find_all("script", {"type": "fastboot/shoebox"}):
+            try:
+                cache = json.loads(script.string)
+            except (TypeError, ValueError):
+                continue
+            # the shoebox cache maps request keys to JSON encoded responses
+            entries = cache.values() if isinstance(cache, dict) else [cache]
+            for entry in entries:
+                if isinstance(entry, str):
+                    try:
+                        entry = json.loads(entry)
+                    except ValueError:
+                        continue
+                privacy_types = self.find_privacy_types(entry)
+                if privacy_types is not None:
+                    break
+            if privacy_types is not None:
+                break
+
+        if privacy_types is None:
+            return False
+
+        for privacy_type in privacy_types:
+            identifier = privacy_type.get("identifier")
+            if identifier == "DATA_LINKED_TO_YOU" or identifier == "DATA_NOT_LINKED_TO_YOU":
+                if identifier == "DATA_LINKED_TO_YOU":
+                    data_dict = self.data_linked
+                else:
+                    data_dict = self.data_not_linked
+                for purpose_data in privacy_type.get("purposes", []):
+                    purpose = purpose_data.get("purpose", "").strip()
+                    if purpose == "Developer’s Advertising or Marketing":
+                        purpose = "Developer's Advertising or Marketing"
+                    for category_data in purpose_data.get("dataCategories", []):
+                        category = category_data.get("dataCategory", "").strip()
+                        
+                        data_dict.setdefault(purpose, {})
+                        
+                        for type in category_data.get("dataTypes", []):
+                            data_dict[purpose].setdefault(category, [])
+                            
+                            data_dict[purpose][category].append(type.strip())
+                            
+            elif identifier == "DATA_USED_TO_TRACK_YOU":
+                for category_data in privacy_type.get("dataCategories", []):
+                    category = category_data.get("dataCategory", "").strip()
+                    
+                    self.data_track.setdefault(category, [])
+                    
+                    for type in category_data.get("dataTypes", []):
+                        self.data_track[category].append(type.strip())
         
-        try:
-            # button.click()
-            driver.execute_script("arguments[0].click();", button)
-        except Exception as e:
-            print(f"An error occurred when trying to click the button: {e}")
+        return True
 
-        # Wait for the modal content to load
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CLASS_NAME, "app-privacy__modal-section")))
+    def scrape_modal_labels(self, soup):
+        """
+        Scrapes the expanded privacy labels from a page whose privacy details pop up is open.
+        The data is stored in three dictionaries, data_linked, data_not_linked and data_track
 
-        # Now the pop up should be open, so you can get its content
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        
+        Args:
+            soup (BeautifulSoup): The parsed page with the pop up open.
+        """
         try: 
-            
             modal_content_sections = soup.find_all("div", {'class':"app-privacy__modal-section"})
             for header in modal_content_sections:
                 collection_cat = header.find("h2", {'class':"privacy-type__heading"})
@@ -273,10 +442,46 @@ class iOS:
                             
         except AttributeError as e:
             print(f"Failed to scrape expanded label. Unable to find element: {e}")    
+
+    def needs_expanded_labels(self):
+        """
+        Decides from the compact label whether the expanded labels have to be scraped, the step that 
+        may need a browser. An app whose compact label is only "Data Not Collected" or "No Details 
+        Provided" has no expanded labels, so nothing is scraped or started for it.
+
+        Returns:
+            bool: False if the compact label proves the expanded labels are empty.
+        """
+        # an empty compact label proves nothing, e.g. the page could not be parsed
+        return not self.compact_dict or not set(self.compact_dict) <= NO_EXPANDED_LABELS
+
+    def update_collection_categories(self):
+        """
+        Fetches data from the app's expanded privacy section. The embedded page data is used when 
+        available, otherwise the privacy details pop up is opened using Selenium (see fetch_modal_page).
+        The data is stored in three dictionaries, data_linked, data_not_linked and data_track
+
+        No parameters or return values.
+        """
+        if self.scrape_embedded_labels():
+            return
         
-        finally:
-            # Always quit the driver, whether an exception occurred or not
-            driver.quit()           
+        # in replay mode the pop up page source saved by an earlier crawl is parsed instead
+        archive = self.http.archive
+        if archive is not None and archive.replay:
+            record = archive.get(self.url, kind="browser")
+            if record is not None:
+                self.scrape_modal_labels(make_soup(record[1]))
+            return
+        
+        if self.modal_page is None:
+            # the crawler's parser processes have no browser, they report that one is needed instead
+            if not self.use_browser:
+                self.needs_browser = True
+                return
+            self.modal_page = fetch_modal_page(self.url, self.driver_pool, self.service, archive)
+        
+        self.scrape_modal_labels(make_soup(self.modal_page))
                 
                             
     def count_labels(self):
@@ -286,40 +491,11 @@ class iOS:
 
         No parameters or return values.
         """
-        for data_dict in [self.data_linked, self.data_not_linked]:
-            for purpose, categories in data_dict.items():
-                # Update the count for the purpose 
-                self.expanded_count.setdefault(purpose, 0)
-                self.expanded_count[purpose] += 1
-                
-                for category, types in categories.items():
-                    # Update the count for the category word
-                    self.expanded_count.setdefault(f'category_{category}', 0)
-                    self.expanded_count[f'category_{category}'] += 1
-
-                    # Update the count for each type word
-                    for type_word in types:
-                        self.expanded_count.setdefault(f'type_{type_word}', 0)
-                        self.expanded_count[f'type_{type_word}'] += 1
-                        
-        # Process self.data_track separately
-        for category, types in self.data_track.items():
-            # Update the count for the category word
-            self.expanded_count.setdefault(f'category_{category}', 0)
-            self.expanded_count[f'category_{category}'] += 1
-
-            # Update the count for each type word
-            for type_word in types:
-                self.expanded_count.setdefault(f'type_{type_word}', 0)
-                self.expanded_count[f'type_{type_word}'] += 1
-                
-        for collection_cat, category in self.compact_dict.items():
-            self.compact_count.setdefault(collection_cat, 0)
-            self.compact_count[collection_cat] += 1
-            
-            for cat in category:
-                self.compact_count.setdefault(cat, 0)
-                self.compact_count[cat] += 1
+        count_terms(self.to_dict(), self.compact_count, self.expanded_count)
+        
+        # normalized once here instead of on every get_expanded_count and get_compact_count call
+        self.normalized_expanded_count = normalize_counts(self.expanded_count)
+        self.normalized_compact_count = normalize_counts(self.compact_count)
     
     
     def get_expanded_count(self, string, category=False, type=False):
@@ -334,7 +510,7 @@ class iOS:
             tuple: The term it looked for and the count of the term in the expanded privacy labels.
         """
         # Normalize the string to lower case and remove spaces
-        normalized_string = string.lower().replace(" ", "")
+        normalized_string = normalize_term(string)
         
         if category:
             key_prefix = 'category_'
@@ -343,9 +519,6 @@ class iOS:
         else:
             key_prefix = ''
 
-        # Normalize the keys to lower case and remove spaces
-        normalized_dict = {k.lower().replace(" ", ""): v for k, v in self.expanded_count.items()}
-
         # Key for search
         search_key = key_prefix + normalized_string
         
@@ -353,7 +526,7 @@ class iOS:
         return_key = key_prefix + string
 
         # Return the count from the dictionary
-        return (return_key, normalized_dict.get(search_key, 0))
+        return (return_key, self.normalized_expanded_count.get(search_key, 0))
             
     
     def get_compact_count(self, string):
@@ -366,39 +539,436 @@ class iOS:
             int: The count of the term in the compact privacy labels.
 
         """
-        # Normalize the string to lower case and remove spaces
-        normalized_string = string.lower().replace(" ", "")
-        
-        # Normalize the keys to lower case and remove spaces
-        normalized_dict = {k.lower().replace(" ", ""): v for k, v in self.compact_count.items()}
-        
         # Return the count from the dictionary
-        return normalized_dict.get(normalized_string, 0)
+        return self.normalized_compact_count.get(normalize_term(string), 0)
         
                             
-    def write_to_json(self):
+    def to_dict(self):
         """
-        Writes all the scraped and computed data to a JSON file.
+        Collects all the scraped data in the layout of the JSON files.
 
-        No parameters or return values.
+        Returns:
+            dict: The app info, compact label and expanded label dictionaries.
         """
-        directory_path = 'json_files'
-        if not os.path.exists(directory_path):
-            os.makedirs(directory_path)
-
-        all_data = {
+        return {
             "app_info": self.app_info,
             "compact_dict": self.compact_dict,
             "data_linked": self.data_linked,
             "data_not_linked": self.data_not_linked,
             "data_track": self.data_track,
         }
+                            
+    def write_to_json(self):
+        """
+        Writes all the scraped and computed data to a JSON file.
+
+        No parameters or return values.
+        """
+        write_app_json(self.to_dict())
+                            
+
+def normalize_term(term):
+    """
+    Normalizes a label term for lookups, e.g. "Other Purposes" -> "otherpurposes".
+
+    Args:
+        term (str): The term.
+
+    Returns:
+        str: The term in lower case without spaces.
+    """
+    return term.lower().replace(" ", "")
+
+def normalize_counts(counts):
+    """
+    Normalizes the terms of a count dictionary. Terms that only differ in case or spaces are counted together.
+
+    Args:
+        counts (dict): Count of every term, e.g. the expanded_count of count_terms.
+
+    Returns:
+        dict: Count of every normalized term.
+    """
+    normalized = {}
+    for term, count in counts.items():
+        key = normalize_term(term)
+        normalized[key] = normalized.get(key, 0) + count
+    return normalized
+
+def count_terms(all_data, compact_count, expanded_count):
+    """
+    Counts the occurrences of each term in the compact and expanded privacy labels of one app. 
+    Purposes are counted under their name, categories under category_<name> and types under type_<name>.
+
+    Args:
+        all_data (dict): The app's data, as returned by iOS.to_dict.
+        compact_count (dict): Counts of the compact label terms, updated in place.
+        expanded_count (dict): Counts of the expanded label terms, updated in place.
+    """
+    for data_dict in [all_data["data_linked"], all_data["data_not_linked"]]:
+        for purpose, categories in data_dict.items():
+            # Update the count for the purpose 
+            expanded_count.setdefault(purpose, 0)
+            expanded_count[purpose] += 1
+            
+            for category, types in categories.items():
+                # Update the count for the category word
+                expanded_count.setdefault(f'category_{category}', 0)
+                expanded_count[f'category_{category}'] += 1
+
+                # Update the count for each type word
+                for type_word in types:
+                    expanded_count.setdefault(f'type_{type_word}', 0)
+                    expanded_count[f'type_{type_word}'] += 1
+                    
+    # Process data_track separately
+    for category, types in all_data["data_track"].items():
+        # Update the count for the category word
+        expanded_count.setdefault(f'category_{category}', 0)
+        expanded_count[f'category_{category}'] += 1
+
+        # Update the count for each type word
+        for type_word in types:
+            expanded_count.setdefault(f'type_{type_word}', 0)
+            expanded_count[f'type_{type_word}'] += 1
+            
+    for collection_cat, category in all_data["compact_dict"].items():
+        compact_count.setdefault(collection_cat, 0)
+        compact_count[collection_cat] += 1
+        
+        for cat in category:
+            compact_count.setdefault(cat, 0)
+            compact_count[cat] += 1
+
+# writer of the sharded corpus, see configure_corpus, apps are written to one JSON file each while it is None
+corpus_writer = None
+
+def configure_corpus(directory="json_files", **kwargs):
+    """
+    Writes every app to compressed JSONL shards in the given directory instead of one JSON file per app.
+    The last shard is only complete once close_corpus is called.
+
+    Args:
+        directory (str, optional): Directory of the shards. Defaults to "json_files".
+        **kwargs: Arguments passed to common.corpus.ShardedJsonlWriter.
+
+    Returns:
+        common.corpus.ShardedJsonlWriter: The writer.
+    """
+    global corpus_writer
+    corpus_writer = ShardedJsonlWriter(directory, **kwargs)
+    return corpus_writer
+
+def sync_corpus():
+    """
+    Makes the apps written to the corpus so far durable, see common.corpus.ShardedJsonlWriter.sync.
+    Called before crawl state that marks apps as done is committed, so no app is marked done but lost.
+
+    No parameters or return values.
+    """
+    if corpus_writer is not None:
+        corpus_writer.sync()
+
+def close_corpus():
+    """
+    Commits the last shard of the corpus and goes back to writing one JSON file per app.
+
+    No parameters or return values.
+    """
+    global corpus_writer
+    if corpus_writer is not None:
+        corpus_writer.close()
+        corpus_writer = None
+
+def flatten_app(all_data):
+    """
+    Flattens the data of one app for the Parquet export, see common.corpus.export_parquet.
+
+    Args:
+        all_data (dict): The app's data, as returned by iOS.to_dict.
+
+    Returns:
+        tuple: The app info as one row, and one row per data type in the compact and expanded labels.
+    """
+    app_id = all_data["app_info"].get("App ID")
+    labels = []
+    for section, categories in all_data["compact_dict"].items():
+        for category in categories:
+            labels.append({"app_id": app_id, "label": "compact", "section": section, "purpose": None, 
+                           "category": category, "data_type": None})
+    for section, data in [("Data Linked to You", all_data["data_linked"]), 
+                          ("Data Not Linked to You", all_data["data_not_linked"])]:
+        for purpose, categories in data.items():
+            for category, types in categories.items():
+                for data_type in types:
+                    labels.append({"app_id": app_id, "label": "expanded", "section": section, "purpose": purpose, 
+                                   "category": category, "data_type": data_type})
+    for category, types in all_data["data_track"].items():
+        for data_type in types:
+            labels.append({"app_id": app_id, "label": "expanded", "section": "Data Used to Track You", "purpose": None, 
+                           "category": category, "data_type": data_type})
+    return (all_data["app_info"], labels)
+
+def write_app_json(all_data):
+    """
+    Writes the data of one app, as returned by iOS.to_dict, to the corpus shards if configured, 
+    otherwise to a JSON file.
+
+    Args:
+        all_data (dict): The app's data.
+    """
+    if corpus_writer is not None:
+        with crawl_metrics.stage("json_write"):
+            corpus_writer.write(all_data)
+        crawl_metrics.count("apps")
+        return
+    
+    directory_path = 'json_files'
+    if not os.path.exists(directory_path):
+        os.makedirs(directory_path)
 
-        file_path = os.path.join(directory_path, str(self.app_info['App ID']) + '.json')
+    file_path = os.path.join(directory_path, str(all_data['app_info']['App ID']) + '.json')
 
+    with crawl_metrics.stage("json_write"):
         with open(file_path, "w") as file:
             json.dump(all_data, file, indent=4)
-                            
+    crawl_metrics.count("apps")
+
+def fetch_modal_page(url, driver_pool=None, service=None, archive=None):
+    """
+    Opens the app's privacy details pop up using Selenium and returns the page source.
+
+    Args:
+        url (str): URL of the app page.
+        driver_pool (common.driver_pool.DriverPool, optional): Pool to borrow the browser from. Defaults to None.
+        service (selenium.webdriver.chrome.service.Service, optional): Chromedriver service used when there is no pool. Defaults to None.
+        archive (common.archive.PageArchive, optional): Archive the page source is saved to. Defaults to None.
+
+    Returns:
+        str: The page source with the pop up open.
+    """
+    # Set up the WebDriver
+    # borrow a browser from the shared pool, or create a web browser instance for this app only
+    if driver_pool is not None:
+        driver = driver_pool.acquire()
+    else:
+        with crawl_metrics.stage("selenium_startup"):
+            driver = webdriver.Chrome(service=service)
+
+    try: 
+        with crawl_metrics.stage("modal_wait"):
+            page_source = open_modal(driver, url)
+        if archive is not None:
+            archive.store(url, page_source, kind="browser")
+        
+        return page_source
+
+    finally:
+        # Always give back or quit the driver, whether an exception occurred or not
+        if driver_pool is not None:
+            driver_pool.release(driver)
+        else:
+            driver.quit()
+
+def open_modal(driver, url):
+    """
+    Loads the app page in the browser and clicks the button that opens the privacy details pop up.
+
+    Args:
+        driver (selenium.webdriver.Chrome): The browser.
+        url (str): URL of the app page.
+
+    Returns:
+        str: The page source with the pop up open.
+    """
+    # Open the url
+    driver.get(url)
+
+    # Wait for the page to load completely
+    WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, '//button[text()="See Details"]')))
+
+    # Click the button to open the pop up
+    button = driver.find_element(By.XPATH, '//button[text()="See Details"]')
+    
+    try:
+        # button.click()
+        driver.execute_script("arguments[0].click();", button)
+    except Exception as e:
+        print(f"An error occurred when trying to click the button: {e}")
+
+    # Wait for the modal content to load
+    WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CLASS_NAME, "app-privacy__modal-section")))
+
+    # Now the pop up should be open, so you can get its content
+    return driver.page_source
+
+def parse_app_pages(url, pages):
+    """
+    Parses the already fetched pages of an app without any network access or browser, 
+    used by the parser processes of the crawl pipeline.
+
+    Args:
+        url (str): URL of the app page.
+        pages (dict): HTML of the app page under "app", and optionally the page source 
+            with the privacy details pop up open under "modal".
+
+    Returns:
+        tuple: The app's data as returned by iOS.to_dict, and whether the expanded labels 
+            still need to be read with a browser.
+    """
+    app = iOS(url, page=pages["app"], modal_page=pages.get("modal"), use_browser=False)
+    return (app.to_dict(), app.needs_browser)
+
+
+def refresh_app(url, store, driver_pool=None, http_client=None):
+    """
+    Checks an app for changed privacy labels at a fraction of the cost of scraping it again. The app
+    page is requested with the validators of the last check and parsed without a browser. If the 
+    server answers 304 Not Modified, or the compact labels hash the same as last time, the browser 
+    step for the expanded labels and the JSON rewrite are skipped.
+
+    Args:
+        url (str): URL of the app page.
+        store (common.refresh.RefreshStore): Validators and label hashes of earlier checks, the check is recorded in it.
+        driver_pool (common.driver_pool.DriverPool, optional): Browsers for the expanded labels of changed apps. Defaults to None.
+        http_client (common.http.HttpClient, optional): Client for the request. Defaults to the shared client.
+
+    Returns:
+        bool: True if the compact labels changed and the app was saved again.
+    """
+    http = http_client if http_client is not None else get_client()
+    app_key = ios_app_id(url)
+    res = http.get(url, headers={**HEADER, **store.conditional_headers(app_key)})
+    if res.status_code == 304:
+        store.record(app_key, url, changed=False, response=res)
+        return False
+    if res.status_code != requests.codes.ok:
+        raise requests.HTTPError(f"Status code: {res.status_code}", response=res)
+    
+    app = iOS(url, page=res.text, http_client=http, use_browser=False)
+    labels_hash = label_hash(app.compact_dict)
+    stored = store.get(app_key)
+    if stored is not None and stored["label_hash"] == labels_hash:
+        store.record(app_key, url, changed=False, response=res, labels_hash=labels_hash)
+        return False
+    
+    if app.needs_browser:
+        app = iOS(url, driver_pool=driver_pool, page=res.text, http_client=http)
+    app.write_to_json()
+    sync_corpus()
+    store.record(app_key, url, changed=True, response=res, labels_hash=labels_hash)
+    return True
+
+
+# client reading from the page archive, one per re-parse worker process
+replay_client = None
+
+def init_replay_worker(directory, parser=None):
+    """
+    Opens the page archive in replay mode in a re-parse worker process.
+
+    Args:
+        directory (str): Directory of the page archive.
+        parser (str, optional): Parser backend to use in the worker. Defaults to the fastest installed one.
+    """
+    global replay_client
+    if parser is not None:
+        configure_parser(parser)
+    replay_client = HttpClient(archive=PageArchive(directory, replay=True))
+
+def reparse_app(url):
+    """
+    Rebuilds an app's JSON file from the page archive without touching the network.
+
+    Args:
+        url (str): URL of the app page.
+
+    Returns:
+        tuple: The URL and the error message, or None if the app was parsed.
+    """
+    try:
+        app = iOS(url, http_client=replay_client)
+        app.write_to_json()
+        return (url, None)
+    except Exception as e:
+        return (url, str(e))
+
+def test_removed_app_is_not_saved():
+    import pytest
+
+    class RemovedApp:
+        status_code = 404
+        text = ""
+
+    class Client:
+        def get(self, url, headers=None):
+            return RemovedApp()
+
+    class Metadata:
+        # the Lookup API may still answer for an app whose page is gone
+        def get(self, app_id):
+            return {"App Name": "Flashlight", "App Category": "Utilities", "Price": "Free",
+                    "App Rating": 4.5, "No. of Ratings": 12, "Age Rating": "4+"}
+
+    # the app fails, so the crawl puts it on the dead-letter queue instead of saving it without labels
+    with pytest.raises(requests.HTTPError):
+        iOS("https://apps.apple.com/us/app/flashlight/id1012345671", http_client=Client(),
+            use_browser=False, metadata=Metadata())
+
+
+def test_refreshed_app_is_read_once(tmp_path):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import threading
+    from common.corpus import read_corpus
+    from common.refresh import RefreshStore
+
+    def app_page(heading, description):
+        return f"""<html><body>
+<h1 class="product-header__title app-header__title">Flashlight <span class="badge">4+</span></h1>
+<dl><dt>Category</dt><dd>Utilities</dd><dt>Price</dt><dd>Free</dd><dt>Age Rating</dt><dd>4+</dd></dl>
+<div class="app-privacy__card"><h3 class="privacy-type__heading">{heading}</h3>
+<p class="privacy-type__description">{description}</p></div>
+</body></html>"""
+
+    pages = [app_page("Data Not Collected", "The developer does not collect any data from this app.")]
+
+    class AppStub(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = pages[-1].encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AppStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/us/app/flashlight/id1012345671"
+    store = RefreshStore(str(tmp_path / "refresh.db"))
+    try:
+        configure_corpus(str(tmp_path / "corpus"))
+        try:
+            assert refresh_app(url, store, http_client=HttpClient())
+        finally:
+            close_corpus()
+
+        # the developer changed the labels, the refresh saves the app again in a new shard
+        pages.append(app_page("No Details Provided", "The developer will be required to provide privacy details."))
+        configure_corpus(str(tmp_path / "corpus"))
+        try:
+            assert refresh_app(url, store, http_client=HttpClient())
+        finally:
+            close_corpus()
+    finally:
+        store.close()
+        server.shutdown()
+
+    records = list(read_corpus(str(tmp_path / "corpus")))
+    assert len(records) == 1
+    assert list(records[0]["compact_dict"]) == ["No Details Provided"]
+
 
 def main():
     # instagram = iOS("https://apps.apple.com/us/app/instagram/id389801252")
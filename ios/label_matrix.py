@@ -0,0 +1,298 @@
+import os
+import sys
+
+# numpy and scipy are only needed to build a matrix, so the module and its test import without them
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ImportError:
+    np = None
+    sp = None
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.corpus import read_corpus
+from ios import count_terms, normalize_counts, normalize_term
+
+
+class LabelMatrix:
+    def __init__(self, app_ids, app_categories, expanded, expanded_terms, compact, compact_terms):
+        """Privacy label term counts of a whole corpus as two sparse app x term matrices, one for the
+        expanded labels and one for the compact labels. Terms are the keys iOS.count_labels counts,
+        normalized once when the matrix is built, so corpus-wide queries are NumPy and SciPy operations
+        instead of loops over every app's count dictionaries. Use from_corpus to build one.
+
+        Args:
+            app_ids (list): App ID of every row.
+            app_categories (list[str]): App Store category of every row, e.g. "Games".
+            expanded (scipy.sparse.csr_matrix): Counts of the expanded label terms, one row per app.
+            expanded_terms (list[str]): Normalized expanded label term of every column.
+            compact (scipy.sparse.csr_matrix): Counts of the compact label terms, one row per app.
+            compact_terms (list[str]): Normalized compact label term of every column.
+        """
+        self.app_ids = app_ids
+        self.app_rows = {app_id: row for row, app_id in enumerate(app_ids)}
+        self.app_categories = app_categories
+
+        self.expanded = expanded
+        self.expanded_terms = expanded_terms
+        self.expanded_index = {term: column for column, term in enumerate(expanded_terms)}
+        self.compact = compact
+        self.compact_terms = compact_terms
+        self.compact_index = {term: column for column, term in enumerate(compact_terms)}
+
+        # column totals and the number of apps using each term, computed once for every query
+        self.expanded_totals = np.asarray(expanded.sum(axis=0)).ravel()
+        self.expanded_apps = np.diff(expanded.tocsc().indptr)
+        self.compact_totals = np.asarray(compact.sum(axis=0)).ravel()
+        self.compact_apps = np.diff(compact.tocsc().indptr)
+
+    @classmethod
+    def from_corpus(cls, directory="json_files"):
+        """Loads every app of a corpus, JSON files and shards, into a LabelMatrix.
+
+        Args:
+            directory (str, optional): Directory of the corpus. Defaults to "json_files".
+
+        Returns:
+            LabelMatrix: The matrix.
+        """
+        if np is None or sp is None:
+            raise ImportError("LabelMatrix needs numpy and scipy: pip install numpy scipy")
+
+        app_ids = []
+        app_categories = []
+        # normalized term -> column, and the (row, column, count) entries, for the expanded and the compact matrix
+        vocabularies = ({}, {})
+        entries = ([], [], []), ([], [], [])
+
+        for data in read_corpus(directory):
+            row = len(app_ids)
+            app_ids.append(data["app_info"].get("App ID"))
+            app_categories.append(data["app_info"].get("App Category"))
+
+            compact_count = {}
+            expanded_count = {}
+            count_terms(data, compact_count, expanded_count)
+            # normalized the same way as iOS.count_labels, terms that only differ in case or spaces are added up
+            for counts, vocabulary, (rows, columns, values) in zip(
+                    [normalize_counts(expanded_count), normalize_counts(compact_count)], vocabularies, entries):
+                for term, count in counts.items():
+                    rows.append(row)
+                    columns.append(vocabulary.setdefault(term, len(vocabulary)))
+                    values.append(count)
+
+        matrices = []
+        for vocabulary, (rows, columns, values) in zip(vocabularies, entries):
+            # typed explicitly, an empty corpus would give float index arrays
+            matrix = sp.coo_matrix((np.array(values, dtype=np.int32),
+                                    (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64))),
+                                   shape=(len(app_ids), len(vocabulary))).tocsr()
+            matrices.append((matrix, list(vocabulary)))
+
+        (expanded, expanded_terms), (compact, compact_terms) = matrices
+        return cls(app_ids, app_categories, expanded, expanded_terms, compact, compact_terms)
+
+    def expanded_term(self, string, category=False, type=False):
+        """Builds the normalized expanded label term the same way iOS.get_expanded_count does.
+
+        Args:
+            string (str): The term to look for.
+            category (bool, optional): Whether to search for category. Defaults to False.
+            type (bool, optional): Whether to search for type. Defaults to False.
+
+        Returns:
+            str: The normalized term.
+        """
+        if category:
+            return "category_" + normalize_term(string)
+        if type:
+            return "type_" + normalize_term(string)
+        return normalize_term(string)
+
+    def expanded_count(self, string, category=False, type=False):
+        """Counts a term in the expanded labels of every app.
+
+        Args:
+            string (str): The term to look for.
+            category (bool, optional): Whether to search for category. Defaults to False.
+            type (bool, optional): Whether to search for type. Defaults to False.
+
+        Returns:
+            tuple: The total count of the term and the number of apps whose labels contain it.
+        """
+        column = self.expanded_index.get(self.expanded_term(string, category, type))
+        if column is None:
+            return (0, 0)
+        return (int(self.expanded_totals[column]), int(self.expanded_apps[column]))
+
+    def compact_count(self, string):
+        """Counts a term in the compact labels of every app.
+
+        Args:
+            string (str): The term to look for.
+
+        Returns:
+            tuple: The total count of the term and the number of apps whose labels contain it.
+        """
+        column = self.compact_index.get(normalize_term(string))
+        if column is None:
+            return (0, 0)
+        return (int(self.compact_totals[column]), int(self.compact_apps[column]))
+
+    def app_counts(self, app_id):
+        """Returns the expanded label term counts of one app.
+
+        Args:
+            app_id: The app's App ID.
+
+        Returns:
+            dict: Count of every normalized term in the app's expanded labels.
+        """
+        row = self.expanded.getrow(self.app_rows[app_id])
+        return {self.expanded_terms[column]: int(count) for column, count in zip(row.indices, row.data)}
+
+    def cooccurrence(self, terms=None):
+        """Counts how many apps have each pair of expanded label terms.
+
+        Args:
+            terms (list[str], optional): Normalized terms to include, e.g. ["category_location", "type_preciselocation"].
+                Defaults to every term.
+
+        Returns:
+            tuple: The terms, and a sparse terms x terms matrix of the number of apps using both terms.
+        """
+        matrix = self.expanded
+        if terms is None:
+            terms = self.expanded_terms
+        else:
+            matrix = matrix[:, [self.expanded_index[term] for term in terms]]
+        # whether an app uses a term at all, not how often
+        present = (matrix > 0).astype(np.int32)
+        return (terms, (present.T @ present).tocsr())
+
+    def prefix_totals(self, prefix):
+        """Sums the expanded label counts of every term with a prefix over the whole corpus,
+        e.g. "category_" for the totals of every data category.
+
+        Args:
+            prefix (str): Prefix of the normalized terms.
+
+        Returns:
+            dict: Total count of every matching term, largest first.
+        """
+        columns = [column for column, term in enumerate(self.expanded_terms) if term.startswith(prefix)]
+        totals = self.expanded_totals[columns]
+        order = np.argsort(-totals, kind="stable")
+        return {self.expanded_terms[columns[i]]: int(totals[i]) for i in order}
+
+    def by_app_category(self):
+        """Adds up the expanded label counts of the apps in each App Store category.
+
+        Returns:
+            tuple: The App Store categories, and a sparse categories x terms matrix of their summed counts.
+        """
+        categories = sorted({category for category in self.app_categories if category is not None})
+        index = {category: row for row, category in enumerate(categories)}
+        rows = []
+        columns = []
+        for app_row, category in enumerate(self.app_categories):
+            if category is not None:
+                rows.append(index[category])
+                columns.append(app_row)
+        # categories x apps indicator matrix, multiplied with apps x terms
+        membership = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                   shape=(len(categories), len(self.app_ids)))
+        return (categories, membership @ self.expanded)
+
+
+def test_label_matrix_matches_ios_counts(tmp_path):
+    import json
+    import pytest
+
+    pytest.importorskip("numpy")
+    pytest.importorskip("scipy")
+    from ios import iOS
+
+    apps = [
+        {"app_info": {"App ID": 1, "App Category": "Games"},
+         "compact_dict": {"Data Linked to You": ["Contact Info", "Location"], "Data Not Linked to You": ["Usage Data"]},
+         "data_linked": {"Other Purposes": {"Contact Info": ["Email Address", "Name"], "Location": ["Precise Location"]},
+                         "App Functionality": {"Contact Info": ["Email Address"]}},
+         "data_not_linked": {"Analytics": {"Usage Data": ["Product Interaction"]}},
+         "data_track": {"Location": ["Precise Location"]}},
+        # "OtherPurposes" and "Other Purposes" normalize to the same term, which counts both
+        {"app_info": {"App ID": 2, "App Category": "Games"},
+         "compact_dict": {"Data Linked to You": ["Usage Data"], "Data Not Linked to You": ["Usage Data"]},
+         "data_linked": {"OtherPurposes": {"Usage Data": ["Product Interaction"]}},
+         "data_not_linked": {"Other Purposes": {"Usage Data": ["Product Interaction"]}},
+         "data_track": {}},
+        {"app_info": {"App ID": 3, "App Category": "Weather"},
+         "compact_dict": {"Data Not Collected": []},
+         "data_linked": {}, "data_not_linked": {}, "data_track": {}},
+    ]
+    scrapers = []
+    for data in apps:
+        with open(tmp_path / f"{data['app_info']['App ID']}.json", "w") as file:
+            json.dump(data, file)
+        # the scraped dictionaries set directly, without fetching the app page
+        scraper = iOS.__new__(iOS)
+        scraper.compact_count = {}
+        scraper.expanded_count = {}
+        scraper.app_info = data["app_info"]
+        scraper.compact_dict = data["compact_dict"]
+        scraper.data_linked = data["data_linked"]
+        scraper.data_not_linked = data["data_not_linked"]
+        scraper.data_track = data["data_track"]
+        scraper.count_labels()
+        scrapers.append(scraper)
+
+    assert scrapers[1].get_expanded_count("other purposes")[1] == 2
+
+    matrix = LabelMatrix.from_corpus(str(tmp_path))
+    assert sorted(matrix.app_ids) == [1, 2, 3]
+
+    for string, category, type in [("other purposes", False, False), ("Analytics", False, False),
+                                   ("contact info", True, False), ("Location", True, False),
+                                   ("email address", False, True), ("Precise Location", False, True),
+                                   ("Browsing History", False, True)]:
+        counts = [scraper.get_expanded_count(string, category, type)[1] for scraper in scrapers]
+        assert matrix.expanded_count(string, category, type) == (sum(counts), sum(1 for count in counts if count))
+
+    for string in ["Data Not Linked to You", "usage data", "Data Not Collected", "Identifiers"]:
+        counts = [scraper.get_compact_count(string) for scraper in scrapers]
+        assert matrix.compact_count(string) == (sum(counts), sum(1 for count in counts if count))
+
+    for scraper in scrapers:
+        app_counts = matrix.app_counts(scraper.app_info["App ID"])
+        assert app_counts == {term: count for term, count in scraper.normalized_expanded_count.items() if count}
+
+    assert list(matrix.prefix_totals("category_").items()) == [
+        ("category_usagedata", 3), ("category_contactinfo", 2), ("category_location", 2)]
+
+    terms, pairs = matrix.cooccurrence(["otherpurposes", "category_usagedata", "category_location"])
+    assert pairs.toarray().tolist() == [[2, 2, 1], [2, 2, 1], [1, 1, 1]]
+    categories, totals = matrix.by_app_category()
+    assert categories == ["Games", "Weather"]
+    games = totals.toarray()[0]
+    assert games[matrix.expanded_index["otherpurposes"]] == 3
+    assert totals.toarray()[1].sum() == 0
+
+    # an empty corpus gives empty matrices
+    (tmp_path / "empty").mkdir()
+    matrix = LabelMatrix.from_corpus(str(tmp_path / "empty"))
+    assert matrix.expanded.shape == (0, 0) and matrix.compact.shape == (0, 0)
+    assert matrix.expanded_count("other purposes") == (0, 0)
+    assert matrix.prefix_totals("category_") == {}
+
+
+def main():
+    matrix = LabelMatrix.from_corpus("json_files")
+    print(f"{len(matrix.app_ids)} apps, {len(matrix.expanded_terms)} expanded and {len(matrix.compact_terms)} compact terms")
+    print(matrix.expanded_count("other purposes"))
+    print(matrix.expanded_count("contacts", type=True))
+    print(matrix.compact_count("Data Not Collected"))
+    print(matrix.prefix_totals("category_"))
+
+
+if __name__ == "__main__":
+    main()